@@ -1,7 +1,14 @@
 import pandas as pd
 import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 directory = "C:/Users/Nikolas/Desktop/NLOG_Data_clean/NLOG_Data_clean"
+flag_columns = ['isCovid', 'isHoliday', 'isChristmas', 'isWeekday', 'isSummer']
+output_dtypes = {'Value': 'float32', 'isCovid': 'int8', 'isHoliday': 'int8', 'isChristmas': 'int8', 'isWeekday': 'int8', 'isSummer': 'int8'}
+extensions = {'parquet': '.parquet', 'feather': '.feather', 'csv': '.csv'}
 
 def fixData(df):
     df = df[df['Valid'] == True]
@@ -24,9 +31,125 @@ def fixData(df):
     df["Date"] = df.index
     return df
 
-for i, filename in enumerate(os.listdir(directory)):
-    if filename.endswith(".csv"):
-        filepath = os.path.join(directory, filename)
-        df = pd.read_csv(filepath)
-        df = fixData(df)
-        df.to_csv(filepath, index=False)
\ No newline at end of file
+def file_hash(filepath):
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def write_frame(df, filepath, output_format):
+    if output_format == 'parquet':
+        df.to_parquet(filepath, index=False)
+    elif output_format == 'feather':
+        df.to_feather(filepath)
+    else:
+        df.to_csv(filepath, index=False, date_format='%Y-%m-%d %H:%M:%S')
+
+def read_frame(filepath, output_format):
+    if output_format == 'parquet':
+        return pd.read_parquet(filepath)
+    elif output_format == 'feather':
+        return pd.read_feather(filepath)
+    return pd.read_csv(filepath, parse_dates=['Date'], dtype=output_dtypes)
+
+def process_meter(filepath, output_path, output_format, source_hash):
+    df = fixData(pd.read_csv(filepath))
+    df = df.reset_index(drop=True).astype(output_dtypes)
+    write_frame(df, output_path, output_format)
+    return len(df), source_hash or file_hash(filepath)
+
+def load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    if not os.path.isfile(manifest_path):
+        return {'meters': {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def remove_outputs(output_dir, filename, keep_format=None):
+    # a meter's outputs in every format but keep_format, so switching --format leaves one file per meter
+    for output_format, extension in extensions.items():
+        output_path = os.path.join(output_dir, filename[:-4] + extension)
+        if output_format != keep_format and os.path.isfile(output_path):
+            os.remove(output_path)
+
+def pending_meters(input_dir, output_dir, manifest, output_format):
+    # a meter is redone when its output is missing, in another format or its source changed; a new mtime with the same content only refreshes the manifest
+    pending = []
+    for filename in sorted(os.listdir(input_dir)):
+        if not filename.endswith(".csv"):
+            continue
+        filepath = os.path.join(input_dir, filename)
+        stat = os.stat(filepath)
+        entry = manifest['meters'].get(filename)
+        output_path = os.path.join(output_dir, filename[:-4] + extensions[output_format])
+        if entry is not None and entry['format'] == output_format and os.path.isfile(output_path):
+            if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                continue
+            source_hash = file_hash(filepath)
+            if entry['sha256'] == source_hash:
+                entry.update({'mtime': stat.st_mtime, 'size': stat.st_size})
+                continue
+        else:
+            source_hash = None
+        pending.append((filename, filepath, output_path, stat, source_hash))
+    return pending
+
+def concatenate_meters(output_dir, manifest, concat_path):
+    # the concat_data.csv layout used for training: one block of rows per meter, 'index' is the meter id
+    # meters that failed after a --format switch still have their previous output, each is read in its own format
+    frames = []
+    for filename, entry in sorted(manifest['meters'].items(), key=lambda item: item[1]['id']):
+        df = read_frame(os.path.join(output_dir, entry['output']), entry['format'])
+        df.insert(0, 'index', entry['id'])
+        frames.append(df)
+    concat_data = pd.concat(frames, ignore_index=True)
+    concat_data['index'] = concat_data['index'].astype('int32')
+    concat_format = 'csv' if concat_path.endswith('.csv') else 'feather' if concat_path.endswith('.feather') else 'parquet'
+    write_frame(concat_data, concat_path, concat_format)
+    return len(concat_data)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_dir", help='Directory with the raw NLOG csv files', default=directory)
+    parser.add_argument("--output_dir", help='Directory for the cleaned per-meter files and manifest.json', required=True)
+    parser.add_argument("--format", choices=list(extensions), default='parquet')
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--concat", help='Also write all meters to this file (.csv, .parquet or .feather), like concat_data.csv')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = load_manifest(args.output_dir)
+    present = {filename for filename in os.listdir(args.input_dir) if filename.endswith('.csv')}
+    for filename in [filename for filename in manifest['meters'] if filename not in present]:
+        manifest['meters'].pop(filename)
+        remove_outputs(args.output_dir, filename)
+
+    pending = pending_meters(args.input_dir, args.output_dir, manifest, args.format)
+    print(f'{len(pending)} of {len(present)} meters changed')
+    next_id = max([entry['id'] for entry in manifest['meters'].values()], default=-1) + 1
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {filename: pool.submit(process_meter, filepath, output_path, args.format, source_hash) for filename, filepath, output_path, stat, source_hash in pending}
+        for filename, filepath, output_path, stat, source_hash in pending:
+            try:
+                rows, source_hash = futures[filename].result()
+            except Exception as error:
+                print(f'Skipping {filename}: {error}')
+                continue
+            meter_id = manifest['meters'].get(filename, {}).get('id')
+            if meter_id is None:
+                meter_id, next_id = next_id, next_id + 1
+            manifest['meters'][filename] = {'id': meter_id, 'output': os.path.basename(output_path), 'format': args.format, 'rows': rows,
+                                            'mtime': stat.st_mtime, 'size': stat.st_size, 'sha256': source_hash}
+            remove_outputs(args.output_dir, filename, args.format)
+    save_manifest(args.output_dir, manifest)
+
+    if args.concat:
+        rows = concatenate_meters(args.output_dir, manifest, args.concat)
+        print(f'Wrote {rows} rows to {args.concat}')
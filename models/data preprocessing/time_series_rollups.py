@@ -0,0 +1,130 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# the pyramid, finest first; periods are stored as the int32 day number (days since 1970-01-01) of their first day
+levels = ['daily', 'weekly', 'monthly', 'yearly']
+columns = {'period': 'int32', 'sum': 'float64', 'min': 'float32', 'max': 'float32', 'count': 'int32'}
+
+def period_starts(days, level):
+    # days is datetime64[D]; weeks start on Monday, 1970-01-01 was a Thursday
+    if level == 'daily':
+        return days
+    if level == 'weekly':
+        return days - ((days.astype('int64') + 3) % 7).astype('timedelta64[D]')
+    unit = 'M' if level == 'monthly' else 'Y'
+    return days.astype(f'datetime64[{unit}]').astype('datetime64[D]')
+
+def rollup(days, values, level):
+    # days sorted; one row per period with values, sum/min/max in one reduceat pass each
+    periods = period_starts(days, level).astype('int64')
+    if len(periods) == 0:
+        return {column: np.empty(0, dtype=dtype) for column, dtype in columns.items()}
+    starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    return {'period': periods[starts].astype('int32'),
+            'sum': np.add.reduceat(values, starts),
+            'min': np.minimum.reduceat(values, starts).astype('float32'),
+            'max': np.maximum.reduceat(values, starts).astype('float32'),
+            'count': np.diff(np.r_[starts, len(values)]).astype('int32')}
+
+def school_pyramid(filepath):
+    # a time-data csv (date,consumption), any resolution; rows without consumption are left out
+    df = pd.read_csv(filepath, parse_dates=['date']).dropna(subset=['consumption']).sort_values('date', kind='stable')
+    days = df['date'].to_numpy(dtype='datetime64[D]')
+    values = df['consumption'].to_numpy(dtype='float64')
+    return {level: rollup(days, values, level) for level in levels}
+
+def build_rollups(input_dir, output_dir, workers=None):
+    """
+    Writes one directory per level with a memory-mappable .npy file per column, the rows of all schools
+    one after the other in period order, and offsets.npy with where every school's rows start.
+    schools.json lists the school ids in that order.
+    """
+    files = sorted((filename for filename in os.listdir(input_dir) if filename.endswith('.csv')), key=lambda filename: (len(filename), filename))
+    schools = [filename[:-4] for filename in files]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pyramids = list(executor.map(school_pyramid, [os.path.join(input_dir, filename) for filename in files], chunksize=16))
+
+    for level in levels:
+        level_dir = os.path.join(output_dir, level)
+        os.makedirs(level_dir, exist_ok=True)
+        lengths = [len(pyramid[level]['period']) for pyramid in pyramids]
+        np.save(os.path.join(level_dir, 'offsets.npy'), np.r_[0, np.cumsum(lengths)].astype('int64'))
+        for column, dtype in columns.items():
+            data = np.concatenate([pyramid[level][column] for pyramid in pyramids]) if pyramids else np.empty(0)
+            np.save(os.path.join(level_dir, f'{column}.npy'), data.astype(dtype))
+    with open(os.path.join(output_dir, 'schools.json'), 'w') as f:
+        json.dump({'source': os.path.abspath(input_dir), 'schools': schools, 'levels': levels}, f)
+    return len(schools)
+
+class RollupReader:
+    """
+    Range queries over the pyramids of build_rollups. Columns are memory-mapped and a school's rows are
+    found by binary search, so a query reads only the rows it returns, however long the history.
+    """
+    def __init__(self, rollup_dir):
+        with open(os.path.join(rollup_dir, 'schools.json')) as f:
+            self.schools = {str(school): position for position, school in enumerate(json.load(f)['schools'])}
+        self.offsets = {level: np.load(os.path.join(rollup_dir, level, 'offsets.npy')) for level in levels}
+        self.data = {level: {column: np.load(os.path.join(rollup_dir, level, f'{column}.npy'), mmap_mode='r') for column in columns} for level in levels}
+
+    def rows(self, school, start, end, level):
+        position = self.schools[str(school)]
+        first, last = self.offsets[level][position], self.offsets[level][position + 1]
+        periods = self.data[level]['period'][first:last]
+        # periods overlapping [start, end]: a month starting before `start` still covers it
+        low = np.searchsorted(periods, period_starts(np.datetime64(start, 'D'), level).astype('int64'), side='left') if start is not None else 0
+        high = np.searchsorted(periods, np.datetime64(end, 'D').astype('int64'), side='right') if end is not None else len(periods)
+        return first + low, first + high
+
+    def pick_level(self, school, start, end, max_points):
+        # the finest level that returns at most max_points rows, yearly otherwise
+        for level in levels:
+            low, high = self.rows(school, start, end, level)
+            if high - low <= max_points:
+                return level
+        return levels[-1]
+
+    def query(self, school, start=None, end=None, resolution=None, max_points=1000):
+        """
+        Sum, min, max and count of consumption per period between `start` and `end` (inclusive dates,
+        open when None) at `resolution`, or at the finest level with at most `max_points` periods.
+        # Returns
+        `pd.DataFrame` with date (first day of the period), sum, min, max, count; resolution in .attrs
+        """
+        if str(school) not in self.schools:
+            raise KeyError(f'Unknown school {school}')
+        level = resolution or self.pick_level(school, start, end, max_points)
+        low, high = self.rows(school, start, end, level)
+        data = self.data[level]
+        df = pd.DataFrame({'date': np.asarray(data['period'][low:high]).astype('datetime64[D]')})
+        for column in ['sum', 'min', 'max', 'count']:
+            df[column] = np.asarray(data[column][low:high])
+        df.attrs['resolution'] = level
+        return df
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Daily/weekly/monthly/yearly consumption rollups of the visualization time-data csvs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='run after preprocessing, whenever the time-data files change')
+    build_parser.add_argument('--input_dir', default='../../visualization/eidap-workspace/time-data2/')
+    build_parser.add_argument('--output_dir', default='../../visualization/eidap-workspace/rollups2/')
+    build_parser.add_argument('--workers', type=int, help='processes reading the csv files, cpu count when not given')
+    query_parser = subparsers.add_parser('query')
+    query_parser.add_argument('--rollup_dir', default='../../visualization/eidap-workspace/rollups2/')
+    query_parser.add_argument('--school', required=True)
+    query_parser.add_argument('--start')
+    query_parser.add_argument('--end')
+    query_parser.add_argument('--resolution', choices=levels)
+    query_parser.add_argument('--max_points', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        print(f'Built rollups of {build_rollups(args.input_dir, args.output_dir, args.workers)} schools in {args.output_dir}')
+    else:
+        df = RollupReader(args.rollup_dir).query(args.school, args.start, args.end, args.resolution, args.max_points)
+        print(f"{len(df)} {df.attrs['resolution']} periods")
+        print(df.to_csv(index=False), end='')
@@ -0,0 +1,56 @@
+import sys
+sys.path.insert(0,'../')
+import os
+import argparse
+import numpy as np
+from pydash import at
+from src.water_consumption_prediction.utils import read_arguments
+from src.water_consumption_prediction.model.backtest import backtest_series, rolling_cutoffs, run_backtest, save_results
+
+if __name__ == '__main__':
+  init_parser = argparse.ArgumentParser(add_help=False)
+  read_arguments.collect_default_arguments(init_parser)
+  default_arguments_dictionary, curr_dict = read_arguments.create_group_dictionary({}, init_parser)
+  read_arguments.collect_rnn_arguments(init_parser)
+  rnn_arguments_dictionary ,curr_dict = read_arguments.create_group_dictionary(curr_dict, init_parser)
+
+  parser = argparse.ArgumentParser(parents=[init_parser])
+  parser.add_argument("--checkpoints", nargs='+', help='best_model.pt files trained with the same data and RNN arguments', default=['../trained_models/best_model.pt'])
+  parser.add_argument("--model_names", nargs='+', help='one name per checkpoint, the rows of a name already in the results are replaced; the checkpoint file names when not given')
+  parser.add_argument("--num_predictions", type=int, default=7, help='days forecast from every cutoff')
+  parser.add_argument("--cutoffs", nargs='+', help='last observed days of the forecasts, YYYY-MM-DD; --origins days --origin_step apart when not given')
+  parser.add_argument("--origins", type=int, default=12)
+  parser.add_argument("--origin_step", type=int, default=7, help='days between two generated cutoffs')
+  parser.add_argument("--last_cutoff", help='latest generated cutoff, the last day a school can be forecast from when not given')
+  parser.add_argument("--batch_windows", type=int, default=4096, help='forecasts per pool task, bounds the memory of every worker')
+  parser.add_argument("--workers", type=int, help='backtesting processes, cpu count when not given')
+  parser.add_argument("--threads_per_worker", type=int, help='torch threads of every process, cpu count / workers when not given')
+  parser.add_argument("--output", help='parquet table the results are added to, backtest.parquet in logs_dir when not given')
+  args = parser.parse_args()
+
+  data_path, logs_dir = at(default_arguments_dictionary, 'data_dir', 'logs_dir')
+  model_names = args.model_names or [os.path.basename(os.path.dirname(os.path.abspath(path))) + '/' + os.path.splitext(os.path.basename(path))[0] for path in args.checkpoints]
+  if len(model_names) != len(args.checkpoints):
+    parser.error('--model_names needs one name per checkpoint')
+  workers = args.workers or os.cpu_count()
+  threads_per_worker = args.threads_per_worker or max(1, os.cpu_count() // workers)
+
+  series = backtest_series(data_path, default_arguments_dictionary, args.num_predictions)
+  if args.cutoffs:
+    cutoffs = np.array(args.cutoffs, dtype='datetime64[D]')
+  else:
+    _, _, days, _, school_targets = series
+    cutoffs = rolling_cutoffs(days, school_targets, args.origins, args.origin_step, args.last_cutoff)
+  print(f"Cutoffs: {', '.join(str(cutoff) for cutoff in cutoffs)}")
+
+  table = run_backtest(data_path, default_arguments_dictionary, rnn_arguments_dictionary, dict(zip(model_names, args.checkpoints)), cutoffs,
+                       args.num_predictions, args.batch_windows, workers, threads_per_worker, series)
+  output = args.output or os.path.join(logs_dir, 'backtest.parquet')
+  results = save_results(table, output)
+  print(f"{len(table)} rows written to {output}, {results['model'].nunique()} models in the table")
+
+  # the worst schools of every model, by RMSE over all cutoffs and forecast days
+  schools = table[table['level'] == 'school'].assign(squared=lambda rows: rows['rmse'] ** 2 * rows['windows'])
+  worst = schools.groupby(['model', 'school'])[['squared', 'windows']].sum()
+  worst = np.sqrt(worst['squared'] / worst['windows']).rename('rmse').reset_index().sort_values(['model', 'rmse'], ascending=[True, False]).groupby('model').head(5)
+  print(worst.to_string(index=False))
@@ -0,0 +1,51 @@
+import sys
+sys.path.insert(0,'../')
+import argparse
+import os
+import tempfile
+import time
+import torch
+from src.water_consumption_prediction.utils import read_arguments
+from src.water_consumption_prediction.model.create_model import build_rnn
+from src.water_consumption_prediction.model.forecast_engine import ForecastEngine, FEATURES
+from src.water_consumption_prediction.model.batch_forecast import forecast_meters, meter_sources_from_directory
+from src.water_consumption_prediction.dataset.meter_data import read_meter
+from src.water_consumption_prediction.dataset.synthetic_data import synthetic_raw_meter
+
+
+if __name__ == '__main__':
+  init_parser = argparse.ArgumentParser(add_help=False)
+  read_arguments.collect_default_arguments(init_parser)
+  default_arguments_dictionary, curr_dict = read_arguments.create_group_dictionary({}, init_parser)
+  read_arguments.collect_rnn_arguments(init_parser)
+  rnn_arguments_dictionary ,curr_dict = read_arguments.create_group_dictionary(curr_dict, init_parser)
+
+  parser = argparse.ArgumentParser(parents=[init_parser])
+  parser.add_argument("--meters", type=int, default=1500)
+  parser.add_argument("--days", type=int, default=365)
+  parser.add_argument("--num_predictions", type=int, default=90)
+  parser.add_argument("--forecast_batch_size", type=int, default=256)
+  parser.add_argument("--sequential_meters", type=int, default=100, help='meters timed on the one-at-a-time path')
+  args = parser.parse_args()
+
+  device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+  time_steps = default_arguments_dictionary['time_steps']
+  model = build_rnn(len(FEATURES) - 1, 1, time_steps, rnn_arguments_dictionary, device).eval()
+  forecaster = ForecastEngine(model, time_steps, None, None, device)
+
+  with tempfile.TemporaryDirectory() as meter_dir:
+    for meter in range(args.meters):
+      synthetic_raw_meter(args.days, meter).to_csv(os.path.join(meter_dir, f'meter_{meter}.csv'), index=False)
+    meter_sources = meter_sources_from_directory(meter_dir)
+
+    start = time.perf_counter()
+    for meter_name, path in meter_sources[:args.sequential_meters]:
+      forecaster.forecast(read_meter(path)[FEATURES], args.num_predictions)
+    sequential_rate = args.sequential_meters / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    results = list(forecast_meters(forecaster, meter_sources, args.num_predictions, args.forecast_batch_size))
+    batched_rate = len(results) / (time.perf_counter() - start)
+
+  print(f"one meter at a time: {sequential_rate:8.1f} meters/s")
+  print(f"batched ({args.forecast_batch_size:4} meters): {batched_rate:8.1f} meters/s , {len(results)} meters , speedup {batched_rate / sequential_rate:.1f}x")
@@ -0,0 +1,51 @@
+import sys
+sys.path.insert(0,'../')
+import argparse
+import itertools
+import time
+import torch
+from src.water_consumption_prediction.model.create_model import RNN
+
+
+def forward_backward(model, inputs, batch_len, device):
+  model.zero_grad()
+  output = model(inputs, batch_len, device)
+  output.sum().backward()
+  return output.detach(), [parameter.grad.clone() for parameter in model.parameters() if parameter.grad is not None]
+
+
+def time_call(function, repeats):
+  function()                                  # warm-up
+  start = time.perf_counter()
+  for _ in range(repeats):
+    function()
+  return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--batch_size", type=int, default=128)
+  parser.add_argument("--time_steps", type=int, default=6)
+  parser.add_argument("--features", type=int, default=7)
+  parser.add_argument("--hidden_size", type=int, default=64)
+  parser.add_argument("--num_layers", type=int, default=2)
+  parser.add_argument("--repeats", type=int, default=50)
+  args = parser.parse_args()
+
+  device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+  inputs = torch.randn(args.batch_size, args.time_steps, args.features, device=device)
+  batch_len = torch.full((args.batch_size,), args.time_steps, dtype=torch.int32)
+
+  print(f"{'model':5} {'bi':>5} {'attn':>5} {'skip':>5} {'packed ms':>10} {'dense ms':>9} {'speedup':>8}  max rel. diff")
+  for model_type, bidirectional, attention, skip_connections in itertools.product(['LSTM', 'GRU'], [False, True], [False, True], [False, True]):
+    torch.manual_seed(0)
+    model = RNN(args.features, args.hidden_size, args.num_layers, 0.0, bidirectional, 1, args.time_steps, attention, model_type, skip_connections).to(device)
+
+    packed_output, packed_grads = forward_backward(model, inputs, batch_len, device)
+    dense_output, dense_grads = forward_backward(model, inputs, None, device)
+    pairs = [(packed_output, dense_output)] + list(zip(packed_grads, dense_grads))
+    difference = max(((a - b).abs().max() / a.abs().max().clamp(min=1e-12)).item() for a, b in pairs)
+
+    packed_time = time_call(lambda: forward_backward(model, inputs, batch_len, device), args.repeats)
+    dense_time = time_call(lambda: forward_backward(model, inputs, None, device), args.repeats)
+    print(f"{model_type:5} {str(bidirectional):>5} {str(attention):>5} {str(skip_connections):>5} {packed_time * 1000:10.2f} {dense_time * 1000:9.2f} {packed_time / dense_time:7.1f}x  {difference:.1e}")
@@ -0,0 +1,210 @@
+import sys
+sys.path.insert(0,'../')
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import torch
+from src.water_consumption_prediction.utils import read_arguments
+from src.water_consumption_prediction.dataset.synthetic_data import write_synthetic_data, data_paths
+from src.water_consumption_prediction.dataset.load_dataset import get_dataset, create_dataloader, create_timesteps_data, prepare_daily_consumptions
+from src.water_consumption_prediction.dataset import normalization_utilites
+from src.water_consumption_prediction.model.create_model import build_rnn, create_model
+from src.water_consumption_prediction.model.train_model import train
+from src.water_consumption_prediction.model.checkpoint import CheckpointManager, save_checkpoint
+from src.water_consumption_prediction.model.model_registry import ModelRegistry
+from src.water_consumption_prediction.model.forecast_engine import FEATURES
+import flask_api_xgb
+
+
+def timed(function, repeats, warmup=1):
+  # every benchmark reports the median and min wall time of `repeats` calls after `warmup` untimed ones
+  for _ in range(warmup):
+    function()
+  times = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    function()
+    times.append(time.perf_counter() - start)
+  return {'median': float(np.median(times)), 'min': float(np.min(times)), 'repeats': repeats}
+
+
+def quiet(function):
+  # the pipeline prints shapes and frames, keep the benchmark output readable
+  def call():
+    with contextlib.redirect_stdout(io.StringIO()):
+      return function()
+  return call
+
+
+def git_commit():
+  try:
+    return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return 'unknown'
+
+
+def data_benchmarks(paths, default_dict, repeats):
+  results = {}
+  time_steps = default_dict['time_steps']
+  concat_data = pd.read_csv(paths['daily'] + 'concat_data.csv')
+  prepared = quiet(lambda: prepare_daily_consumptions(concat_data.copy(), paths['daily'], True))()
+  results['create_timesteps_data'] = timed(quiet(lambda: create_timesteps_data(prepared.copy(), time_steps, 'daily')), repeats)
+
+  def build_dataset(create_data):
+    normalization_utilites.fitted_scalers.clear()
+    return get_dataset(paths['daily'], dict(default_dict, create_data=create_data))
+  results['get_dataset_build'] = timed(quiet(lambda: build_dataset(True)), repeats)
+  results['get_dataset_cached'] = timed(quiet(lambda: build_dataset(False)), repeats)
+  results['get_dataset_lazy_cached'] = timed(quiet(lambda: get_dataset(paths['daily'], dict(default_dict, create_data=False, lazy_windows=True))), repeats)
+
+  train_data = quiet(lambda: build_dataset(False))()[0]
+  for rescale_method in ['z_score', 'minmax']:
+    results[f'normalization_fit_{rescale_method}'] = timed(lambda: normalization_utilites.fit_scaler(train_data, rescale_method), repeats)
+    scaler = normalization_utilites.fit_scaler(train_data, rescale_method)
+    results[f'normalization_transform_{rescale_method}'] = timed(lambda: scaler.transform(train_data), repeats)
+  return results
+
+
+def rnn_benchmarks(D_in, default_dict, rnn_dictionary, device, repeats):
+  results = {}
+  batch_size, time_steps = default_dict['batch_size'], default_dict['time_steps']
+  inputs = torch.randn(batch_size, time_steps, D_in, device=device)
+  for model_type in ['LSTM', 'GRU']:
+    for bidirectional in [False, True]:
+      model = build_rnn(D_in, 1, time_steps, dict(rnn_dictionary, model_type=model_type, bidirectional=bidirectional), device)
+      name = f"{model_type}{'_bidirectional' if bidirectional else ''}"
+
+      def forward():
+        with torch.no_grad():
+          model(inputs, None, device)
+
+      def forward_backward():
+        model.zero_grad()
+        model(inputs, None, device).sum().backward()
+      results[f'rnn_forward_{name}'] = timed(forward, repeats)
+      results[f'rnn_forward_backward_{name}'] = timed(forward_backward, repeats)
+  return results
+
+
+def train_benchmarks(dataset, default_dict, rnn_dictionary, device, repeats):
+  results = {}
+  X_train, y_train, X_valid, y_valid, _, _ = dataset
+  time_steps, learning_rate, batch_size, loss_type, reduction = [default_dict[name] for name in ['time_steps', 'learning_rate', 'batch_size', 'loss_type', 'reduction']]
+  gradient_clipping = rnn_dictionary['gradient_clipping']
+  with tempfile.TemporaryDirectory() as checkpoint_dir:
+    for mode, fast_options in [('standard', None), ('fast', {'autocast_bf16': False, 'compile': False})]:
+      def one_epoch():
+        model, optimizer, criterion = create_model(X_train.shape[-1], 1, time_steps, learning_rate, loss_type, reduction, rnn_dictionary, device)
+        dataloaders = (create_dataloader(X_train, y_train, batch_size=batch_size, shuffle=True), create_dataloader(X_valid, y_valid, batch_size=batch_size, shuffle=True))
+        checkpoints = CheckpointManager(checkpoint_dir)
+        train(device, model, 1, optimizer, criterion, dataloaders, 1, gradient_clipping, checkpoints, False, fast_options)
+        checkpoints.close()
+      results[f'train_one_epoch_{mode}'] = timed(quiet(one_epoch), repeats)
+  return results
+
+
+def predict_benchmarks(paths, default_dict, rnn_dictionary, device, horizons, repeats):
+  # an untrained model without scalers, the service's feature set has no monthly column
+  results = {}
+  D_in = len(FEATURES) - 1
+  serving_dict = dict(default_dict, normalize_input=False, normalize_target=False)
+  with tempfile.TemporaryDirectory() as model_dir:
+    model = build_rnn(D_in, 1, default_dict['time_steps'], rnn_dictionary, device)
+    save_checkpoint(os.path.join(model_dir, 'best_model.pt'), model.state_dict())
+    flask_api_xgb.model_registry = ModelRegistry(model_dir, D_in, 1, serving_dict, rnn_dictionary, device)
+    quiet(flask_api_xgb.model_registry.load_directory)()
+    client = flask_api_xgb.app.test_client()
+    with open(paths['raw'] + 'meter_0.csv', 'rb') as f:
+      meter_csv = f.read()
+
+    for horizon in horizons:
+      def request():
+        response = client.post('/predict', query_string={'num_predictions': horizon}, data={'file': (io.BytesIO(meter_csv), 'meter_0.csv')})
+        assert response.status_code == 200, response.get_data(as_text=True)
+      results[f'predict_latency_{horizon}'] = timed(quiet(request), repeats)
+  return results
+
+
+def compare(results, baseline_path, tolerance):
+  with open(baseline_path) as f:
+    baseline = json.load(f)
+  print(f"\ncompared with {baseline['commit']} ({baseline_path})")
+  if baseline['settings'] != results['settings']:
+    print('warning: the runs used different settings, the ratios are not comparable')
+  regressions = 0
+  for name, result in results['benchmarks'].items():
+    if name not in baseline['benchmarks']:
+      continue
+    ratio = result['median'] / baseline['benchmarks'][name]['median']
+    regressed = ratio > 1 + tolerance
+    regressions += regressed
+    print(f"{name:42} {ratio:6.2f}x{'  REGRESSION' if regressed else ''}")
+  return regressions
+
+
+if __name__ == '__main__':
+  init_parser = argparse.ArgumentParser(add_help=False)
+  read_arguments.collect_default_arguments(init_parser)
+  default_arguments_dictionary, curr_dict = read_arguments.create_group_dictionary({}, init_parser)
+  read_arguments.collect_rnn_arguments(init_parser)
+  rnn_arguments_dictionary ,curr_dict = read_arguments.create_group_dictionary(curr_dict, init_parser)
+
+  parser = argparse.ArgumentParser(parents=[init_parser])
+  parser.add_argument("--schools", type=int, default=100)
+  parser.add_argument("--days", type=int, default=400)
+  parser.add_argument("--gap_probability", type=float, default=0.02)
+  parser.add_argument("--data_root", help='synthetic data directory, generated in a temporary directory when not given')
+  parser.add_argument("--horizons", default='7,30,90', help='num_predictions timed on /predict')
+  parser.add_argument("--repeats", type=int, default=5)
+  parser.add_argument("--output", help='results file, ../logs/benchmarks/<commit>.json when not given')
+  parser.add_argument("--compare", help='results file of another commit to compare the medians with')
+  parser.add_argument("--tolerance", type=float, default=0.1, help='slowdown ratio above 1 reported as a regression')
+  args = parser.parse_args()
+
+  device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+  default_dict = dict(default_arguments_dictionary, data_type='daily', extra_column=True, normalize_input=True, normalize_target=True, lazy_windows=False)
+  torch.manual_seed(default_dict['random_seed_number'])
+
+  with tempfile.TemporaryDirectory() as temporary_root:
+    paths = data_paths(args.data_root or temporary_root)
+    if not os.path.isfile(paths['daily'] + 'concat_data.csv'):
+      print(f"Writing {args.schools} synthetic schools over {args.days} days to {args.data_root or temporary_root}")
+      write_synthetic_data(args.data_root or temporary_root, args.schools, args.days, raw_meters=1, gap_probability=args.gap_probability)
+
+    benchmarks = data_benchmarks(paths, default_dict, args.repeats)
+    normalization_utilites.fitted_scalers.clear()
+    dataset = quiet(lambda: get_dataset(paths['daily'], dict(default_dict, create_data=False)))()
+    D_in = dataset[0].shape[-1]
+    benchmarks.update(rnn_benchmarks(D_in, default_dict, rnn_arguments_dictionary, device, args.repeats))
+    benchmarks.update(train_benchmarks(dataset, default_dict, rnn_arguments_dictionary, device, args.repeats))
+    benchmarks.update(predict_benchmarks(paths, default_dict, rnn_arguments_dictionary, device, [int(horizon) for horizon in args.horizons.split(',')], args.repeats))
+
+  commit = git_commit()
+  results = {
+    'commit': commit,
+    'created': datetime.datetime.now().isoformat(timespec='seconds'),
+    'settings': {'schools': args.schools, 'days': args.days, 'gap_probability': args.gap_probability, 'repeats': args.repeats,
+                 'time_steps': default_dict['time_steps'], 'batch_size': default_dict['batch_size'], 'rnn': rnn_arguments_dictionary},
+    'environment': {'python': platform.python_version(), 'torch': torch.__version__, 'numpy': np.__version__, 'threads': torch.get_num_threads(), 'device': str(device)},
+    'benchmarks': benchmarks
+  }
+  for name, result in benchmarks.items():
+    print(f"{name:42} median {result['median'] * 1000:10.2f} ms , min {result['min'] * 1000:10.2f} ms")
+
+  output = args.output or f'../logs/benchmarks/{commit}.json'
+  os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+  with open(output, 'w') as f:
+    json.dump(results, f, indent=2)
+  print(f'Results written to {output}')
+
+  if args.compare and compare(results, args.compare, args.tolerance):
+    sys.exit(1)
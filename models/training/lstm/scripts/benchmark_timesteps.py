@@ -0,0 +1,122 @@
+import sys
+sys.path.insert(0,'../')
+import argparse
+import datetime
+import time
+import numpy as np
+import pandas as pd
+from src.water_consumption_prediction.dataset.load_dataset import create_timesteps_data
+
+
+def legacy_create_timesteps_data(input_data, num_timesteps, data_type):
+  # the original row-by-row implementation, kept as the reference for equality and speedup
+  smashed_data = []
+  smashed_data_schools = []
+  target_labels = []
+  smashed_data_targets = []
+
+  if data_type == 'monthly':
+    input_data['Date'] = pd.to_datetime(input_data['Month'], format = "%Y-%m")
+    interval = datetime.timedelta(days=31)
+  elif data_type == 'daily':
+    input_data['Date'] = pd.to_datetime(input_data['Date'], format = "%Y-%m-%d %H:%M:%S")
+    interval = datetime.timedelta(days=1)
+
+  for school_id in input_data.ID.unique():
+    school_smashed = []
+    school_smashed_target = []
+    school_consumption = input_data.loc[input_data['ID'] == school_id]
+    starting_index = school_consumption.index[0]
+    for ind in school_consumption.index:
+      if ind - starting_index - num_timesteps < 0:
+        continue
+      rows = input_data.iloc[ind - num_timesteps : ind]
+      dates = rows.Date.reset_index(drop=True)
+      target_row = input_data.iloc[ind]
+      target_date = target_row.Date
+
+      missing = False
+      for i in range (1, len(dates) - 1):
+        if dates[i] - dates[i - 1] > interval:
+          missing = True
+      if target_date - dates[len(dates) - 1] > interval:
+        missing = True
+      if missing:
+        continue
+
+      if data_type == 'monthly':
+        append_row = rows[['ID', 'Monthly Consumption', 'isCovid', 'isSummer', 'isHalfSummer']].to_numpy()
+        append_target = target_row['Monthly Consumption']
+      if data_type == 'daily':
+        append_row = rows[['ID', 'Value', 'isCovid', 'isHoliday', 'isChristmas', 'isWeekday', 'isSummer', 'Monthly Consumption']].to_numpy()
+        append_target = target_row['Value']
+
+      smashed_data.append(append_row[: , 1 :])
+      school_smashed.append(append_row[:, 1 :])
+      target_labels.append(append_target)
+      school_smashed_target.append(append_target)
+
+    smashed_data_schools.append(school_smashed)
+    smashed_data_targets.append(school_smashed_target)
+
+  return smashed_data, target_labels, smashed_data_schools, smashed_data_targets
+
+
+def synthetic_daily_data(num_schools, num_days, gap_probability, seed):
+  rng = np.random.default_rng(seed)
+  frames = []
+  start = pd.Timestamp('2019-01-01')
+  for school_id in range(num_schools):
+    dates = start + pd.to_timedelta(np.arange(num_days), unit='D')
+    keep = rng.random(num_days) > gap_probability
+    dates = dates[keep]
+    frames.append(pd.DataFrame({
+      'ID': school_id,
+      'Date': dates.strftime('%Y-%m-%d %H:%M:%S'),
+      'Value': rng.gamma(2.0, 3.0, len(dates)),
+      'isCovid': rng.integers(0, 2, len(dates)),
+      'isHoliday': rng.integers(0, 2, len(dates)),
+      'isChristmas': rng.integers(0, 2, len(dates)),
+      'isWeekday': (dates.weekday < 5).astype(int),
+      'isSummer': rng.integers(0, 2, len(dates)),
+      'Monthly Consumption': rng.gamma(2.0, 50.0, len(dates))
+    }))
+  return pd.concat(frames, ignore_index=True)
+
+
+def same_windows(legacy_output, output):
+  legacy_data, legacy_targets, legacy_schools, legacy_school_targets = legacy_output
+  data, targets, schools, school_targets = output
+  if [len(s) for s in legacy_schools] != [len(s) for s in schools]:
+    return False
+  if len(legacy_data) == 0:
+    return len(data) == 0
+  return np.array_equal(np.array(legacy_data, dtype='float32'), np.array(data, dtype='float32')) and \
+    np.array_equal(np.array(legacy_targets, dtype='float32'), np.array(targets, dtype='float32'))
+
+
+def time_call(function, *args):
+  start = time.perf_counter()
+  output = function(*args)
+  return time.perf_counter() - start, output
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--base_schools", type=int, default=150)
+  parser.add_argument("--days", type=int, default=365)
+  parser.add_argument("--time_steps", type=int, default=6)
+  parser.add_argument("--gap_probability", type=float, default=0.02)
+  parser.add_argument("--scales", default='1,10,100')
+  parser.add_argument("--legacy_scales", default='1,10', help='scales at which the row loop is also timed')
+  args = parser.parse_args()
+
+  legacy_scales = [int(scale) for scale in args.legacy_scales.split(',') if scale]
+  for scale in [int(scale) for scale in args.scales.split(',')]:
+    data = synthetic_daily_data(args.base_schools * scale, args.days, args.gap_probability, seed=scale)
+    vectorized_time, output = time_call(create_timesteps_data, data.copy(), args.time_steps, 'daily')
+    line = f"{scale:4}x ({len(data):9} rows): vectorized {vectorized_time:8.2f}s"
+    if scale in legacy_scales:
+      legacy_time, legacy_output = time_call(legacy_create_timesteps_data, data.copy(), args.time_steps, 'daily')
+      line += f" , row loop {legacy_time:8.2f}s , speedup {legacy_time / vectorized_time:7.1f}x , identical {same_windows(legacy_output, output)}"
+    print(line)
@@ -0,0 +1,72 @@
+import sys
+sys.path.insert(0,'../')
+import os
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from pydash import at
+from src.water_consumption_prediction.utils import read_arguments
+from src.water_consumption_prediction.dataset.load_dataset import get_dataset, dataset_sources
+from src.water_consumption_prediction.dataset.window_cache import refresh_stale_sets, load_window_cache, read_manifest
+from src.water_consumption_prediction.dataset.incremental_ingest import ingest_readings
+
+# Checks that ingest_readings leaves the window cache a full rebuild of the appended concat_data.csv gives:
+# the last --held_back rows of every school are taken out of a copy of the data, the cache is built, the rows
+# are ingested back in --chunks appends and every set is compared with a rebuild of the resulting file.
+
+init_parser = argparse.ArgumentParser(add_help=False)
+read_arguments.collect_default_arguments(init_parser)
+default_arguments_dictionary, curr_dict = read_arguments.create_group_dictionary({}, init_parser)
+
+parser = argparse.ArgumentParser(parents=[init_parser])
+parser.add_argument("--held_back", type=int, default=10, help='last rows of every school that are ingested instead of built')
+parser.add_argument("--chunks", type=int, default=2, help='appends the held back rows are split in, by date')
+args = parser.parse_args()
+
+data_path = at(default_arguments_dictionary, 'data_dir')[0]
+# unscaled windows, the check does not write scaler files
+settings = dict(default_arguments_dictionary, normalize_input=False, normalize_target=False, lazy_windows=False)
+
+
+def window_sets(cache_dir):
+  refresh_stale_sets(cache_dir)
+  return {set_name: [np.array(array) for array in load_window_cache(cache_dir, set_name)] for set_name in ['train', 'validation', 'test']}
+
+
+with tempfile.TemporaryDirectory() as work_dir:
+  # the daily data and the monthly table next to it, like data_dir and ../Monthly_data
+  copy_path = os.path.join(work_dir, os.path.basename(os.path.normpath(data_path))) + '/'
+  os.makedirs(copy_path)
+  concat_data = pd.read_csv(data_path + 'concat_data.csv')
+  if os.path.isdir(data_path + '../Monthly_data'):
+    shutil.copytree(data_path + '../Monthly_data', os.path.join(work_dir, 'Monthly_data'))
+
+  held_back = concat_data.groupby('index').tail(args.held_back)
+  concat_data.drop(held_back.index).to_csv(copy_path + 'concat_data.csv', index=False)
+  get_dataset(copy_path, dict(settings, create_data=True))
+
+  days = pd.to_datetime(held_back['Date'])
+  for chunk_number, chunk_days in enumerate(np.array_split(np.sort(days.unique()), args.chunks)):
+    summary = ingest_readings(copy_path, settings, held_back[days.isin(chunk_days)])
+    if summary.get('rebuild'):
+      sys.exit(f'Append {chunk_number + 1} found no appendable window cache')
+  cache_dir = copy_path + dataset_sources(copy_path, settings)[0]
+  ingested = window_sets(cache_dir)
+
+  get_dataset(copy_path, dict(settings, create_data=True))
+  rebuilt = window_sets(cache_dir)
+  if read_manifest(cache_dir)['blocks'] is None:
+    sys.exit('The rebuilt cache cannot be appended to, the schools of concat_data.csv are not contiguous')
+
+mismatches = []
+for set_name in rebuilt:
+  for part, ingested_array, rebuilt_array in zip(['windows', 'targets'], ingested[set_name], rebuilt[set_name]):
+    same = ingested_array.shape == rebuilt_array.shape and np.array_equal(ingested_array, rebuilt_array)
+    print(f'{set_name:10} {part:7} ingested {str(ingested_array.shape):18} rebuilt {str(rebuilt_array.shape):18} {"equal" if same else "DIFFERENT"}')
+    if not same:
+      mismatches.append(f'{set_name} {part}')
+if mismatches:
+  sys.exit(f'Incremental ingest differs from a full rebuild: {", ".join(mismatches)}')
+print(f'{len(held_back)} rows ingested in {args.chunks} appends, every set equals a full rebuild')
@@ -0,0 +1,33 @@
+import sys
+sys.path.insert(0,'../')
+import os
+import time
+import argparse
+import numpy as np
+from src.water_consumption_prediction.clustering.gower_distance import school_features, gower_condensed, cluster_labels
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--categorical", help='categorical_clean.csv with the school metadata', required=True)
+parser.add_argument("--monthly", help='monthly_consumptions.csv', required=True)
+parser.add_argument("--weights", help='comma separated gower weights of diameter, sector, students and consumption', default=f'{50/3},{50/3},{50/3},50')
+parser.add_argument("--categorical_columns", help='comma separated columns compared as categories, by dtype when not given')
+parser.add_argument("--clusters", type=int, help='number of clusters cut from the dendrogram', default=3)
+parser.add_argument("--method", help='scipy linkage method', default='ward')
+parser.add_argument("--distance_file", help='write the condensed distances to this memory-mapped .npy instead of RAM')
+parser.add_argument("--workers", type=int, default=os.cpu_count())
+parser.add_argument("--block_elements", type=int, help='school pairs per block and thread', default=1 << 22)
+parser.add_argument("--output", help='schools with their cluster in the cl column, the input of train_clusters.py', default='clustered_df.csv')
+args = parser.parse_args()
+
+df = school_features(args.categorical, args.monthly)
+cat_features = None if args.categorical_columns is None else [column in args.categorical_columns.split(',') for column in df.columns]
+weights = np.array([float(weight) for weight in args.weights.split(',')])
+print(f'{len(df)} schools')
+
+start = time.perf_counter()
+condensed = gower_condensed(df, weights, cat_features, args.distance_file, args.workers, args.block_elements)
+print(f'Gower distances in {time.perf_counter() - start:.1f}s')
+
+df['cl'] = cluster_labels(condensed, args.clusters, args.method)
+print(df['cl'].value_counts())
+df.to_csv(args.output)
@@ -0,0 +1,77 @@
+import sys
+sys.path.insert(0,'../')
+import os
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from pydash import at
+from src.water_consumption_prediction.utils import read_arguments
+from src.water_consumption_prediction.dataset.load_dataset import get_dataset, dataset_sources
+from src.water_consumption_prediction.dataset.window_cache import load_series_cache
+from src.water_consumption_prediction.dataset.normalization_utilites import rescale_with_factors
+from src.water_consumption_prediction.model.checkpoint import load_checkpoint
+from src.water_consumption_prediction.model.export_model import checkpoint_sizes
+from src.water_consumption_prediction.model.backtest import checkpoint_engine
+from src.water_consumption_prediction.model.evaluate_model import rmse_evaluation, smape_evaluation, horizon_errors
+
+# Recursive (one day per forward pass) against direct (--horizon days per pass) forecasting on the same
+# test windows: every window is followed by the direct model's horizon of observed days, both models run
+# through ForecastEngine.roll with the calendar features of the observed days.
+
+init_parser = argparse.ArgumentParser(add_help=False)
+read_arguments.collect_default_arguments(init_parser)
+default_arguments_dictionary, curr_dict = read_arguments.create_group_dictionary({}, init_parser)
+read_arguments.collect_rnn_arguments(init_parser)
+rnn_arguments_dictionary ,curr_dict = read_arguments.create_group_dictionary(curr_dict, init_parser)
+
+parser = argparse.ArgumentParser(parents=[init_parser])
+parser.add_argument("--recursive_checkpoint", help='best_model.pt of a run with --horizon 1', default='../trained_models/best_model.pt')
+parser.add_argument("--direct_checkpoint", help='best_model.pt of a run with --horizon H, H is read from its output layer', required=True)
+parser.add_argument("--repeats", type=int, default=20, help='timed forecasts of the whole test set and of a single window')
+args = parser.parse_args()
+
+device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+data_path, logs_dir, time_steps = at(default_arguments_dictionary, 'data_dir', 'logs_dir', 'time_steps')
+horizon = checkpoint_sizes(load_checkpoint(args.direct_checkpoint, device)[0])[1]
+settings = dict(default_arguments_dictionary, horizon=horizon, lazy_windows=True)
+get_dataset(data_path, settings)          # builds the window cache of the direct model's horizon when missing
+data_split, _ = dataset_sources(data_path, settings)
+series_values, series_targets, start_sets = load_series_cache(data_path + data_split, ['test'])
+series_values, series_targets = torch.from_numpy(series_values), torch.from_numpy(series_targets)
+
+
+def timed_roll(engine, buffer, repeats):
+  timings = []
+  with torch.no_grad():
+    for _ in range(repeats + 1):
+      working = buffer.clone()              # roll writes the predictions into its buffer
+      start = time.perf_counter()
+      predictions = engine.roll(working, horizon)
+      timings.append(time.perf_counter() - start)
+  return predictions, np.array(timings[1:]) * 1000
+
+
+# the observed days of every window and its forecast horizon, inputs scaled like each model saw them in training
+starts = torch.from_numpy(start_sets['test'])
+rows = series_values[starts[:, None] + torch.arange(time_steps + horizon)].to(device)
+targets = series_targets[starts[:, None] + time_steps + torch.arange(horizon)].to(device)
+
+report = {'time_steps': time_steps, 'horizon': horizon, 'windows': len(starts), 'models': {}}
+for mode, checkpoint_path in [('recursive', args.recursive_checkpoint), ('direct', args.direct_checkpoint)]:
+  engine = checkpoint_engine(checkpoint_path, default_arguments_dictionary, rnn_arguments_dictionary, device)
+  buffer = rescale_with_factors(rows, engine.input_scaler) if engine.input_scaler is not None else rows.clone()
+  predictions, batch_ms = timed_roll(engine, buffer, args.repeats)
+  _, single_ms = timed_roll(engine, buffer[:1], args.repeats)
+  report['models'][mode] = {'checkpoint': checkpoint_path, 'days_per_pass': engine.horizon, 'forward_passes': -(-horizon // engine.horizon),
+                            'rmse': rmse_evaluation(predictions, targets).item(), 'smape': smape_evaluation(predictions, targets).item(),
+                            'per_day': horizon_errors(predictions, targets),
+                            'test_set_ms': batch_ms.mean(), 'single_window_ms': single_ms.mean(), 'single_window_p95_ms': np.percentile(single_ms, 95)}
+
+print(f"{len(starts)} test windows of {time_steps} days, {horizon} day forecasts")
+print(f"{'mode':10} {'passes':>6} {'RMSE':>10} {'SMAPE':>8} {'test set ms':>12} {'1 window ms':>12}")
+for mode, result in report['models'].items():
+  print(f"{mode:10} {result['forward_passes']:6} {result['rmse']:10.4f} {result['smape']:8.4f} {result['test_set_ms']:12.3f} {result['single_window_ms']:12.3f}")
+with open(os.path.join(logs_dir, 'horizon_comparison.json'), 'w') as f:
+  json.dump(report, f, indent=2)
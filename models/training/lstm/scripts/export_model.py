@@ -0,0 +1,65 @@
+import sys
+sys.path.insert(0,'../')
+import os
+import json
+import argparse
+import torch
+from pydash import at
+from src.water_consumption_prediction.utils import read_arguments
+from src.water_consumption_prediction.dataset.load_dataset import get_dataset
+from src.water_consumption_prediction.model.export_model import extensions, load_eager, quantize, export_torchscript, export_onnx, ExportedModel, parity_check, benchmark
+
+init_parser = argparse.ArgumentParser(add_help=False)
+read_arguments.collect_default_arguments(init_parser)
+default_arguments_dictionary, curr_dict = read_arguments.create_group_dictionary({}, init_parser)
+read_arguments.collect_rnn_arguments(init_parser)
+rnn_arguments_dictionary ,curr_dict = read_arguments.create_group_dictionary(curr_dict, init_parser)
+
+parser = argparse.ArgumentParser(parents=[init_parser])
+parser.add_argument("--checkpoint", help='best_model.pt to export, trained with the same data and RNN arguments', default='../trained_models/best_model.pt')
+parser.add_argument("--output_dir", help='exports are written next to the checkpoint when not given')
+parser.add_argument("--formats", nargs='+', choices=sorted(extensions), default=['torchscript'])
+parser.add_argument('--quantize', action='store_true', help='dynamic int8 quantization of the LSTM/GRU cells and the output layer')
+parser.add_argument("--parity_tolerance", type=float, help='largest absolute difference to the eager model on the test windows, 1e-4 or 5e-2 with --quantize when not given')
+parser.add_argument("--benchmark_batch_sizes", type=int, nargs='+', default=[1, 32, 256])
+parser.add_argument("--repeats", type=int, default=50)
+parser.add_argument("--threads", type=int, help='torch and onnxruntime intra-op threads, the library default when not given')
+args = parser.parse_args()
+
+parity_tolerance = args.parity_tolerance or (5e-2 if args.quantize else 1e-4)
+if args.threads:
+  torch.set_num_threads(args.threads)
+data_path, time_steps = at(default_arguments_dictionary, 'data_dir', 'time_steps')
+eager_model, scalers = load_eager(args.checkpoint, time_steps, rnn_arguments_dictionary)
+output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.checkpoint))
+os.makedirs(output_dir, exist_ok=True)
+name = os.path.splitext(os.path.basename(args.checkpoint))[0]
+
+# the test windows, scaled like the model saw them in training
+_, _, _, _, X_test, _ = get_dataset(data_path, default_arguments_dictionary)
+X_test = X_test.to(torch.float32)
+D_in = X_test.shape[-1]
+
+report = {'checkpoint': args.checkpoint, 'quantized': args.quantize, 'exports': [], 'benchmarks': {'eager': benchmark(eager_model, time_steps, D_in, args.benchmark_batch_sizes, args.repeats)}}
+export_model = quantize(eager_model) if args.quantize else eager_model
+for export_format in args.formats:
+  path = os.path.join(output_dir, name + extensions[export_format])
+  if export_format == 'torchscript':
+    export_torchscript(export_model, X_test[:2], path, scalers)
+  else:
+    export_onnx(eager_model, X_test[:2], path, scalers, quantized=args.quantize)
+  exported = ExportedModel(path, args.threads)
+  parity = parity_check(eager_model, exported, X_test)
+  parity.update({'format': export_format, 'path': path, 'size_bytes': os.path.getsize(path), 'passed': parity['max_abs_error'] <= parity_tolerance})
+  report['exports'].append(parity)
+  report['benchmarks'][export_format] = benchmark(exported, time_steps, D_in, args.benchmark_batch_sizes, args.repeats)
+  print(f"{export_format}: {path} , max abs. error {parity['max_abs_error']:.2e} over {parity['windows']} test windows , {'passed' if parity['passed'] else 'FAILED'}")
+
+print(f"{'model':12} {'batch':>6} {'mean ms':>9} {'p95 ms':>9} {'windows/s':>11}")
+for model_name, results in report['benchmarks'].items():
+  for row in results:
+    print(f"{model_name:12} {row['batch_size']:6} {row['mean_ms']:9.3f} {row['p95_ms']:9.3f} {row['windows_per_second']:11.0f}")
+with open(os.path.join(output_dir, f'{name}_export.json'), 'w') as f:
+  json.dump(report, f, indent=2)
+if not all(export['passed'] for export in report['exports']):
+  sys.exit(1)
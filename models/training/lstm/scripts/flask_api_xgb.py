@@ -1,126 +1,164 @@
 import sys
 sys.path.insert(0,'../')
 import argparse
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context, g
 from urllib.parse import urlparse, parse_qs
 import pandas as pd
 import pickle
+import json
+import io
 import numpy as np
 import torch
 import matplotlib.pyplot as plt
-import holidays
 import os
+import time
 from pydash import at
 from src.water_consumption_prediction.utils import read_arguments
-from src.water_consumption_prediction.model.create_model import create_model
-from src.water_consumption_prediction.dataset.normalization_utilites import rescale_data, inverse_normalized_data
+from src.water_consumption_prediction.model.model_registry import ModelRegistry
+from src.water_consumption_prediction.model.forecast_cache import ForecastCache, cached_forecast
+from src.water_consumption_prediction.model.forecast_engine import FEATURES
+from src.water_consumption_prediction.model.batch_forecast import forecast_meters, meter_sources_from_directory
+from src.water_consumption_prediction.dataset.meter_data import read_meter_tail
+from src.water_consumption_prediction.utils import profiling
+from src.water_consumption_prediction.utils.profiling import stage
 
 
 
 app = Flask(__name__)
+forecast_cache = None
 
-def fixData(df):
-    df = df[df['Valid'] == True]
-    df = df.rename(columns={df.columns[0]: 'Date'})
-    df['Date'] = pd.to_datetime(df['Date'])
-    df['Vol'] = df['Net Vol. (m³)'].diff().fillna(df['Net Vol. (m³)'])
-    df = df.iloc[2:]
-    df = df.reset_index()
-    #drop all rows from bottom that Vol = 0
-    vol_nonzero = df['Vol'] != 0
-    if vol_nonzero.any():
-        last_nonzero_index = df.iloc[::-1].loc[vol_nonzero].index[0]
-        df = df.iloc[:last_nonzero_index + 1]
-    df = df[['Date', 'Daily Consumption (m³)', 'isCovid', 'isHoliday', 'isChristmas', 'isWeekday', 'isSummer']]
-    df = df.set_index('Date')
-    for col in ['isCovid', 'isHoliday', 'isChristmas', 'isWeekday', 'isSummer']:
-      df[col] = df[col].astype(int)
-    df = df[df['Daily Consumption (m³)'].notna()]
-    df = df.rename(columns={"Daily Consumption (m³)": "Value"})
-    df["Date"] = df.index
-    return df
-
-def create_features(df):
-    df['Value'] = df['Value'].clip(lower=0)
-    print(df)
-    covid_months = ['2020-03', '2020-04', '2020-05', '2020-11', '2020-12', '2021-02', '2021-03', '2021-04']
-    is_covid_mask = df['Date'].dt.strftime('%Y-%m').isin(covid_months)
-    df['isCovid'] = is_covid_mask
-    df['isChristmas'] = ((df['Date'].dt.month == 12) & ((df['Date'].dt.day >= 24) | (df['Date'].dt.day <= 31))) | ((df['Date'].dt.month == 1) & ((df['Date'].dt.day >= 1) & (df['Date'].dt.day <= 7)))
-    df['isWeekday'] = df['Date'].dt.weekday < 5
-    greek_holidays = holidays.GR(years=df['Date'].dt.year.unique())
-    df['isHoliday'] = df['Date'].dt.date.astype('datetime64[ns]').isin(greek_holidays.keys())
-    df['isSummer'] = ((df['Date'].dt.month == 6) & (df['Date'].dt.day >= 16)) | ((df['Date'].dt.month > 6) & (df['Date'].dt.month < 9)) | ((df['Date'].dt.month == 9) & (df['Date'].dt.day <= 10))
-    for col in ['isCovid', 'isHoliday', 'isChristmas', 'isWeekday', 'isSummer']:
-      df[col] = df[col].astype('float32')
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    # latency per route, /metrics scrapes are not counted
+    if request.url_rule is not None and request.url_rule.rule != '/metrics':
+        labels = {'endpoint': request.url_rule.rule, 'status': str(response.status_code)}
+        request_start = g.request_start
+
+        def record():
+            profiling.observe('request_duration_seconds', time.perf_counter() - request_start, **labels)
+            profiling.count('requests', **labels)
+
+        # a streamed body (/predict_batch) is generated after this hook, its latency ends when the stream is closed
+        if response.is_streamed:
+            response.call_on_close(record)
+        else:
+            record()
+    return response
+
+
+def model_type_default(query_params):
+    # model_type=xgboost picks the booster loaded with --xgboost_model, lstm (the default) the RNN checkpoints
+    model_type = query_params.get('model_type', ['lstm'])[0].lower()
+    return 'xgboost' if model_type == 'xgboost' else None
 
-    print(df)
-    return df
 
 @app.route('/predict', methods=['POST'])
 def predict():
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    time_steps = 7
     file = request.files['file']
-    
-    df = pd.read_csv(file)
-    print(df)
-    df = fixData(df)
-    print(df)
 
-    FEATURES = ['Date', 'Value', 'isCovid', 'isHoliday', 'isChristmas', 'isWeekday', 'isSummer']  #'index'
-    
-    end_date = df.index.max() + pd.DateOffset(days=1)
     parsed_url = urlparse(request.url)
     query_params = parse_qs(parsed_url.query)
     num_predictions = int(query_params.get('num_predictions', [90])[0])
-    prediction_period = pd.date_range(start=end_date, periods=num_predictions, freq='D')
-    df = df[FEATURES] 
-
-    D_in = len(FEATURES) - 1
-    D_out = 1
-
-    time_steps, learning_rate, batch_size, epochs, early_stopping_epochs, loss_type, reduction, gradient_clipping, data_type, target_norm, norm_technique, attention = at(default_arguments_dictionary, 'time_steps', 'learning_rate', 'batch_size', 'epochs', 'early_stopping_epochs', 'loss_type', 'reduction', 'gradient_clipping', 'data_type', 'normalize_target', 'target_normalization', 'attention')
-    rnn_model, optimizer, criterion = create_model(D_in, D_out, time_steps, learning_rate, loss_type, reduction, rnn_arguments_dictionary, device)
-    print(rnn_arguments_dictionary)
-    rnn_model.load_state_dict(torch.load("../trained_models/best_model.pt", map_location=device))
-
-
-    for date in prediction_period:
-        df.loc[date, "Value"] = float('nan')
-        df.loc[date, "Date"] = date
-
-        timesteps_sequence = df.iloc[-time_steps-1 : -1]
-        timesteps_sequence = create_features(timesteps_sequence)
-        timesteps_sequence = timesteps_sequence[FEATURES[1:]]
-        print(timesteps_sequence)
-        X = torch.from_numpy(timesteps_sequence.to_numpy(dtype='float32'))[None, : , :]
-        batch_len = torch.Tensor([elem.shape[-2] for elem in X]).int()
-
-        normalize_input, normalize_target = at(default_arguments_dictionary, 'normalize_input', 'normalize_target')
-        if normalize_input:
-            inp_norm_technique, data_type = at(default_arguments_dictionary, 'input_normalization', 'data_type')
-            X = rescale_data(X, inp_norm_technique, f'{data_type}_{inp_norm_technique}_input_scaler')
-        rnn_model.eval()
-        X = X.to(device)
-        predicted_value = rnn_model(X, batch_len, device=device)
-        if normalize_target:
-            targ_data_technique, data_type = at(default_arguments_dictionary, 'target_normalization', 'data_type')
-            predicted_value = inverse_normalized_data(predicted_value, norm_technique, f'{data_type}_{targ_data_technique}_target_scaler')
-
-        df.loc[date, "Value"] = predicted_value.item()
-        predictions = df['Value'][-num_predictions:]
-
-        print(predicted_value.item())
+    school = query_params.get('school', [None])[0]
+    # an explicit model wins, then model_type=xgboost, otherwise the school's cluster model when --cluster_dir is served
+    model_name = query_params.get('model', [model_type_default(query_params) or model_registry.model_for(school)])[0]
+    model_version = query_params.get('version', [None])[0]
+
+    try:
+        model_entry = model_registry.get(model_name, model_version)
+    except KeyError as error:
+        return jsonify({'error': error.args[0]}), 404
+
+    # only the days the model's windows need are parsed, from the end of the upload
+    with stage('serving.read_meter'):
+        df = read_meter_tail(file, model_entry.forecaster.time_steps)
+    print(df)
+    df = df[FEATURES]
+
+    try:
+        with stage('serving.forecast'):
+            if forecast_cache is not None:
+                prediction_period, predictions = cached_forecast(forecast_cache, model_entry, df, num_predictions)
+            else:
+                prediction_period, predictions = model_entry.forecaster.forecast(df, num_predictions)
+    except ValueError as error:
+        return jsonify({'error': error.args[0]}), 400
+    print(predictions)
         
     # Create response JSON
     response = {
-        'predictions': predictions.tolist()
+        'predictions': predictions.tolist(),
+        'model': model_entry.name,
+        'version': model_entry.version
     }
     
     return jsonify(response)
 
 
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    parsed_url = urlparse(request.url)
+    query_params = parse_qs(parsed_url.query)
+    num_predictions = int(query_params.get('num_predictions', [90])[0])
+    batch_size = int(query_params.get('batch_size', [256])[0])
+    model_name = query_params.get('model', [model_type_default(query_params)])[0]
+    model_version = query_params.get('version', [None])[0]
+    directory = query_params.get('directory', [None])[0]
+
+    if directory is not None:
+        # server-side meters, only from inside --meter_data_root
+        data_root = os.path.realpath(serving_arguments_dictionary['meter_data_root'])
+        meter_dir = os.path.realpath(os.path.join(data_root, directory))
+        if os.path.commonpath([data_root, meter_dir]) != data_root or not os.path.isdir(meter_dir):
+            return jsonify({'error': f'Unknown meter directory {directory}'}), 404
+        meter_sources = meter_sources_from_directory(meter_dir)
+    else:
+        # uploads are closed once the response starts streaming, keep their bytes
+        meter_sources = [(os.path.splitext(file.filename)[0], io.BytesIO(file.read())) for file in request.files.getlist('files')]
+
+    # meters are named after their school id, each group of meters is forecast with its cluster's model
+    groups = {}
+    for meter_name, source in meter_sources:
+        groups.setdefault(model_name or model_registry.model_for(meter_name), []).append((meter_name, source))
+    try:
+        model_entries = {name: model_registry.get(name, model_version) for name in groups}
+    except KeyError as error:
+        return jsonify({'error': error.args[0]}), 404
+
+    def generate():
+        for name, group_sources in groups.items():
+            model_entry = model_entries[name]
+            for result in forecast_meters(model_entry.forecaster, group_sources, num_predictions, batch_size):
+                result.update({'model': model_entry.name, 'version': model_entry.version})
+                yield json.dumps(result) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/models', methods=['GET'])
+def models():
+    return jsonify(model_registry.report())
+
+
+@app.route('/cache', methods=['GET', 'DELETE'])
+def cache():
+    if forecast_cache is None:
+        return jsonify({'error': 'The forecast cache is disabled'}), 404
+    if request.method == 'DELETE':
+        forecast_cache.clear()
+    return jsonify(forecast_cache.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(profiling.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     init_parser = argparse.ArgumentParser(add_help=False)
     read_arguments.collect_default_arguments(init_parser)
@@ -129,7 +167,25 @@ if __name__ == '__main__':
     read_arguments.collect_rnn_arguments(init_parser)
     rnn_arguments_dictionary ,curr_dict = read_arguments.create_group_dictionary(curr_dict, init_parser)
 
+    read_arguments.collect_serving_arguments(init_parser)
+    serving_arguments_dictionary ,curr_dict = read_arguments.create_group_dictionary(curr_dict, init_parser)
+
     parser = argparse.ArgumentParser(parents=[init_parser])
     args = parser.parse_args()
 
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    model_dir, reload_interval, model_format = at(serving_arguments_dictionary, 'model_dir', 'reload_interval', 'model_format')
+    D_in, D_out = len(FEATURES) - 1, 1
+    model_registry = ModelRegistry(model_dir, D_in, D_out, default_arguments_dictionary, rnn_arguments_dictionary, device, model_format=model_format)
+    model_registry.load_directory()
+    if serving_arguments_dictionary['cluster_dir']:
+        model_registry.load_clusters(serving_arguments_dictionary['cluster_dir'])
+    if serving_arguments_dictionary['xgboost_model']:
+        model_registry.load_xgboost(serving_arguments_dictionary['xgboost_model'])
+    if reload_interval > 0:
+        model_registry.start_watcher(reload_interval)
+    cache_bytes, cache_ttl, cache_db = at(serving_arguments_dictionary, 'forecast_cache_bytes', 'forecast_cache_ttl', 'forecast_cache_db')
+    if cache_bytes > 0:
+        forecast_cache = ForecastCache(cache_bytes, cache_ttl, cache_db)
+
     app.run()
\ No newline at end of file
@@ -0,0 +1,18 @@
+import sys
+sys.path.insert(0,'../')
+import argparse
+import pandas as pd
+from pydash import at
+from src.water_consumption_prediction.utils import read_arguments
+from src.water_consumption_prediction.dataset.incremental_ingest import ingest_readings
+
+init_parser = argparse.ArgumentParser(add_help=False)
+read_arguments.collect_default_arguments(init_parser)
+default_arguments_dictionary, curr_dict = read_arguments.create_group_dictionary({}, init_parser)
+
+parser = argparse.ArgumentParser(parents=[init_parser])
+parser.add_argument("--readings", help='csv with the new rows, same columns as concat_data.csv', required=True)
+args = parser.parse_args()
+
+data_path = at(default_arguments_dictionary, 'data_dir')[0]
+ingest_readings(data_path, default_arguments_dictionary, pd.read_csv(args.readings))
@@ -11,7 +11,10 @@ from pydash import at
 from src.water_consumption_prediction.dataset.load_dataset import get_dataset, create_dataloader
 from src.water_consumption_prediction.model.create_model import create_model
 from src.water_consumption_prediction.model.train_model import train, plot_learning_curves
+from src.water_consumption_prediction.model.checkpoint import CheckpointManager
 from src.water_consumption_prediction.model.evaluate_model import evaluation
+from src.water_consumption_prediction.dataset.normalization_utilites import checkpoint_scalers
+from src.water_consumption_prediction.utils.profiling import stage, start_torch_profiler, write_timing_report
 
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
@@ -27,26 +30,41 @@ parser = argparse.ArgumentParser(parents=[init_parser])
 args = parser.parse_args()
 
 
-data_path, logs_dir, random_seed_number = at(default_arguments_dictionary, 'data_dir', 'logs_dir', 'random_seed_number')
+data_path, logs_dir, random_seed_number, checkpoint_dir, resume = at(default_arguments_dictionary, 'data_dir', 'logs_dir', 'random_seed_number', 'checkpoint_dir', 'resume')
 torch.manual_seed(random_seed_number)
 
-X_train, y_train, X_valid, y_valid, X_test, y_test = get_dataset(data_path, default_arguments_dictionary)
+with stage('run.get_dataset'):
+  X_train, y_train, X_valid, y_valid, X_test, y_test = get_dataset(data_path, default_arguments_dictionary)
 
 D_in = X_train.shape[-1]
-D_out = 1
+D_out = y_train.shape[-1]          # 1 for the recursive model, --horizon days for a direct one
 
 time_steps, learning_rate, batch_size, epochs, early_stopping_epochs, loss_type, reduction, gradient_clipping, data_type, target_norm, norm_technique, attention = at(default_arguments_dictionary, 'time_steps', 'learning_rate', 'batch_size', 'epochs', 'early_stopping_epochs', 'loss_type', 'reduction', 'gradient_clipping', 'data_type', 'normalize_target', 'target_normalization', 'attention')
 
-rnn_model, optimizer, criterion = create_model(D_in, D_out, time_steps, learning_rate, loss_type, reduction, rnn_arguments_dictionary, device)
+with stage('run.create_model'):
+  rnn_model, optimizer, criterion = create_model(D_in, D_out, time_steps, learning_rate, loss_type, reduction, rnn_arguments_dictionary, device)
 
-train_dataloader = create_dataloader(X_train, y_train, batch_size=batch_size, shuffle=True)
-valid_dataloader = create_dataloader(X_valid, y_valid, batch_size=batch_size, shuffle=True)
+fast, num_workers, pin_memory, validation_batch_size = at(default_arguments_dictionary, 'fast', 'num_workers', 'pin_memory', 'validation_batch_size')
+if fast:
+  train_dataloader = create_dataloader(X_train, y_train, batch_size=batch_size, shuffle=True, num_workers=num_workers, pin_memory=pin_memory)
+  valid_dataloader = create_dataloader(X_valid, y_valid, batch_size=validation_batch_size or batch_size, shuffle=True, num_workers=num_workers, pin_memory=pin_memory)
+  fast_options = {'autocast_bf16': default_arguments_dictionary['autocast_bf16'], 'compile': default_arguments_dictionary['compile']}
+else:
+  train_dataloader = create_dataloader(X_train, y_train, batch_size=batch_size, shuffle=True)
+  valid_dataloader = create_dataloader(X_valid, y_valid, batch_size=batch_size, shuffle=True)
+  fast_options = None
 
 dataloaders = (train_dataloader, valid_dataloader)
 
-best_model, train_loss, validation_loss, val_raw_output = train(device, rnn_model, epochs, optimizer, criterion, dataloaders, early_stopping_epochs, gradient_clipping)
+checkpoints = CheckpointManager(checkpoint_dir, checkpoint_scalers(default_arguments_dictionary))
+start_torch_profiler(default_arguments_dictionary['torch_profile_batches'], logs_dir)
+with stage('run.train'):
+  best_model, train_loss, validation_loss, val_raw_output = train(device, rnn_model, epochs, optimizer, criterion, dataloaders, early_stopping_epochs, gradient_clipping, checkpoints, resume, fast_options)
+checkpoints.close()
 import os
 print(os.getcwd())
 
 plot_learning_curves(train_loss, validation_loss, logs_dir)
-evaluation(best_model, criterion, X_test, y_test, device, logs_dir, target_norm, norm_technique, data_type)
\ No newline at end of file
+with stage('run.evaluation'):
+  evaluation(best_model, criterion, X_test, y_test, device, logs_dir, target_norm, norm_technique, data_type)
+write_timing_report(logs_dir, 'train')
\ No newline at end of file
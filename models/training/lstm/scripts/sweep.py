@@ -0,0 +1,60 @@
+import sys
+sys.path.insert(0,'../')
+import os
+import json
+import argparse
+from src.water_consumption_prediction.utils import read_arguments
+from src.water_consumption_prediction.dataset.load_dataset import get_dataset
+from src.water_consumption_prediction.dataset.xgboost_features import test_start
+from src.water_consumption_prediction.tuning.sweep import run_sweep, expand_grid, rung_budgets, check_space, xgboost_grid
+from src.water_consumption_prediction.tuning.sweep_store import SweepStore
+from src.water_consumption_prediction.tuning.trials import dataset_settings
+
+if __name__ == '__main__':
+  init_parser = argparse.ArgumentParser(add_help=False)
+  read_arguments.collect_default_arguments(init_parser)
+  default_arguments_dictionary, curr_dict = read_arguments.create_group_dictionary({}, init_parser)
+  read_arguments.collect_rnn_arguments(init_parser)
+  rnn_arguments_dictionary ,curr_dict = read_arguments.create_group_dictionary(curr_dict, init_parser)
+
+  parser = argparse.ArgumentParser(parents=[init_parser])
+  parser.add_argument("--model", choices=['rnn', 'xgboost'], default='rnn')
+  parser.add_argument("--space", help='json file {option: [values, ...]}; xgboost defaults to the notebook grid')
+  parser.add_argument("--study", help='name of the sweep in the store, rerun with the same name to resume', required=True)
+  parser.add_argument("--store", help='SQLite file with the trial results', default='../logs/sweeps.sqlite')
+  parser.add_argument("--sweep_dir", help='per-trial checkpoints of RNN sweeps', default='../trained_models/sweeps/')
+  parser.add_argument("--workers", type=int, default=os.cpu_count())
+  parser.add_argument("--threads_per_trial", type=int, default=1)
+  parser.add_argument("--min_budget", type=int, help='epochs (rnn) or boosting rounds (xgboost) of the first rung')
+  parser.add_argument("--max_budget", type=int, help='epochs (rnn) or boosting rounds (xgboost) of the last rung')
+  parser.add_argument("--eta", type=int, help='keep the best 1/eta trials of every rung', default=3)
+  parser.add_argument("--split_date", help='xgboost: days after this date are the test set', default=test_start)
+  args = parser.parse_args()
+
+  if args.space:
+    with open(args.space) as f:
+      space = json.load(f)
+  elif args.model == 'xgboost':
+    space = xgboost_grid
+  else:
+    parser.error('--space is required for RNN sweeps')
+  check_space(space, args.model, {**default_arguments_dictionary, **rnn_arguments_dictionary})
+
+  if args.model == 'rnn':
+    min_budget, max_budget = args.min_budget or 2, args.max_budget or default_arguments_dictionary['epochs']
+    sweep_dir = os.path.join(args.sweep_dir, args.study)
+    context = (default_arguments_dictionary, rnn_arguments_dictionary, sweep_dir)
+    # build the window caches here once, the pool processes only read them
+    data_space = {name: values for name, values in space.items() if name in dataset_settings}
+    for values in expand_grid(data_space):
+      get_dataset(default_arguments_dictionary['data_dir'], dict(default_arguments_dictionary, **values))
+  else:
+    min_budget, max_budget = args.min_budget or 11, args.max_budget or 100
+    context = (default_arguments_dictionary['data_dir'] + 'concat_data.csv', default_arguments_dictionary['val_ptg'], args.split_date)
+
+  os.makedirs(os.path.dirname(os.path.abspath(args.store)), exist_ok=True)
+  store = SweepStore(args.store)
+  store.open_study(args.study, args.model, space, {'min_budget': min_budget, 'max_budget': max_budget, 'eta': args.eta})
+  budgets = rung_budgets(min_budget, max_budget, args.eta)
+  best, params, rmse = run_sweep(store, args.study, args.model, space, context, budgets, args.eta, args.workers, args.threads_per_trial)
+  print(f'Best trial {best}: validation RMSE {rmse:.5f} with {params}')
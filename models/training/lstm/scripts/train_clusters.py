@@ -0,0 +1,32 @@
+import sys
+sys.path.insert(0,'../')
+import os
+import argparse
+import torch
+from pydash import at
+from src.water_consumption_prediction.utils import read_arguments
+from src.water_consumption_prediction.model.cluster_training import read_cluster_assignment, train_clusters
+
+if __name__ == '__main__':
+  init_parser = argparse.ArgumentParser(add_help=False)
+  read_arguments.collect_default_arguments(init_parser)
+  default_arguments_dictionary, curr_dict = read_arguments.create_group_dictionary({}, init_parser)
+  read_arguments.collect_rnn_arguments(init_parser)
+  rnn_arguments_dictionary ,curr_dict = read_arguments.create_group_dictionary(curr_dict, init_parser)
+
+  parser = argparse.ArgumentParser(parents=[init_parser])
+  parser.add_argument("--clusters", help='csv with the school id in the first column and its cluster, like clustered_df.csv of the gower clustering notebook', required=True)
+  parser.add_argument("--cluster_column", default='cl')
+  parser.add_argument("--cluster_dir", help='one subdirectory per cluster and clusters.json for the service', default='../trained_models/clusters/')
+  parser.add_argument("--workers", type=int, help='clusters trained at the same time, all of them when not given')
+  parser.add_argument("--threads_per_worker", type=int, help='torch threads of every training process, cpu count / workers when not given')
+  args = parser.parse_args()
+
+  data_path, random_seed_number = at(default_arguments_dictionary, 'data_dir', 'random_seed_number')
+  torch.manual_seed(random_seed_number)
+
+  assignment = read_cluster_assignment(args.clusters, args.cluster_column)
+  workers = args.workers or len(set(assignment.values()))
+  threads_per_worker = args.threads_per_worker or max(1, os.cpu_count() // workers)
+  os.makedirs(args.cluster_dir, exist_ok=True)
+  train_clusters(data_path, default_arguments_dictionary, rnn_arguments_dictionary, assignment, args.cluster_dir, workers, threads_per_worker)
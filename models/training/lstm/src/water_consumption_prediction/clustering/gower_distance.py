@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from scipy.cluster.hierarchy import linkage, fcluster
+
+
+def condensed_length(n):
+  return n * (n - 1) // 2
+
+
+def condensed_start(i, n):
+  # position of the pair (i, i + 1) in SciPy's condensed vector, row i's pairs follow it contiguously
+  return n * i - i * (i + 1) // 2
+
+
+def encode_features(df, weights, cat_features=None):
+  """
+  Splits `df` into float32 numeric columns pre-divided by their range and integer codes for the
+  categorical ones, the per-column terms of gower.gower_matrix. Non-numeric dtypes are categorical
+  unless `cat_features` says otherwise.
+  """
+  if cat_features is None:
+    cat_features = [not pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes]
+  cat_features = np.asarray(cat_features, dtype=bool)
+  weights = np.ones(df.shape[1]) if weights is None else np.asarray(weights, dtype='float64')
+
+  numeric = df.loc[:, ~cat_features].to_numpy(dtype='float32')
+  maxima, minima = np.nanmax(numeric, axis=0), np.nanmin(numeric, axis=0)
+  ranges = np.abs(maxima - minima)
+  # gower scales by |1 - min / max| after dividing by max, which is 0 for constant or all-zero columns
+  scales = np.divide(1.0, ranges, out=np.zeros_like(ranges), where=(ranges != 0) & (maxima != 0))
+  numeric = numeric * scales
+
+  codes = np.stack([pd.factorize(df[column])[0] for column in df.columns[cat_features]], axis=1) if cat_features.any() else np.empty((len(df), 0), dtype='int64')
+  return numeric, (weights[~cat_features] / weights.sum()).astype('float32'), codes, (weights[cat_features] / weights.sum()).astype('float32')
+
+
+def row_blocks(n, block_elements):
+  # rows grouped so every block holds about `block_elements` pairs; later rows have fewer pairs so their blocks are taller
+  blocks, start, pairs = [], 0, 0
+  for i in range(n - 1):
+    pairs += n - i - 1
+    if pairs >= block_elements:
+      blocks.append((start, i + 1))
+      start, pairs = i + 1, 0
+  if start < n - 1:
+    blocks.append((start, n - 1))
+  return blocks
+
+
+def fill_block(out, n, start, end, numeric, numeric_weights, codes, code_weights):
+  # distances of rows start..end-1 against rows start..n-1, accumulated one feature at a time in float32
+  block = np.zeros((end - start, n - start), dtype='float32')
+  term = np.empty_like(block)
+  for k in range(numeric.shape[1]):
+    np.subtract(numeric[start:end, k, None], numeric[None, start:, k], out=term)
+    np.abs(term, out=term)
+    term *= numeric_weights[k]
+    block += term
+  for k in range(codes.shape[1]):
+    np.not_equal(codes[start:end, k, None], codes[None, start:, k], out=term)
+    term *= code_weights[k]
+    block += term
+  for i in range(start, end):
+    out[condensed_start(i, n) : condensed_start(i + 1, n)] = block[i - start, i - start + 1:]
+
+
+def gower_condensed(df, weights=None, cat_features=None, out_path=None, workers=None, block_elements=1 << 22):
+  """
+  Weighted Gower distances of the rows of `df`, the values of gower.gower_matrix in float32, written
+  straight into the condensed vector `linkage` takes. Blocks of about `block_elements` pairs are computed
+  on `workers` threads, so memory stays at the output plus one block per thread.
+  # Parameters
+  out_path : `str`, optional
+      Write the condensed vector to this .npy file through a memory map instead of keeping it in memory.
+  """
+  n = len(df)
+  numeric, numeric_weights, codes, code_weights = encode_features(df, weights, cat_features)
+  if out_path is None:
+    out = np.empty(condensed_length(n), dtype='float32')
+  else:
+    out = np.lib.format.open_memmap(out_path, mode='w+', dtype='float32', shape=(condensed_length(n),))
+
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    futures = [pool.submit(fill_block, out, n, start, end, numeric, numeric_weights, codes, code_weights) for start, end in row_blocks(n, block_elements)]
+    for future in futures:
+      future.result()
+  if out_path is not None:
+    out.flush()
+  return out
+
+
+def cluster_labels(condensed, num_clusters, method='ward'):
+  # linkage works in float64, it makes its own copy of the condensed vector
+  return fcluster(linkage(condensed, method=method), num_clusters, criterion='maxclust')
+
+
+def school_features(categorical_path, monthly_path):
+  # the clustering notebook's table: diameter, sector, students and mean monthly consumption per school
+  categorical = pd.read_csv(categorical_path, sep=';')
+  categorical['ΜΑΘΗΤΕΣ'] = categorical['ΑΡΙΘΜΟΣ_ΑΓΟΡΙΩΝ'] + categorical['ΑΡΙΘΜΟΣ_ΚΟΡΙΤΣΙΩΝ']
+  categorical = categorical[['ΑΑ', 'ΔΙΑΜΕΤΡΟΣ', 'ΤΟΜΕΑΣ', 'ΜΑΘΗΤΕΣ']].dropna()
+  consumption = pd.read_csv(monthly_path).groupby('ID')['Monthly Consumption'].mean().reset_index()
+  df = pd.merge(categorical, consumption, left_on='ΑΑ', right_on='ID', how='inner').set_index('ΑΑ').drop(['ID'], axis=1)
+  return df.dropna().drop_duplicates()
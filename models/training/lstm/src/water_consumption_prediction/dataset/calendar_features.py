@@ -0,0 +1,76 @@
+import os
+import numpy as np
+import pandas as pd
+import holidays
+
+# the flags of the Metadata-NLOG preprocessing notebook; isChristmas covers all of December like the notebook's
+daily_flags = ['isCovid', 'isHoliday', 'isChristmas', 'isWeekday', 'isSummer']
+calendar_columns = daily_flags + ['isHalfSummer']
+covid_months = pd.PeriodIndex(['2020-03', '2020-04', '2020-05', '2020-11', '2020-12', '2021-02', '2021-03', '2021-04'], freq='M')
+calendar = None                 # the shared table, whole years, rebuilt larger when a date outside it is looked up
+monthly_means = {}              # monthly_consumptions.csv -> (mtime, mean consumption of all schools per month)
+
+
+def build_calendar(first_year, last_year):
+  """
+  One row per day of `first_year` .. `last_year` with every calendar flag as float32, computed once for
+  the whole range instead of for every frame. isHalfSummer marks June and September, the months isSummer
+  only partly covers.
+  """
+  days = pd.date_range(f'{first_year}-01-01', f'{last_year}-12-31', freq='D')
+  month, day = days.month, days.day
+  greek_holidays = holidays.GR(years=range(first_year, last_year + 1))
+  table = pd.DataFrame(index=days)
+  table['isCovid'] = days.to_period('M').isin(covid_months)
+  table['isHoliday'] = days.isin(pd.DatetimeIndex(list(greek_holidays.keys())))
+  table['isChristmas'] = (month == 12) | ((month == 1) & (day <= 7))
+  table['isWeekday'] = days.weekday < 5
+  table['isSummer'] = ((month == 6) & (day >= 16)) | ((month > 6) & (month < 9)) | ((month == 9) & (day <= 10))
+  table['isHalfSummer'] = (month == 6) | (month == 9)
+  return table.astype('float32')
+
+
+def calendar_table(first_year, last_year):
+  global calendar
+  if calendar is None or first_year < calendar.index[0].year or last_year > calendar.index[-1].year:
+    if calendar is not None:
+      first_year, last_year = min(first_year, calendar.index[0].year), max(last_year, calendar.index[-1].year)
+    calendar = build_calendar(first_year, last_year)
+  return calendar
+
+
+def day_positions(dates, table):
+  days = pd.DatetimeIndex(dates).normalize()
+  return (days - table.index[0]).days.to_numpy()
+
+
+def calendar_lookup(dates, columns=daily_flags):
+  # (len(dates), len(columns)) float32 flags, one take per column from the shared table
+  dates = pd.DatetimeIndex(dates)
+  if len(dates) == 0:
+    return np.empty((0, len(columns)), dtype='float32')
+  table = calendar_table(dates.min().year, dates.max().year)
+  return table[columns].to_numpy()[day_positions(dates, table)]
+
+
+def previous_month_mean(dates, monthly_path):
+  """
+  The mean monthly consumption of all schools in the month before each date, NaN where monthly data is
+  missing. monthly_consumptions.csv is read and averaged once per file version.
+  """
+  mtime = os.path.getmtime(monthly_path)
+  if monthly_path not in monthly_means or monthly_means[monthly_path][0] != mtime:
+    means = pd.read_csv(monthly_path).groupby('Month')['Monthly Consumption'].mean()
+    means.index = pd.to_datetime(means.index, format='%Y-%m').to_period('M')
+    monthly_means[monthly_path] = (mtime, means)
+  means = monthly_means[monthly_path][1]
+  previous_months = pd.DatetimeIndex(dates).to_period('M') - 1
+  return means.reindex(previous_months).to_numpy()
+
+
+def create_features(df):
+  df['Value'] = df['Value'].clip(lower=0)
+  flags = calendar_lookup(df['Date'])
+  for position, column in enumerate(daily_flags):
+    df[column] = flags[:, position]
+  return df
@@ -0,0 +1,137 @@
+import os
+import numpy as np
+import pandas as pd
+from pydash import at
+from src.water_consumption_prediction.dataset.load_dataset import dataset_sources, prepare_daily_consumptions, window_starts
+from src.water_consumption_prediction.dataset.sliding_windows import parse_dates, gap_flags, valid_target_positions, feature_columns, target_columns
+from src.water_consumption_prediction.dataset.window_cache import cache_key, is_valid_cache, read_manifest, write_manifest, load_blocks, save_blocks, map_series, map_raw, append_raw, grow_series, block_capacity, window_files
+
+
+def append_readings(concat_path, new_readings):
+  # concat_data.csv stays the full history; the new rows go to its end, prepare_daily_consumptions groups them with their school
+  columns = pd.read_csv(concat_path, nrows=0).columns
+  with open(concat_path, 'rb') as f:
+    f.seek(-1, os.SEEK_END)
+    ends_with_newline = f.read(1) == b'\n'
+  with open(concat_path, 'a', newline='') as f:
+    if not ends_with_newline:
+      f.write('\n')
+    new_readings[columns].to_csv(f, header=False, index=False)
+
+
+def add_schools(blocks, school_ids):
+  blocks['ids'] = np.concatenate((blocks['ids'], np.asarray(school_ids, dtype=blocks['ids'].dtype)))
+  for name in ['offsets', 'lengths', 'capacities']:
+    blocks[name] = np.concatenate((blocks[name], np.zeros(len(school_ids), dtype='int64')))
+
+
+def move_full_blocks(cache_dir, manifest, blocks, schools, counts):
+  # a school whose spare rows run out is copied to a new, larger block at the end of the series
+  needed = blocks['lengths'][schools] + counts
+  full = needed > blocks['capacities'][schools]
+  moved, capacities = schools[full], block_capacity(needed[full])
+  if len(moved) == 0:
+    return 0
+  new_offsets = manifest['series']['rows'] + np.concatenate(([0], np.cumsum(capacities)[:-1]))
+  grow_series(cache_dir, manifest, int(capacities.sum()))
+  series = map_series(cache_dir, manifest, mode='r+')
+  for school, offset in zip(moved, new_offsets):
+    old_offset, length = blocks['offsets'][school], blocks['lengths'][school]
+    for array in series:
+      array[offset : offset + length] = array[old_offset : old_offset + length]
+  for array in series:
+    array.flush()
+  blocks['offsets'][moved], blocks['capacities'][moved] = new_offsets, capacities
+  return len(moved)
+
+
+def ingest_readings(path_to_data, default_dict, new_readings):
+  """
+  Appends new daily readings, rows in the concat_data.csv layout, to concat_data.csv and to the window cache.
+  Only the new rows and the last `time_steps` rows of their schools are read to find the new windows. The
+  window starts of every set are then split again with create_validation_test, so each set holds the windows
+  a full rebuild would put in it.
+  # Parameters
+  new_readings : `pd.DataFrame`
+      The new rows of each school, in date order and not older than the rows already stored for it.
+  """
+  data_type, number_timesteps, horizon, val_ptg, test_ptg = at(default_dict, 'data_type', 'time_steps', 'horizon', 'val_ptg', 'test_ptg')
+  horizon = horizon or 1
+  if data_type != 'daily':
+    raise ValueError('Only daily readings can be appended to the window cache')
+  data_split, source_files = dataset_sources(path_to_data, default_dict)
+  cache_dir = path_to_data + data_split
+  key, _, _ = cache_key(default_dict, source_files)
+  manifest = read_manifest(cache_dir)
+  appendable = is_valid_cache(cache_dir, key) and manifest['blocks'] is not None
+
+  new_rows = prepare_daily_consumptions(new_readings.copy(), path_to_data, default_dict['extra_column'])
+  interval = parse_dates(new_rows, data_type)
+  if not appendable:
+    append_readings(path_to_data + 'concat_data.csv', new_readings)
+    print(f'No appendable window cache in {cache_dir}, the next get_dataset call rebuilds it')
+    return {'rows': len(new_rows), 'rebuild': True}
+
+  blocks = load_blocks(cache_dir)
+  codes = pd.Index(blocks['ids']).get_indexer(new_rows['ID'])
+  new_schools = pd.unique(new_rows['ID'].to_numpy()[codes < 0])
+  if len(new_schools):
+    add_schools(blocks, new_schools)
+    codes = pd.Index(blocks['ids']).get_indexer(new_rows['ID'])
+  order = np.argsort(codes, kind='stable')
+  schools, first_rows, counts = np.unique(codes[order], return_index=True, return_counts=True)
+  values = new_rows[feature_columns[data_type]].to_numpy(dtype='float32')[order]
+  targets = new_rows[target_columns[data_type]].to_numpy(dtype='float32')[order]
+  dates = new_rows['Date'].to_numpy(dtype='datetime64[ns]').view('int64')[order]
+
+  _, _, series_dates = map_series(cache_dir, manifest)
+  for school, first, count in zip(schools, first_rows, counts):
+    school_dates = dates[first : first + count]
+    offset, length = blocks['offsets'][school], blocks['lengths'][school]
+    if np.any(np.diff(school_dates) < 0) or (length and school_dates[0] < series_dates[offset + length - 1]):
+      raise ValueError(f'Readings of school {blocks["ids"][school]} are not in date order after its stored rows')
+
+  # concat_data.csv changes first, so a failure past this point leaves a manifest key that forces a rebuild
+  append_readings(path_to_data + 'concat_data.csv', new_readings)
+  moved = move_full_blocks(cache_dir, manifest, blocks, schools, counts)
+
+  series_values, series_targets, series_dates = map_series(cache_dir, manifest, mode='r+')
+  window_school, window_target = [], []
+  for school, first, count in zip(schools, first_rows, counts):
+    offset, length = blocks['offsets'][school], blocks['lengths'][school]
+    rows = slice(offset + length, offset + length + count)
+    series_values[rows], series_targets[rows], series_dates[rows] = values[first : first + count], targets[first : first + count], dates[first : first + count]
+
+    # the new windows are those whose last target day is new; they reach back at most time_steps + horizon - 1 stored rows
+    context = max(length - number_timesteps - horizon + 1, 0)
+    gaps = gap_flags(pd.Series(series_dates[offset + context : offset + length + count].view('datetime64[ns]')), interval)
+    first_target = max(length - horizon + 1, 0) - context
+    school_targets = valid_target_positions(np.arange(first_target, len(gaps)), gaps, number_timesteps, school_start=-context, horizon=horizon) + context
+    window_school.append(np.full(len(school_targets), school, dtype='int32'))
+    window_target.append(school_targets)
+    blocks['lengths'][school] = length + count
+  for array in (series_values, series_targets, series_dates):
+    array.flush()
+  del series_values, series_targets, series_dates
+
+  new_windows = [np.concatenate(window_school + [np.zeros(0, 'int32')]), np.concatenate(window_target + [np.zeros(0, 'int64')]).astype('int64')]
+  for (file_name, dtype), array in zip(window_files.items(), new_windows):
+    append_raw(os.path.join(cache_dir, file_name), array, dtype)
+  manifest['blocks']['windows'] += len(new_windows[0])
+  save_blocks(cache_dir, blocks)
+
+  # only integer window starts are split again, the stacked windows are gathered by refresh_stale_sets
+  num_windows = manifest['blocks']['windows']
+  all_schools, all_targets = [map_raw(os.path.join(cache_dir, file_name), dtype, (num_windows,)) for file_name, dtype in window_files.items()]
+  order = np.argsort(all_schools, kind='stable')
+  bounds = np.cumsum(np.bincount(all_schools, minlength=len(blocks['ids'])))[:-1]
+  per_school_targets = np.split(blocks['offsets'][all_schools[order]] + all_targets[order], bounds)
+  for set_name, starts in window_starts(per_school_targets, number_timesteps, val_ptg, test_ptg).items():
+    np.save(os.path.join(cache_dir, f'{set_name}_starts.npy'), starts)
+    manifest['sets'][set_name].update({'samples': len(starts), 'stale': True})
+
+  manifest['key'], manifest['settings'], manifest['sources'] = cache_key(default_dict, source_files)
+  write_manifest(cache_dir, manifest)
+  summary = {'rows': len(new_rows), 'schools': len(schools), 'new_schools': len(new_schools), 'windows': len(new_windows[0]), 'moved_blocks': moved}
+  print(f'Appended {summary["rows"]} rows of {summary["schools"]} schools ({summary["new_schools"]} new), {summary["windows"]} new windows, {moved} blocks moved')
+  return summary
@@ -5,98 +5,31 @@ from tqdm import tqdm
 import datetime
 import numpy as np
 import torch
-import pickle
 from torch.utils.data import DataLoader, TensorDataset
 from src.water_consumption_prediction.dataset.normalization_utilites import rescale_data
+from src.water_consumption_prediction.dataset.calendar_features import daily_flags, calendar_lookup, previous_month_mean
+from src.water_consumption_prediction.dataset.sliding_windows import build_windows, window_view, horizon_targets, feature_columns, school_row_positions, group_by_school
+from src.water_consumption_prediction.dataset.window_cache import cache_key, is_valid_cache, save_window_cache, load_window_cache, load_series_cache, school_blocks, refresh_stale_sets
+from src.water_consumption_prediction.dataset.windowed_dataset import WindowedDataset, collate_windows, window_coverage, target_coverage
+from src.water_consumption_prediction.utils.profiling import stage
+
+def create_timesteps_data(input_data, num_timesteps, data_type, horizon=1):
+  values, targets, school_ids, school_targets = build_windows(input_data, num_timesteps, data_type, horizon)
+  print(input_data)
+  return school_windows(values, targets, school_targets, num_timesteps, horizon)
+
 
-def save_to_pkl(input_data, target_data, dir_to_save, set_name):
-  with open(dir_to_save + f'{set_name}_input_data.pkl','wb') as f: pickle.dump(input_data, f)
-  with open(dir_to_save + f'{set_name}_target_data.pkl','wb') as f: pickle.dump(target_data, f)
-
-def load_pkl(dir_to_load, set_name):
-    with open(dir_to_load + f'{set_name}_input_data.pkl','rb') as f: input_data = pickle.load(f)
-    with open(dir_to_load + f'{set_name}_target_data.pkl','rb') as f: target_data = pickle.load(f)
-    return input_data, target_data
-
-
-def replace_month(x):
-  if x.month == 1:
-    x = x.replace(month=12)
-    return x.replace(year=x.year-1)
-
-  else:
-    return x.replace(month=x.month-1)
-  
-  
-def add_extra_feature(daily_consumptions, monthly_consumptions):
-  monthly_consumptions['Month'] = pd.to_datetime(monthly_consumptions['Month'], format="%Y-%m")
-  daily_consumptions['Date'] = pd.to_datetime(daily_consumptions['Date'], format="%Y-%m")
-  print(daily_consumptions)
-  daily_consumptions['concat_date'] = daily_consumptions['Date'].apply(replace_month)
-  daily_consumptions = pd.merge(daily_consumptions, monthly_consumptions, how='inner', left_on='concat_date', right_on='Month')
-  daily_consumptions = daily_consumptions.drop(['Month', 'concat_date'], axis=1)
-  return daily_consumptions
-
-
-def create_timesteps_data(input_data, num_timesteps, data_type):
-  smashed_data = []
+def school_windows(values, targets, school_targets, num_timesteps, horizon=1):
   smashed_data_schools = []
-  target_labels = []
   smashed_data_targets = []
+  windows = window_view(values, num_timesteps)
 
+  for target_positions in tqdm(school_targets):
+    smashed_data_schools.append(list(np.ascontiguousarray(windows[target_positions - num_timesteps])))
+    smashed_data_targets.append(list(horizon_targets(targets, target_positions, horizon)))
 
-  if data_type == 'monthly':
-    input_data['Date'] = pd.to_datetime(input_data['Month'], format = "%Y-%m")
-    interval = datetime.timedelta(days=31)
-  elif data_type == 'daily':
-    input_data['Date'] = pd.to_datetime(input_data['Date'], format = "%Y-%m-%d %H:%M:%S")
-    interval = datetime.timedelta(days=1)
-  print(input_data)
-
-  ids = input_data.ID.unique()
-
-  for school_id in tqdm(ids):
-    school_smashed = []
-    school_smashed_target = []
-
-    school_consumption = input_data.loc[input_data['ID'] == school_id]
-    starting_index = school_consumption.index[0]
-    for ind in school_consumption.index:
-      if ind - starting_index - num_timesteps < 0:
-        continue
-      rows = input_data.iloc[ind - num_timesteps : ind]
-      dates = rows.Date.reset_index(drop=True)
-
-      target_row = input_data.iloc[ind]
-      target_date = target_row.Date
-
-      missing = False
-      for i in range (1, len(dates) - 1):
-        if dates[i] - dates[i - 1] > interval:
-          missing = True
-      if target_date - dates[len(dates) - 1] > interval:
-        missing = True
-
-      if missing:
-        missing = False 
-        continue
-      
-      if data_type == 'monthly':
-        append_row = rows[['ID', 'Monthly Consumption', 'isCovid', 'isSummer', 'isHalfSummer']].to_numpy()      
-        append_target = target_row['Monthly Consumption']
-      if data_type == 'daily':
-        append_row = rows[['ID', 'Value', 'isCovid', 'isHoliday', 'isChristmas', 'isWeekday', 'isSummer', 'Monthly Consumption']].to_numpy()
-        append_target = target_row['Value']
-
-      smashed_data.append(append_row[: , 1 :])
-      school_smashed.append(append_row[:, 1 :])
-      
-      target_labels.append(append_target)
-      school_smashed_target.append(append_target)
-
-    smashed_data_schools.append(school_smashed)
-    smashed_data_targets.append(school_smashed_target)
-    
+  smashed_data = [window for school_smashed in smashed_data_schools for window in school_smashed]
+  target_labels = [target for school_smashed_target in smashed_data_targets for target in school_smashed_target]
   return smashed_data, target_labels, smashed_data_schools, smashed_data_targets
 
 
@@ -118,22 +51,34 @@ def create_validation_test(smashed_data_schools, target_labels, val_ptg, test_pt
     
   return train_data, train_targets, test_data, test_targets, validation_data, validation_targets
 
-def create_np_array(input_list, target_list):
-  input_data = np.array(input_list, dtype='float32')
-  target_data = np.array(target_list, dtype='float32')
-  return input_data, target_data
-
-def create_dataloader(input_data, input_targets, batch_size=128, shuffle=True):
+def create_dataloader(input_data, input_targets, batch_size=128, shuffle=True, num_workers=0, pin_memory=False):
+  loader_options = {'num_workers': num_workers, 'pin_memory': pin_memory, 'persistent_workers': num_workers > 0}
+  if isinstance(input_data, WindowedDataset):
+    return DataLoader(input_data, batch_size=batch_size, shuffle=shuffle, collate_fn=collate_windows, **loader_options)
   input_dataset = TensorDataset(input_data, input_targets)
-  input_dataloader = DataLoader(input_dataset, batch_size=batch_size, shuffle=shuffle)
+  input_dataloader = DataLoader(input_dataset, batch_size=batch_size, shuffle=shuffle, **loader_options)
   return input_dataloader
 
 
 
-def get_dataset(path_to_data, default_dict):
-  data_type, number_timesteps, val_ptg, test_ptg, normalize_input, normalize_target = at(default_dict, 'data_type', 'time_steps', 'val_ptg', 'test_ptg', 'normalize_input', 'normalize_target')
-  create_data, include_students = at(default_dict, 'create_data', 'include_students')
-  data_split = 'split_data/'  
+def dataset_sources(path_to_data, default_dict):
+  data_type, include_students = at(default_dict, 'data_type', 'include_students')
+  data_split = 'split_data/'
+
+  if data_type == 'monthly':
+    source_files = [path_to_data + 'monthly_consumptions.csv', path_to_data + 'categorical_clean.csv']
+    if include_students:
+      data_split = 'split_data_2/'
+  elif data_type == 'daily':
+    source_files = [path_to_data + 'concat_data.csv']
+    if default_dict['extra_column']:
+      data_split = 'split_data_2/'
+      source_files.append(path_to_data + '../Monthly_data/monthly_consumptions.csv')
+  return data_split, source_files
+
+
+def load_school_consumptions(path_to_data, default_dict):
+  data_type, include_students = at(default_dict, 'data_type', 'include_students')
 
   if data_type == 'monthly':
     school_consumptions = pd.read_csv(path_to_data + 'monthly_consumptions.csv')
@@ -143,7 +88,6 @@ def get_dataset(path_to_data, default_dict):
     if include_students:
       school_consumptions = pd.merge(monthly_school_consumptions, categorical_school, how='inner', left_on='ID', right_on='ΑΑ')
       school_consumptions = monthly_school_consumptions.dropna().reset_index(drop=True)
-      data_split = 'split_data_2/'
 
     monthly_school_consumptions = monthly_school_consumptions.drop(['School'], axis=1)
     monthly_school_consumptions["isCovid"] = monthly_school_consumptions["isCovid"].astype(int)
@@ -151,34 +95,104 @@ def get_dataset(path_to_data, default_dict):
     monthly_school_consumptions["isHalfSummer"] = monthly_school_consumptions["isHalfSummer"].astype(int)
 
   elif data_type == 'daily':
-    extra_column = default_dict['extra_column']
-    school_consumptions = pd.read_csv(path_to_data + 'concat_data.csv')
-    if extra_column:
-      data_split = 'split_data_2/'
-      monthly_consumptions = pd.read_csv(path_to_data + '../Monthly_data/monthly_consumptions.csv')
-      monthly_consumptions = monthly_consumptions.groupby('Month')['Monthly Consumption'].mean()
-      school_consumptions['Date'] = ['-'.join(x.split('-')[:2]) for x in school_consumptions['Date']]
-      monthly_consumptions = pd.DataFrame({'Month':monthly_consumptions.index, 'Monthly Consumption':monthly_consumptions.values})
-      school_consumptions = add_extra_feature(school_consumptions, monthly_consumptions)
-      print(school_consumptions)
-    school_consumptions['Value'] = school_consumptions['Value'].clip(lower=0)
-    school_consumptions = school_consumptions.rename(columns={"index": "ID"})
-
-  if create_data:
-    input_data_list, target_labels_list, smashed_data_schools, smashed_data_targets = create_timesteps_data(school_consumptions, number_timesteps, data_type)
-    train_data, train_targets, test_data, test_targets, validation_data, validation_targets = create_validation_test(smashed_data_schools, smashed_data_targets, val_ptg, test_ptg)
-    save_to_pkl(train_data, train_targets, path_to_data + data_split, 'train')
-    save_to_pkl(validation_data, validation_targets, path_to_data + data_split, 'validation')
-    save_to_pkl(test_data, test_targets, path_to_data + data_split, 'test')
-  else:
-    train_data, train_targets = load_pkl(path_to_data + data_split, 'train')
-    validation_data, validation_targets = load_pkl(path_to_data + data_split, 'validation')
-    test_data, test_targets = load_pkl(path_to_data + data_split, 'test')
-
-
-  train_data, train_targets = create_np_array(train_data, train_targets)
-  validation_data, validation_targets = create_np_array(validation_data, validation_targets)
-  test_data, test_targets = create_np_array(test_data, test_targets)
+    school_consumptions = prepare_daily_consumptions(pd.read_csv(path_to_data + 'concat_data.csv'), path_to_data, default_dict['extra_column'])
+
+  return school_consumptions
+
+
+def prepare_daily_consumptions(school_consumptions, path_to_data, extra_column):
+  # row by row steps and the grouping by school only, so appended readings go through the same preparation as concat_data.csv
+  dates = pd.to_datetime(school_consumptions['Date'])
+  # calendar flags come from the table the service uses, not from the csv
+  school_consumptions[daily_flags] = calendar_lookup(dates)
+  if extra_column:
+    school_consumptions['Monthly Consumption'] = previous_month_mean(dates, path_to_data + '../Monthly_data/monthly_consumptions.csv')
+    # Date keeps only the month, as the month merge of the extra column always did; rows without a previous month are dropped
+    school_consumptions['Date'] = dates.dt.to_period('M').dt.to_timestamp()
+    school_consumptions = school_consumptions[school_consumptions['Monthly Consumption'].notna()].reset_index(drop=True)
+    print(school_consumptions)
+  school_consumptions['Value'] = school_consumptions['Value'].clip(lower=0)
+  school_consumptions = school_consumptions.rename(columns={"index": "ID"})
+  return group_by_school(school_consumptions)
+
+
+def window_starts(school_targets, num_timesteps, val_ptg, test_ptg):
+  # the per-school split of create_validation_test, on the series row where each window starts
+  train_starts, _, test_starts, _, validation_starts, _ = create_validation_test(school_targets, school_targets, val_ptg, test_ptg)
+  return {'train': np.asarray(train_starts, dtype='int64') - num_timesteps, 'validation': np.asarray(validation_starts, dtype='int64') - num_timesteps, 'test': np.asarray(test_starts, dtype='int64') - num_timesteps}
+
+
+def get_windowed_datasets(cache_dir, default_dict):
+  data_type, number_timesteps, horizon, normalize_input, normalize_target = at(default_dict, 'data_type', 'time_steps', 'horizon', 'normalize_input', 'normalize_target')
+  horizon = horizon or 1
+  with stage('dataset.load_cache'):
+    series_values, series_targets, start_sets = load_series_cache(cache_dir, ['train', 'validation', 'test'])
+  series_values, series_targets = torch.from_numpy(series_values), torch.from_numpy(series_targets)
+  print(series_values.shape)
+
+  # rows are rescaled once; scaler factors are weighted by how often the training windows use each row
+  with stage('dataset.normalize'):
+    if normalize_input:
+      inp_norm_technique = default_dict.get('input_normalization')
+      input_weights = window_coverage(start_sets['train'], number_timesteps, len(series_values))
+      series_values = rescale_data(series_values, inp_norm_technique, f'{data_type}_{inp_norm_technique}_input_scaler', weights=input_weights)
+
+    if normalize_target:
+      targ_norm_technique = default_dict.get('target_normalization')
+      target_weights = target_coverage(start_sets['train'], number_timesteps, len(series_targets), horizon)
+      series_targets = rescale_data(series_targets, targ_norm_technique, f'{data_type}_{targ_norm_technique}_target_scaler', weights=target_weights)
+
+  train_set = WindowedDataset(series_values, series_targets, start_sets['train'], number_timesteps, horizon)
+  validation_set = WindowedDataset(series_values, series_targets, start_sets['validation'], number_timesteps, horizon)
+  test_data, test_targets = WindowedDataset(series_values, series_targets, start_sets['test'], number_timesteps, horizon).materialize()
+  print(train_set.shape)
+  print(validation_set.shape)
+  print(test_data.shape)
+
+  return train_set, train_set.targets(), validation_set, validation_set.targets(), test_data, test_targets
+
+
+def get_dataset(path_to_data, default_dict):
+  data_type, number_timesteps, horizon, val_ptg, test_ptg, normalize_input, normalize_target = at(default_dict, 'data_type', 'time_steps', 'horizon', 'val_ptg', 'test_ptg', 'normalize_input', 'normalize_target')
+  horizon = horizon or 1            # days predicted per window, 1 for the recursive one-step model
+  create_data = default_dict['create_data']
+  data_split, source_files = dataset_sources(path_to_data, default_dict)
+  cache_dir = path_to_data + data_split
+  key, settings, sources = cache_key(default_dict, source_files)
+
+  if create_data or not is_valid_cache(cache_dir, key):
+    print(f'Building window cache {key} in {cache_dir}')
+    with stage('dataset.read_sources'):
+      school_consumptions = load_school_consumptions(path_to_data, default_dict)
+    with stage('dataset.build_windows'):
+      values, targets, school_ids, school_targets = build_windows(school_consumptions, number_timesteps, data_type, horizon)
+    # lazy windows only need the series and the window starts, the stacked copies are skipped
+    window_sets = None
+    if not default_dict.get('lazy_windows'):
+      with stage('dataset.stack_windows'):
+        input_data_list, target_labels_list, smashed_data_schools, smashed_data_targets = school_windows(values, targets, school_targets, number_timesteps, horizon)
+      with stage('dataset.split'):
+        train_data, train_targets, test_data, test_targets, validation_data, validation_targets = create_validation_test(smashed_data_schools, smashed_data_targets, val_ptg, test_ptg)
+      window_sets = {'train': (train_data, train_targets), 'validation': (validation_data, validation_targets), 'test': (test_data, test_targets)}
+
+    dates = school_consumptions['Date'].to_numpy(dtype='datetime64[ns]').view('int64')
+    layout = school_blocks(values, targets, dates, school_ids, school_row_positions(school_consumptions['ID'].to_numpy())[1], school_targets)
+    if layout is None:
+      series, blocks, windows, physical_targets = (values, targets, dates), None, None, school_targets
+    else:
+      series, blocks, windows, physical_targets = layout
+    start_sets = window_starts(physical_targets, number_timesteps, val_ptg, test_ptg)
+    with stage('dataset.save_cache'):
+      save_window_cache(cache_dir, key, settings, sources, window_sets, (number_timesteps, len(feature_columns[data_type])), series, start_sets, blocks, windows, horizon)
+
+  if default_dict.get('lazy_windows'):
+    return get_windowed_datasets(cache_dir, default_dict)
+
+  with stage('dataset.load_cache'):
+    refresh_stale_sets(cache_dir)
+    train_data, train_targets = load_window_cache(cache_dir, 'train')
+    validation_data, validation_targets = load_window_cache(cache_dir, 'validation')
+    test_data, test_targets = load_window_cache(cache_dir, 'test')
 
   print(train_data.shape)
   print(validation_data.shape)
@@ -187,22 +201,25 @@ def get_dataset(path_to_data, default_dict):
   validation_data, validation_targets = torch.from_numpy(validation_data), torch.from_numpy(validation_targets)
   test_data, test_targets = torch.from_numpy(test_data), torch.from_numpy(test_targets)
 
-  if normalize_input:
-    inp_norm_technique = default_dict.get('input_normalization')
+  with stage('dataset.normalize'):
+    if normalize_input:
+      inp_norm_technique = default_dict.get('input_normalization')
 
-    train_data = rescale_data(train_data, inp_norm_technique, f'{data_type}_{inp_norm_technique}_input_scaler')
-    validation_data = rescale_data(validation_data, inp_norm_technique, f'{data_type}_{inp_norm_technique}_input_scaler')
-    test_data = rescale_data(test_data, inp_norm_technique, f'{data_type}_{inp_norm_technique}_input_scaler')
+      train_data = rescale_data(train_data, inp_norm_technique, f'{data_type}_{inp_norm_technique}_input_scaler')
+      validation_data = rescale_data(validation_data, inp_norm_technique, f'{data_type}_{inp_norm_technique}_input_scaler')
+      test_data = rescale_data(test_data, inp_norm_technique, f'{data_type}_{inp_norm_technique}_input_scaler')
 
-  if normalize_target:
-    targ_norm_technique = default_dict.get('target_normalization')
+    if normalize_target:
+      targ_norm_technique = default_dict.get('target_normalization')
 
-    train_targets = rescale_data(train_targets, targ_norm_technique, f'{data_type}_{targ_norm_technique}_target_scaler')
-    validation_targets = rescale_data(validation_targets, targ_norm_technique, f'{data_type}_{targ_norm_technique}_target_scaler')
-    test_targets = rescale_data(test_targets, targ_norm_technique, f'{data_type}_{targ_norm_technique}_target_scaler')
+      # one factor for every day of the horizon, fitted on the target rows like the lazy windows do
+      train_targets = rescale_data(train_targets.reshape(-1), targ_norm_technique, f'{data_type}_{targ_norm_technique}_target_scaler').reshape(train_targets.shape)
+      validation_targets = rescale_data(validation_targets.reshape(-1), targ_norm_technique, f'{data_type}_{targ_norm_technique}_target_scaler').reshape(validation_targets.shape)
+      test_targets = rescale_data(test_targets.reshape(-1), targ_norm_technique, f'{data_type}_{targ_norm_technique}_target_scaler').reshape(test_targets.shape)
 
-  train_targets = torch.unsqueeze(train_targets, 1)
-  test_targets = torch.unsqueeze(test_targets, 1)
-  validation_targets = torch.unsqueeze(validation_targets, 1)
+  if horizon == 1:
+    train_targets = torch.unsqueeze(train_targets, 1)
+    test_targets = torch.unsqueeze(test_targets, 1)
+    validation_targets = torch.unsqueeze(validation_targets, 1)
 
   return train_data, train_targets, validation_data, validation_targets, test_data, test_targets
\ No newline at end of file
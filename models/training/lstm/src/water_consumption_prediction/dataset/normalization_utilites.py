@@ -18,38 +18,122 @@ def inverse_minmax(input_data, min_value, max_value, scale_range = (0,1)):
     minrange, maxrange = scale_range
     return ((input_data / (maxrange - minrange)) * (max_value - min_value)) + min_value
 
-def set_scaling_factors(torch_data, filename, rescale_method):
-    if torch_data.dim() > 2:
-        torch_data = torch_data.flatten(end_dim=-2)
-    if rescale_method == 'minmax':
-        minval, maxval = torch.min(torch_data).numpy(), torch.max(torch_data).numpy()
-        to_save = [minval, maxval]
-    elif rescale_method == 'z_score':
-        m, s = torch_data.mean(axis=0).numpy() , torch_data.std(axis=0).numpy()
-        to_save = [m, s]       
-    
-    np.savetxt(filename, to_save, delimiter=', ')
-    
-    return to_save[0], to_save[1]            # saved_vector[0] is min or mean , saved_vector[1] is max or std deviation
-
-def get_normalization_factors(filename):        
-    if os.path.isfile(filename):
-        saved_vector = np.genfromtxt(filename, dtype='float32', delimiter=', ')
-    else:
-        return None
-    return saved_vector
+class Scaler:
+    """
+    Min/max or z-score factors fitted in one streaming pass. `partial_fit` takes one chunk at a time and
+    merges it with running min/max, or with Welford/Chan running count, mean and squared deviations, so the
+    training tensor is never flattened or copied as a whole. Optional per-row weights count a row several
+    times, e.g. once per window that contains it.
+    """
+    def __init__(self, rescale_method):
+        self.rescale_method = rescale_method
+        self.count = 0.0
+        self.mean, self.m2 = None, None
+        self.minval, self.maxval = None, None
+        self.factors = None
 
-def rescale_data(input_data, rescale_method, scaler_save_name):
-    scalers = {'minmax': minmax_normalization, 'z_score': z_score_normalization}
-    saved_vector =  return_saved_vector(scaler_save_name)
-    if saved_vector is None:
-        a_val, b_val = set_scaling_factors(input_data, scaler_save_name, rescale_method)
-    else:
-        a_val, b_val = saved_vector
+    def partial_fit(self, input_data, weights=None):
+        feature_shape = tuple(input_data.shape[-1:]) if input_data.dim() > 1 else ()
+        if weights is None:
+            rows = input_data.reshape((-1,) + feature_shape).to(torch.float64)
+            weights = torch.ones(rows.shape[0], dtype=torch.float64)
+        else:
+            rows = input_data.to(torch.float64)
+            weights = weights.to(torch.float64)
+            rows = rows[weights > 0]
+            weights = weights[weights > 0]
+        if rows.shape[0] == 0:
+            return self
+        self.factors = None
+
+        if self.rescale_method == 'minmax':
+            batch_min, batch_max = torch.min(rows), torch.max(rows)
+            self.minval = batch_min if self.minval is None else torch.minimum(self.minval, batch_min)
+            self.maxval = batch_max if self.maxval is None else torch.maximum(self.maxval, batch_max)
+        elif self.rescale_method == 'z_score':
+            weights = weights.reshape((-1,) + (1,) * len(feature_shape))
+            batch_count = weights.sum()
+            batch_mean = (weights * rows).sum(axis=0) / batch_count
+            batch_m2 = (weights * (rows - batch_mean) ** 2).sum(axis=0)
+            if self.mean is None:
+                self.mean, self.m2 = batch_mean, batch_m2
+            else:
+                delta = batch_mean - self.mean
+                total = self.count + batch_count
+                self.mean = self.mean + delta * batch_count / total
+                self.m2 = self.m2 + batch_m2 + delta ** 2 * self.count * batch_count / total
+        self.count += float(weights.sum())
+        return self
+
+    def scaling_factors(self):
+        # (method, a, b): a is min or mean, b is max or std deviation
+        if self.factors is None:
+            if self.rescale_method == 'minmax':
+                a_val, b_val = self.minval, self.maxval
+            elif self.rescale_method == 'z_score':
+                a_val, b_val = self.mean, torch.sqrt(self.m2 / (self.count - 1))
+                # a constant feature, e.g. isCovid outside 2020-21, is only centred
+                b_val = torch.where(b_val > 0, b_val, torch.ones_like(b_val))
+            self.factors = (self.rescale_method, a_val.to(torch.float32), b_val.to(torch.float32))
+        return self.factors
+
+    def transform(self, input_data):
+        return rescale_with_factors(input_data, self.scaling_factors())
+
+    def inverse_transform(self, input_data):
+        return inverse_with_factors(input_data, self.scaling_factors())
+
+    def state_dict(self):
+        _, a_val, b_val = self.scaling_factors()
+        return {'rescale_method': self.rescale_method, 'count': self.count, 'a': a_val, 'b': b_val}
+
+    @classmethod
+    def from_factors(cls, rescale_method, a_val, b_val, count=0.0):
+        scaler = cls(rescale_method)
+        scaler.count = count
+        scaler.factors = (rescale_method, torch.as_tensor(a_val, dtype=torch.float32), torch.as_tensor(b_val, dtype=torch.float32))
+        return scaler
+
+    @classmethod
+    def from_state_dict(cls, state):
+        return cls.from_factors(state['rescale_method'], state['a'], state['b'], state['count'])
 
-    a_val, b_val = torch.from_numpy(np.asarray(a_val, dtype='float32')), torch.from_numpy(np.asarray(b_val, dtype='float32'))
-    data_rescaled = scalers[rescale_method](input_data, a_val, b_val)
-    return data_rescaled
+
+fitted_scalers = {}             # scaler_save_name -> Scaler, fitted or loaded once per process
+
+def fit_scaler(input_data, rescale_method, weights=None, chunk_size=65536):
+    scaler = Scaler(rescale_method)
+    for start in range(0, len(input_data), chunk_size):
+        chunk_weights = None if weights is None else weights[start : start + chunk_size]
+        scaler.partial_fit(input_data[start : start + chunk_size], chunk_weights)
+    return scaler
+
+def get_scaler(scaler_save_name, rescale_method, input_data=None, weights=None):
+    if scaler_save_name not in fitted_scalers:
+        if input_data is None:
+            return None
+        fitted_scalers[scaler_save_name] = fit_scaler(input_data, rescale_method, weights)
+    return fitted_scalers[scaler_save_name]
+
+def scaler_names(default_dict):
+    data_type = default_dict.get('data_type')
+    names = {}
+    if default_dict.get('normalize_input'):
+        inp_norm_technique = default_dict.get('input_normalization')
+        names['input'] = (inp_norm_technique, f'{data_type}_{inp_norm_technique}_input_scaler')
+    if default_dict.get('normalize_target'):
+        targ_norm_technique = default_dict.get('target_normalization')
+        names['target'] = (targ_norm_technique, f'{data_type}_{targ_norm_technique}_target_scaler')
+    return names
+
+def checkpoint_scalers(default_dict):
+    # the fitted scalers of this run, in the form stored next to the model weights
+    return {role: fitted_scalers[scaler_save_name].state_dict() for role, (_, scaler_save_name) in scaler_names(default_dict).items() if scaler_save_name in fitted_scalers}
+
+def rescale_data(input_data, rescale_method, scaler_save_name, weights=None):
+    # the first call of a process fits the scaler on input_data, later calls reuse it
+    scaler = get_scaler(scaler_save_name, rescale_method, input_data, weights)
+    return scaler.transform(input_data)
 
 def return_saved_vector(filename):        
     if os.path.isfile(filename):
@@ -59,9 +143,23 @@ def return_saved_vector(filename):
     return saved_vector
 
 def inverse_normalized_data(input_data, rescale_method, scaler_save_name):
-    inverse_scalers = {'minmax': inverse_minmax, 'z_score': inverse_z_score}
+    scaler = get_scaler(scaler_save_name, rescale_method)
+    return scaler.inverse_transform(input_data)
+
+def load_scaling_factors(rescale_method, scaler_save_name):
+    # scaler text files written by older runs, for checkpoints that do not carry their scalers
     saved_vector = return_saved_vector(scaler_save_name)
+    if saved_vector is None:
+        return None
     a_val, b_val = saved_vector
-    a_val, b_val = torch.from_numpy(np.asarray(a_val, dtype='float32')), torch.from_numpy(np.asarray(b_val, dtype='float32'))
-    data_inversed = inverse_scalers[rescale_method](input_data, a_val, b_val)
-    return data_inversed
\ No newline at end of file
+    return rescale_method, torch.from_numpy(np.asarray(a_val, dtype='float32')), torch.from_numpy(np.asarray(b_val, dtype='float32'))
+
+def rescale_with_factors(input_data, scaling_factors):
+    scalers = {'minmax': minmax_normalization, 'z_score': z_score_normalization}
+    rescale_method, a_val, b_val = scaling_factors
+    return scalers[rescale_method](input_data, a_val, b_val)
+
+def inverse_with_factors(input_data, scaling_factors):
+    inverse_scalers = {'minmax': inverse_minmax, 'z_score': inverse_z_score}
+    rescale_method, a_val, b_val = scaling_factors
+    return inverse_scalers[rescale_method](input_data, a_val, b_val)
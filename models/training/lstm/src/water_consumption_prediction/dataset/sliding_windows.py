@@ -0,0 +1,87 @@
+import datetime
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+feature_columns = {
+  'monthly': ['Monthly Consumption', 'isCovid', 'isSummer', 'isHalfSummer'],
+  'daily': ['Value', 'isCovid', 'isHoliday', 'isChristmas', 'isWeekday', 'isSummer', 'Monthly Consumption']
+}
+target_columns = {'monthly': 'Monthly Consumption', 'daily': 'Value'}
+date_intervals = {'monthly': datetime.timedelta(days=31), 'daily': datetime.timedelta(days=1)}
+
+
+def parse_dates(input_data, data_type):
+  if data_type == 'monthly':
+    input_data['Date'] = pd.to_datetime(input_data['Month'], format = "%Y-%m")
+  elif data_type == 'daily':
+    input_data['Date'] = pd.to_datetime(input_data['Date'], format = "%Y-%m-%d %H:%M:%S")
+  return date_intervals[data_type]
+
+
+def school_row_positions(ids):
+  # row positions of every school, schools ordered by first appearance like Series.unique()
+  codes, uniques = pd.factorize(ids)
+  order = np.argsort(codes, kind='stable')
+  bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+  return uniques, np.split(order, bounds)
+
+
+def group_by_school(input_data):
+  # rows of a school next to each other, schools by first appearance and each school's rows in file order;
+  # the windows and the cache blocks need this once incremental ingest appended rows to the end of the file
+  codes = pd.factorize(input_data['ID'])[0]
+  if np.all(np.diff(codes) >= 0):
+    return input_data
+  return input_data.iloc[np.argsort(codes, kind='stable')].reset_index(drop=True)
+
+
+def gap_flags(dates, interval):
+  # gaps[k] is True when row k is more than one interval after row k - 1
+  day_diffs = np.diff(dates.to_numpy(dtype='datetime64[ns]'))
+  gaps = np.zeros(len(dates), dtype=bool)
+  gaps[1:] = day_diffs > np.timedelta64(interval)
+  return gaps
+
+
+def valid_target_positions(positions, gaps, num_timesteps, school_start=None, horizon=1):
+  """
+  Returns the target rows of a school that get a window, with the same rules as the original row loop:
+  a window of rows [p - T, p) is dropped when a gap falls inside rows p - T + 1 .. p - 2 or between
+  the last window row and the target row p. `school_start` is the position of the school's first row
+  when `positions` only covers its tail. With a `horizon` of H days the targets p .. p + H - 1 must
+  also be rows of the school without a gap between them.
+  """
+  school_start = positions[0] if school_start is None else school_start
+  candidates = positions[(positions - school_start - num_timesteps >= 0) & (positions + horizon - 1 <= positions[-1])]
+  if len(candidates) == 0:
+    return candidates
+  gap_count = np.concatenate(([0], np.cumsum(gaps, dtype=np.int64)))
+  inner_start = candidates - num_timesteps + 1
+  inner_end = np.maximum(candidates - 1, inner_start)
+  inner_gaps = gap_count[inner_end] - gap_count[inner_start]
+  horizon_gaps = gap_count[candidates + horizon] - gap_count[candidates + 1]
+  return candidates[(inner_gaps == 0) & (horizon_gaps == 0) & ~gaps[candidates]]
+
+
+def horizon_targets(targets, target_positions, horizon):
+  # (windows,) targets for one-step models, (windows, horizon) for direct multi-day ones
+  if horizon == 1:
+    return targets[target_positions]
+  return targets[np.asarray(target_positions)[:, None] + np.arange(horizon)]
+
+
+def window_view(values, num_timesteps):
+  # (rows - T + 1, T, features) view, window i covers rows i .. i + T - 1
+  return sliding_window_view(values, num_timesteps, axis=0).transpose(0, 2, 1)
+
+
+def build_windows(input_data, num_timesteps, data_type, horizon=1):
+  interval = parse_dates(input_data, data_type)
+  values = np.ascontiguousarray(input_data[feature_columns[data_type]].to_numpy(dtype='float32'))
+  targets = input_data[target_columns[data_type]].to_numpy(dtype='float32')
+  gaps = gap_flags(input_data['Date'], interval)
+
+  school_ids, school_positions = school_row_positions(input_data['ID'].to_numpy())
+  school_targets = [valid_target_positions(positions, gaps, num_timesteps, horizon=horizon) for positions in school_positions]
+  return values, targets, school_ids, school_targets
@@ -0,0 +1,84 @@
+import os
+import numpy as np
+import pandas as pd
+from src.water_consumption_prediction.dataset.calendar_features import create_features
+
+flag_columns = ['isCovid', 'isHoliday', 'isChristmas', 'isWeekday', 'isSummer']
+
+
+def school_series(num_days, gap_probability, rng, start='2019-01-01'):
+  """
+  Daily consumption of one synthetic school with the real calendar flags. Schools use less water on
+  weekends, holidays and in summer; single days go missing with `gap_probability` and some schools
+  also have one longer outage, so the gap handling of the windowing is exercised.
+  """
+  dates = pd.Series(pd.date_range(start, periods=num_days, freq='D'))
+  df = create_features(pd.DataFrame({'Date': dates, 'Value': np.zeros(num_days)}))
+  activity = np.where(df['isWeekday'] == 1, 1.0, 0.3) * np.where(df['isSummer'] == 1, 0.2, 1.0) * np.where(df['isHoliday'] == 1, 0.3, 1.0)
+  df['Value'] = rng.gamma(2.0, 3.0) * activity * rng.gamma(4.0, 0.25, num_days)
+  keep = rng.random(num_days) > gap_probability
+  if num_days > 30 and rng.random() < 0.3:
+    outage = rng.integers(0, num_days - 14)
+    keep[outage:outage + rng.integers(3, 15)] = False
+  return df[keep].reset_index(drop=True)
+
+
+def synthetic_concat_data(num_schools, num_days, gap_probability=0.02, seed=0, start='2019-01-01'):
+  # the shape of NLOG_Data_clean/concat_data.csv, the school id is in the 'index' column
+  rng = np.random.default_rng(seed)
+  frames = []
+  for school_id in range(num_schools):
+    df = school_series(num_days, gap_probability, rng, start)
+    df.insert(0, 'index', school_id)
+    frames.append(df)
+  concat_data = pd.concat(frames, ignore_index=True)
+  concat_data['Date'] = concat_data['Date'].dt.strftime('%Y-%m-%d %H:%M:%S')
+  concat_data[flag_columns] = concat_data[flag_columns].astype(int)
+  return concat_data[['index', 'Date', 'Value'] + flag_columns]
+
+
+def synthetic_monthly_consumptions(concat_data):
+  # the shape of Monthly_data/monthly_consumptions.csv: per school totals of the daily values
+  months = concat_data['Date'].str[:7]
+  monthly = concat_data.groupby([concat_data['index'], months])['Value'].sum().reset_index()
+  return monthly.rename(columns={'index': 'ID', 'Date': 'Month', 'Value': 'Monthly Consumption'})
+
+
+def synthetic_raw_meter(num_days, seed, gap_probability=0.0, start='2019-01-01'):
+  # NLOG-shaped readings every 6 hours, the daily consumption is filled on the midnight reading
+  rng = np.random.default_rng(seed)
+  daily = school_series(num_days, gap_probability, rng, start)
+  readings = pd.DatetimeIndex(np.repeat(daily['Date'].values, 4)) + pd.to_timedelta(np.tile([0, 6, 12, 18], len(daily)), unit='h')
+  flags = daily[flag_columns].to_numpy().repeat(4, axis=0).astype(bool)
+  raw = pd.DataFrame({
+    'Record Date': readings.strftime('%Y-%m-%d %H:%M:%S'),
+    'Valid': rng.random(len(readings)) > 0.01,
+    'Net Vol. (m³)': np.cumsum(np.repeat(daily['Value'].values / 4, 4) + rng.gamma(1.0, 0.01, len(readings))),
+    'Daily Consumption (m³)': np.where(readings.hour == 0, np.repeat(daily['Value'].values, 4), np.nan)
+  })
+  raw[flag_columns] = flags
+  return raw
+
+
+def data_paths(data_root):
+  return {name: os.path.join(data_root, directory) + '/' for name, directory in [('daily', 'NLOG_Data_clean'), ('monthly', 'Monthly_data'), ('raw', 'NLOG_raw')]}
+
+
+def write_synthetic_data(data_root, num_schools, num_days, raw_meters=0, gap_probability=0.02, seed=0):
+  """
+  Writes a data directory laid out like the real one, so get_dataset, NLOG-data-prep.py and the service
+  can run on it:
+  # Parameters
+  data_root : `str`
+      Gets NLOG_Data_clean/concat_data.csv, Monthly_data/monthly_consumptions.csv and, when
+      `raw_meters` > 0, NLOG_raw/meter_<i>.csv.
+  """
+  paths = data_paths(data_root)
+  for path in paths.values():
+    os.makedirs(path, exist_ok=True)
+  concat_data = synthetic_concat_data(num_schools, num_days, gap_probability, seed)
+  concat_data.to_csv(paths['daily'] + 'concat_data.csv', index=False)
+  synthetic_monthly_consumptions(concat_data).to_csv(paths['monthly'] + 'monthly_consumptions.csv', index=False)
+  for meter in range(raw_meters):
+    synthetic_raw_meter(num_days, seed + meter, gap_probability).to_csv(paths['raw'] + f'meter_{meter}.csv', index=False)
+  return paths
@@ -0,0 +1,214 @@
+import os
+import json
+import hashlib
+import numpy as np
+from numpy.lib.format import open_memmap
+from src.water_consumption_prediction.dataset.sliding_windows import horizon_targets
+
+manifest_name = 'manifest.json'
+cache_settings = ['data_type', 'time_steps', 'horizon', 'val_ptg', 'test_ptg', 'extra_column', 'include_students']
+set_names = ['train', 'validation', 'test']
+cache_format = 4
+# raw files so rows can be appended without rewriting a .npy header; shapes live in the manifest
+series_files = {'series_input_data.bin': 'float32', 'series_target_data.bin': 'float32', 'series_dates.bin': 'int64'}
+window_files = {'windows_school.bin': 'int32', 'windows_target.bin': 'int64'}
+blocks_file = 'schools.npz'
+
+
+def cache_key(default_dict, source_files):
+  settings = {name: default_dict.get(name) for name in cache_settings}
+  sources = {os.path.basename(path): os.path.getmtime(path) for path in source_files}
+  payload = json.dumps({'format': cache_format, 'settings': settings, 'sources': sources}, sort_keys=True)
+  return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16], settings, sources
+
+
+def read_manifest(cache_dir):
+  manifest_path = os.path.join(cache_dir, manifest_name)
+  if not os.path.isfile(manifest_path):
+    return None
+  with open(manifest_path) as f:
+    return json.load(f)
+
+
+def write_manifest(cache_dir, manifest):
+  manifest_path = os.path.join(cache_dir, manifest_name)
+  with open(manifest_path + '.tmp', 'w') as f:
+    json.dump(manifest, f, indent=2)
+  os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def is_valid_cache(cache_dir, key):
+  manifest = read_manifest(cache_dir)
+  if manifest is None or manifest.get('key') != key:
+    return False
+  entries = list(manifest['sets'].values()) + [manifest['series']] + ([manifest['blocks']] if manifest['blocks'] else [])
+  return all(os.path.isfile(os.path.join(cache_dir, file_name)) for entry in entries for file_name in entry['files'])
+
+
+def block_capacity(rows):
+  # spare rows behind every school, so daily appends only move a block once it is full
+  return rows + np.maximum(rows // 2, 64)
+
+
+def school_blocks(values, targets, dates, school_ids, school_positions, school_targets):
+  """
+  Lays the rows out one school per block, each block followed by spare rows for later appends.
+  Returns None when a school's rows are not contiguous, such a series is stored as it is and
+  cannot be appended to.
+  """
+  lengths = np.array([len(positions) for positions in school_positions], dtype='int64')
+  if any(positions[-1] - positions[0] + 1 != len(positions) for positions in school_positions):
+    return None
+  capacities = block_capacity(lengths)
+  offsets = np.concatenate(([0], np.cumsum(capacities)[:-1])).astype('int64')
+  rows = int(capacities.sum())
+
+  block_values = np.zeros((rows, values.shape[1]), dtype='float32')
+  block_targets = np.zeros(rows, dtype='float32')
+  block_dates = np.zeros(rows, dtype='int64')
+  physical_targets, window_school, window_target = [], [], []
+  for school, (positions, target_positions) in enumerate(zip(school_positions, school_targets)):
+    offset, first = offsets[school], positions[0]
+    block_values[offset : offset + len(positions)] = values[first : first + len(positions)]
+    block_targets[offset : offset + len(positions)] = targets[first : first + len(positions)]
+    block_dates[offset : offset + len(positions)] = dates[first : first + len(positions)]
+    physical_targets.append(target_positions - first + offset)
+    window_school.append(np.full(len(target_positions), school, dtype='int32'))
+    window_target.append(target_positions - first)
+
+  blocks = {'ids': np.asarray(school_ids), 'offsets': offsets, 'lengths': lengths, 'capacities': capacities}
+  windows = (np.concatenate(window_school or [np.zeros(0, 'int32')]), np.concatenate(window_target or [np.zeros(0, 'int64')]).astype('int64'))
+  return (block_values, block_targets, block_dates), blocks, windows, physical_targets
+
+
+def target_shape(horizon):
+  # one target per window, or the next `horizon` days of a direct multi-day model
+  return () if horizon == 1 else (horizon,)
+
+
+def write_array(path, array_list, item_shape):
+  # stack the windows straight into the .npy file so the set is never held twice in memory
+  array = open_memmap(path + '.tmp', mode='w+', dtype='float32', shape=(len(array_list),) + tuple(item_shape))
+  if len(array_list):
+    np.stack(array_list, out=array)
+  array.flush()
+  del array
+  os.replace(path + '.tmp', path)
+
+
+def write_raw(path, array, dtype):
+  with open(path + '.tmp', 'wb') as f:
+    f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+  os.replace(path + '.tmp', path)
+
+
+def append_raw(path, array, dtype):
+  with open(path, 'ab') as f:
+    f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+
+
+def map_raw(path, dtype, shape, mode='c'):
+  if shape[0] == 0:                     # np.memmap refuses empty files
+    return np.zeros(shape, dtype=dtype)
+  return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+
+def save_blocks(cache_dir, blocks):
+  np.savez(os.path.join(cache_dir, 'tmp_' + blocks_file), **blocks)
+  os.replace(os.path.join(cache_dir, 'tmp_' + blocks_file), os.path.join(cache_dir, blocks_file))
+
+
+def load_blocks(cache_dir):
+  with np.load(os.path.join(cache_dir, blocks_file)) as blocks:
+    return {name: blocks[name] for name in blocks.files}
+
+
+def save_window_cache(cache_dir, key, settings, sources, window_sets, window_shape, series, start_sets, blocks=None, windows=None, horizon=1):
+  os.makedirs(cache_dir, exist_ok=True)
+  manifest_path = os.path.join(cache_dir, manifest_name)
+  if os.path.isfile(manifest_path):
+    os.remove(manifest_path)            # invalidate the old cache before touching its arrays
+
+  sets = {}
+  for set_name in set_names:
+    input_file, target_file, starts_file = f'{set_name}_input_data.npy', f'{set_name}_target_data.npy', f'{set_name}_starts.npy'
+    np.save(os.path.join(cache_dir, starts_file), np.asarray(start_sets[set_name], dtype='int64'))
+    if window_sets is None:
+      # lazy windows are sliced from the series; stale sets are only stacked if an eager run asks for them
+      for file_name in (input_file, target_file):
+        if os.path.isfile(os.path.join(cache_dir, file_name)):
+          os.remove(os.path.join(cache_dir, file_name))
+      sets[set_name] = {'files': [starts_file], 'samples': len(start_sets[set_name]), 'stale': True}
+      continue
+    input_list, target_list = window_sets[set_name]
+    write_array(os.path.join(cache_dir, input_file), input_list, window_shape)
+    write_array(os.path.join(cache_dir, target_file), target_list, target_shape(horizon))
+    sets[set_name] = {'files': [input_file, target_file, starts_file], 'samples': len(input_list), 'stale': False}
+
+  # every row once, for the lazy WindowedDataset and for appends
+  for (file_name, dtype), array in zip(series_files.items(), series):
+    write_raw(os.path.join(cache_dir, file_name), array, dtype)
+  series_entry = {'files': list(series_files), 'rows': len(series[0]), 'features': int(series[0].shape[1])}
+
+  blocks_entry = None
+  if blocks is not None:
+    save_blocks(cache_dir, blocks)
+    for (file_name, dtype), array in zip(window_files.items(), windows):
+      write_raw(os.path.join(cache_dir, file_name), array, dtype)
+    blocks_entry = {'files': [blocks_file] + list(window_files), 'windows': len(windows[0])}
+
+  write_manifest(cache_dir, {'key': key, 'settings': settings, 'sources': sources, 'window_shape': list(window_shape), 'horizon': horizon, 'sets': sets, 'series': series_entry, 'blocks': blocks_entry})
+
+
+def load_window_cache(cache_dir, set_name):
+  # copy-on-write maps share the page cache like mmap_mode='r' but stay writable for torch.from_numpy
+  input_data = np.load(os.path.join(cache_dir, f'{set_name}_input_data.npy'), mmap_mode='c')
+  target_data = np.load(os.path.join(cache_dir, f'{set_name}_target_data.npy'), mmap_mode='c')
+  return input_data, target_data
+
+
+def map_series(cache_dir, manifest, mode='c'):
+  rows, features = manifest['series']['rows'], manifest['series']['features']
+  shapes = [(rows, features), (rows,), (rows,)]
+  return [map_raw(os.path.join(cache_dir, file_name), dtype, shape, mode) for (file_name, dtype), shape in zip(series_files.items(), shapes)]
+
+
+def grow_series(cache_dir, manifest, extra_rows):
+  # zero filled rows at the end of every series file, the manifest is updated by the caller
+  rows, features = manifest['series']['rows'], manifest['series']['features']
+  for (file_name, dtype), width in zip(series_files.items(), [features, 1, 1]):
+    os.truncate(os.path.join(cache_dir, file_name), (rows + extra_rows) * width * np.dtype(dtype).itemsize)
+  manifest['series']['rows'] = rows + extra_rows
+
+
+def load_series_cache(cache_dir, set_names):
+  series_values, series_targets, _ = map_series(cache_dir, read_manifest(cache_dir))
+  start_sets = {set_name: np.load(os.path.join(cache_dir, f'{set_name}_starts.npy')) for set_name in set_names}
+  return series_values, series_targets, start_sets
+
+
+def refresh_stale_sets(cache_dir, chunk_size=65536):
+  # appends and lazy builds only write the window starts, the stacked windows of a set are gathered on first eager use
+  manifest = read_manifest(cache_dir)
+  stale = [set_name for set_name, entry in manifest['sets'].items() if entry.get('stale')]
+  if not stale:
+    return
+  series_values, series_targets, _ = map_series(cache_dir, manifest)
+  num_timesteps, horizon = manifest['window_shape'][0], manifest.get('horizon', 1)
+  offsets = np.arange(num_timesteps)
+  for set_name in stale:
+    starts = np.load(os.path.join(cache_dir, f'{set_name}_starts.npy'))
+    input_path, target_path = os.path.join(cache_dir, f'{set_name}_input_data.npy'), os.path.join(cache_dir, f'{set_name}_target_data.npy')
+    input_data = open_memmap(input_path + '.tmp', mode='w+', dtype='float32', shape=(len(starts),) + tuple(manifest['window_shape']))
+    target_data = open_memmap(target_path + '.tmp', mode='w+', dtype='float32', shape=(len(starts),) + target_shape(horizon))
+    for begin in range(0, len(starts), chunk_size):
+      chunk = starts[begin : begin + chunk_size]
+      input_data[begin : begin + len(chunk)] = series_values[chunk[:, None] + offsets]
+      target_data[begin : begin + len(chunk)] = horizon_targets(series_targets, chunk + num_timesteps, horizon)
+    input_data.flush(), target_data.flush()
+    del input_data, target_data
+    os.replace(input_path + '.tmp', input_path)
+    os.replace(target_path + '.tmp', target_path)
+    manifest['sets'][set_name].update({'files': [os.path.basename(input_path), os.path.basename(target_path), f'{set_name}_starts.npy'], 'samples': len(starts), 'stale': False})
+    print(f'Gathered {len(starts)} {set_name} windows from the series')
+  write_manifest(cache_dir, manifest)
@@ -0,0 +1,65 @@
+import torch
+from torch.utils.data import Dataset
+
+
+def collate_windows(batch):
+  # WindowedDataset.__getitems__ already returns a stacked (inputs, targets) batch
+  return batch
+
+
+class WindowedDataset(Dataset):
+  """
+  Serves the windows of create_timesteps_data without materializing them.
+  # Parameters
+  series : `torch.Tensor`
+      All school rows concatenated, (rows x features). Each school occupies a contiguous block.
+  series_targets : `torch.Tensor`
+      The target value of every row, (rows,).
+  starts : `torch.Tensor`
+      The row offset where each window begins; its targets are the `horizon` rows right after the window.
+  """
+  def __init__(self, series, series_targets, starts, time_steps, horizon=1):
+    self.series = series
+    self.series_targets = series_targets
+    self.starts = torch.as_tensor(starts, dtype=torch.int64)
+    self.time_steps = time_steps
+    self.horizon = horizon
+    self.offsets = torch.arange(time_steps, dtype=torch.int64)
+    self.target_offsets = time_steps + torch.arange(horizon, dtype=torch.int64)
+
+  @property
+  def shape(self):
+    return (len(self.starts), self.time_steps, self.series.shape[-1])
+
+  def targets(self):
+    return self.series_targets[self.starts[:, None] + self.target_offsets]
+
+  def __len__(self):
+    return len(self.starts)
+
+  def __getitem__(self, index):
+    start = int(self.starts[index])
+    return self.series[start : start + self.time_steps], self.series_targets[start + self.time_steps : start + self.time_steps + self.horizon]
+
+  def __getitems__(self, indices):
+    starts = self.starts[torch.as_tensor(indices, dtype=torch.int64)]
+    rows = starts[:, None] + self.offsets
+    return self.series[rows], self.series_targets[starts[:, None] + self.target_offsets]
+
+  def materialize(self):
+    return self.__getitems__(torch.arange(len(self.starts)))
+
+
+def window_coverage(starts, time_steps, num_rows):
+  # number of windows that contain each row, the weight of that row in the flattened windows
+  starts = torch.as_tensor(starts, dtype=torch.int64)
+  changes = torch.zeros(num_rows + 1, dtype=torch.int64)
+  changes.index_add_(0, starts, torch.ones_like(starts))
+  changes.index_add_(0, starts + time_steps, -torch.ones_like(starts))
+  return changes.cumsum(0)[:-1]
+
+
+def target_coverage(starts, time_steps, num_rows, horizon=1):
+  starts = torch.as_tensor(starts, dtype=torch.int64)
+  target_rows = starts[:, None] + time_steps + torch.arange(horizon, dtype=torch.int64)
+  return torch.bincount(target_rows.reshape(-1), minlength=num_rows)
@@ -0,0 +1,31 @@
+import pandas as pd
+
+# the "xgboost save model" notebook: one model on the consumption averaged over all schools
+xgboost_features = ['rolling_month', 'rolling_3month', 'rolling_week', 'shift1']
+test_start = '2021-11-09'
+
+
+def average_daily_consumption(concat_data):
+  concat_data = concat_data[['Date', 'Value']].copy()
+  concat_data['Date'] = pd.to_datetime(concat_data['Date'])
+  return concat_data.groupby('Date').mean()
+
+
+def create_features(df):
+  # features of a day come from the days before it only, like XGBoostForecaster computes them when serving
+  df = df.copy()
+  df["rolling_month"] = df['Value'].shift(1).rolling(window=30).mean()
+  df["rolling_3month"] = df['Value'].shift(1).rolling(window=3*30).mean()
+  df["rolling_week"] = df['Value'].shift(1).rolling(window=7).mean()
+  df["shift1"] = df['Value'].shift(1)
+  return df.dropna()
+
+
+def xgboost_datasets(concat_data, val_ptg, split_date=test_start):
+  # train and test features are computed per split like the notebook; validation is the last val_ptg
+  # of the training rows, so its rolling windows may reach back into the training days
+  daily = average_daily_consumption(concat_data)
+  train, test = create_features(daily[daily.index <= split_date]), create_features(daily[daily.index > split_date])
+  validation_days = int(len(train) * val_ptg)
+  train, validation = train.iloc[:len(train) - validation_days], train.iloc[len(train) - validation_days:]
+  return [(frame[xgboost_features], frame['Value']) for frame in (train, validation, test)]
@@ -0,0 +1,203 @@
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+import torch
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.water_consumption_prediction.dataset.load_dataset import prepare_daily_consumptions
+from src.water_consumption_prediction.dataset.sliding_windows import build_windows
+from src.water_consumption_prediction.dataset.normalization_utilites import scaler_names, load_scaling_factors, rescale_with_factors
+from src.water_consumption_prediction.model.create_model import build_rnn
+from src.water_consumption_prediction.model.checkpoint import load_checkpoint
+from src.water_consumption_prediction.model.export_model import checkpoint_sizes, without_dropout
+from src.water_consumption_prediction.model.forecast_engine import ForecastEngine
+from src.water_consumption_prediction.model.cluster_training import cap_threads
+
+error_terms = ['squared', 'absolute', 'symmetric']          # summed per group, reduced to rmse, mae and smape
+table_columns = ['model', 'checkpoint', 'level', 'school', 'cutoff', 'horizon_day', 'windows', 'rmse', 'smape', 'mae', 'created']
+worker_state = {}
+
+
+def checkpoint_engine(checkpoint_path, default_dict, rnn_dictionary, device):
+  """
+  ForecastEngine of a training checkpoint, over the feature rows of the dataset it was trained on; D_in and
+  the days per forward pass come from its weights. Checkpoints without scalers use the scaler text files
+  of older runs, like the model registry.
+  """
+  model_state_dict, scalers = load_checkpoint(checkpoint_path, device)
+  D_in, D_out = checkpoint_sizes(model_state_dict)
+  model = build_rnn(D_in, D_out, default_dict['time_steps'], rnn_dictionary, device)
+  model.load_state_dict(model_state_dict)
+  if scalers:
+    factors = {role: scaler.scaling_factors() for role, scaler in scalers.items()}
+  else:
+    factors = {role: load_scaling_factors(technique, save_name) for role, (technique, save_name) in scaler_names(default_dict).items()}
+  return ForecastEngine(without_dropout(model), default_dict['time_steps'], factors.get('input'), factors.get('target'), device, D_out)
+
+
+def backtest_series(path_to_data, default_dict, num_predictions):
+  """
+  The rows of concat_data.csv prepared like for training, and the target rows of every school whose
+  window and the `num_predictions` days from it are gap-free rows of that school.
+  # Returns
+  values, targets, days (the datetime64[D] day of every row), school_ids, school_targets
+  """
+  if default_dict['data_type'] != 'daily':
+    raise ValueError('Backtesting runs on daily readings')
+  school_consumptions = pd.read_csv(path_to_data + 'concat_data.csv')
+  # with --extra_column Date keeps only the month, the cutoffs need the day
+  school_consumptions['Day'] = pd.to_datetime(school_consumptions['Date'])
+  school_consumptions = prepare_daily_consumptions(school_consumptions, path_to_data, default_dict['extra_column'])
+  values, targets, school_ids, school_targets = build_windows(school_consumptions, default_dict['time_steps'], 'daily', num_predictions)
+  return values, targets, school_consumptions['Day'].to_numpy(dtype='datetime64[D]'), school_ids, school_targets
+
+
+def rolling_cutoffs(days, school_targets, origins, step_days, last_cutoff=None):
+  # `origins` cutoffs `step_days` apart, the latest at last_cutoff or at the last day any school can be forecast from
+  if last_cutoff is None:
+    last_cutoff = max((days[targets[-1] - 1] for targets in school_targets if len(targets)), default=None)
+    if last_cutoff is None:
+      raise ValueError('No school has enough gap-free days for a forecast')
+  return np.datetime64(last_cutoff, 'D') - (np.arange(origins)[::-1] * step_days).astype('timedelta64[D]')
+
+
+def forecast_origins(days, school_targets, cutoffs):
+  """
+  One origin per school and cutoff the school can be forecast from: the target row right after the
+  cutoff, its window ending on the cutoff day.
+  # Returns
+  target rows, school positions and cutoff positions of the origins, ordered by school
+  """
+  schools = np.repeat(np.arange(len(school_targets)), [len(targets) for targets in school_targets])
+  positions = np.concatenate(list(school_targets) + [np.zeros(0, 'int64')]).astype('int64')
+  cutoff_codes = pd.Index(cutoffs).get_indexer(days[positions - 1])
+  keep = cutoff_codes >= 0
+  return positions[keep], schools[keep], cutoff_codes[keep]
+
+
+def error_sums(output, target, groups):
+  """
+  Squared, absolute and symmetric percentage errors of (windows x horizon) forecasts, summed per group
+  and forecast day with one index_add_. Any grouping of the windows reduces to RMSE, MAE and SMAPE
+  from these sums, so batches can be evaluated independently.
+  # Returns
+  `(keys, sums, counts)`: the groups present, their (groups x 3 x horizon) float64 sums and window counts
+  """
+  error = output - target
+  terms = torch.stack([error ** 2, error.abs(), 2 * error.abs() / (output.abs() + target.abs() + 1e-8)], dim=1).to(torch.float64)
+  keys, inverse = torch.unique(groups, return_inverse=True)
+  sums = torch.zeros((len(keys),) + terms.shape[1:], dtype=torch.float64).index_add_(0, inverse, terms)
+  return keys.numpy(), sums.numpy(), torch.bincount(inverse, minlength=len(keys)).numpy()
+
+
+def init_worker(threads, context):
+  # runs once in every pool process: the series are memory-mapped, models are loaded on first use
+  cap_threads(threads)
+  series_dir, default_dict, rnn_dictionary, num_predictions = context
+  worker_state.update({'values': np.load(os.path.join(series_dir, 'values.npy'), mmap_mode='r'), 'targets': np.load(os.path.join(series_dir, 'targets.npy'), mmap_mode='r'),
+                       'default_dict': default_dict, 'rnn_dictionary': rnn_dictionary, 'num_predictions': num_predictions, 'engines': {}})
+
+
+def worker_engine(checkpoint_path):
+  engines = worker_state['engines']
+  if checkpoint_path not in engines:
+    engines[checkpoint_path] = checkpoint_engine(checkpoint_path, worker_state['default_dict'], worker_state['rnn_dictionary'], torch.device('cpu'))
+  return engines[checkpoint_path]
+
+
+def backtest_batch(checkpoint_path, positions, groups):
+  # forecasts of one bounded batch of origins, only its (windows x time_steps + horizon) rows are read
+  engine = worker_engine(checkpoint_path)
+  time_steps, num_predictions = engine.time_steps, worker_state['num_predictions']
+  buffer = torch.from_numpy(worker_state['values'][positions[:, None] - time_steps + np.arange(time_steps + num_predictions)])
+  target = torch.from_numpy(worker_state['targets'][positions[:, None] + np.arange(num_predictions)])
+  if engine.input_scaler is not None:
+    buffer = rescale_with_factors(buffer, engine.input_scaler)
+  with torch.no_grad():
+    output = engine.roll(buffer, num_predictions)
+  return error_sums(output, target, torch.from_numpy(groups))
+
+
+def reduce_errors(sums, counts):
+  # (..., 3, horizon) sums and (...) counts -> rmse, smape, mae of shape (..., horizon)
+  windows = np.maximum(counts, 1)[..., None]
+  return np.sqrt(sums[..., 0, :] / windows), sums[..., 2, :] / windows, sums[..., 1, :] / windows
+
+
+def metrics_table(sums, counts, school_ids, cutoffs):
+  """
+  Long table of the (schools x cutoffs x 3 x horizon) sums: one row per school and forecast day over
+  all cutoffs (level school), per cutoff and day over all schools (level cutoff) and per day (level all).
+  """
+  horizon = sums.shape[-1]
+  levels = [('school', sums.sum(axis=1), counts.sum(axis=1), np.asarray(school_ids).astype(str), np.full(len(school_ids), None)),
+            ('cutoff', sums.sum(axis=0), counts.sum(axis=0), np.full(len(cutoffs), None), cutoffs),
+            ('all', sums.sum(axis=(0, 1))[None], counts.sum(keepdims=True).reshape(1), np.array([None]), np.array([None]))]
+  frames = []
+  for level, level_sums, level_counts, schools, level_cutoffs in levels:
+    present = level_counts > 0
+    rmse, smape, mae = reduce_errors(level_sums[present], level_counts[present])
+    entities = int(present.sum())
+    frames.append(pd.DataFrame({'level': level, 'school': np.repeat(schools[present], horizon), 'cutoff': np.repeat(level_cutoffs[present], horizon),
+                                'horizon_day': np.tile(np.arange(1, horizon + 1), entities), 'windows': np.repeat(level_counts[present], horizon),
+                                'rmse': rmse.reshape(-1), 'smape': smape.reshape(-1), 'mae': mae.reshape(-1)}))
+  table = pd.concat(frames, ignore_index=True)
+  table['cutoff'] = pd.to_datetime(table['cutoff'])
+  return table
+
+
+def run_backtest(path_to_data, default_dict, rnn_dictionary, checkpoints, cutoffs, num_predictions, batch_windows=4096, workers=None, threads_per_worker=1, series=None):
+  """
+  Rolling-origin backtest of every checkpoint on the same origins: from each cutoff day, every school
+  with `time_steps` days up to it and `num_predictions` observed days after it is forecast and scored.
+  Origins are split in batches of at most `batch_windows` forecasts spread over a process pool, the
+  errors are reduced per school, cutoff and forecast day as they come back.
+  # Parameters
+  checkpoints : `dict`
+      model name -> checkpoint path
+  series : `tuple`, optional
+      backtest_series of the same arguments, when the caller already read it to pick the cutoffs
+  # Returns
+  `pd.DataFrame` with the columns of table_columns
+  """
+  values, targets, days, school_ids, school_targets = series or backtest_series(path_to_data, default_dict, num_predictions)
+  positions, schools, cutoff_codes = forecast_origins(days, school_targets, cutoffs)
+  print(f'{len(positions)} forecasts of {len(set(schools.tolist()))} schools from {len(cutoffs)} cutoffs, {num_predictions} days each')
+  groups = schools * len(cutoffs) + cutoff_codes
+  batches = [(positions[start : start + batch_windows], groups[start : start + batch_windows]) for start in range(0, len(positions), batch_windows)]
+
+  tables = []
+  with tempfile.TemporaryDirectory() as series_dir:
+    np.save(os.path.join(series_dir, 'values.npy'), values)
+    np.save(os.path.join(series_dir, 'targets.npy'), targets)
+    del values, targets
+    context = (series_dir, default_dict, rnn_dictionary, num_predictions)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(threads_per_worker, context)) as pool:
+      for name, checkpoint_path in checkpoints.items():
+        start = time.perf_counter()
+        sums = np.zeros((len(school_ids) * len(cutoffs), len(error_terms), num_predictions))
+        counts = np.zeros(len(school_ids) * len(cutoffs), dtype='int64')
+        futures = [pool.submit(backtest_batch, checkpoint_path, batch_positions, batch_groups) for batch_positions, batch_groups in batches]
+        for future in as_completed(futures):
+          keys, batch_sums, batch_counts = future.result()
+          sums[keys] += batch_sums              # keys are unique within a batch
+          counts[keys] += batch_counts
+        table = metrics_table(sums.reshape(len(school_ids), len(cutoffs), len(error_terms), num_predictions), counts.reshape(len(school_ids), len(cutoffs)), school_ids, cutoffs)
+        table.insert(0, 'model', name)
+        table.insert(1, 'checkpoint', os.path.abspath(checkpoint_path))
+        table['created'] = pd.Timestamp.now()
+        tables.append(table)
+        overall = table[table['level'] == 'all']
+        print(f"{name}: RMSE {np.sqrt((overall['rmse'] ** 2 * overall['windows']).sum() / overall['windows'].sum()):.4f} over {len(batches)} batches in {time.perf_counter() - start:.1f}s")
+  return pd.concat(tables, ignore_index=True)[table_columns]
+
+
+def save_results(table, path):
+  # one parquet table for all backtests; a model name that is backtested again replaces its earlier rows
+  if os.path.isfile(path):
+    previous = pd.read_parquet(path)
+    table = pd.concat([previous[~previous['model'].isin(table['model'].unique())], table], ignore_index=True)
+  table.to_parquet(path + '.tmp', index=False)
+  os.replace(path + '.tmp', path)
+  return table
@@ -0,0 +1,38 @@
+import os
+from src.water_consumption_prediction.dataset.meter_data import read_meter_tail
+from src.water_consumption_prediction.model.forecast_engine import FEATURES
+
+
+def meter_sources_from_directory(directory):
+  return [(file_name[:-4], os.path.join(directory, file_name)) for file_name in sorted(os.listdir(directory)) if file_name.endswith('.csv')]
+
+
+def forecast_meters(forecaster, meter_sources, num_predictions, batch_size=256):
+  """
+  Forecasts many meters together, one batched forward pass per horizon step for every `batch_size`
+  meters. Yields one result dict per meter as soon as its batch is done, in the order of `meter_sources`
+  (name, path or file object); meters that cannot be read or are too short yield an 'error' entry. Results
+  are kept by position, so meters sharing a name each get their own.
+  """
+  for batch_start in range(0, len(meter_sources), batch_size):
+    batch = meter_sources[batch_start : batch_start + batch_size]
+    positions, histories, results = [], [], [None] * len(batch)
+    for position, (meter_name, source) in enumerate(batch):
+      try:
+        history = read_meter_tail(source, forecaster.time_steps)[FEATURES]
+      except Exception as error:
+        results[position] = {'meter': meter_name, 'error': f'Could not read meter: {error}'}
+        continue
+      if len(history) < forecaster.time_steps:
+        results[position] = {'meter': meter_name, 'error': f'Need at least {forecaster.time_steps} valid days to forecast, got {len(history)}'}
+        continue
+      positions.append(position)
+      histories.append(history)
+
+    if histories:
+      prediction_periods, predictions = forecaster.forecast_batch(histories, num_predictions)
+      for position, prediction_period, meter_predictions in zip(positions, prediction_periods, predictions):
+        results[position] = {'meter': batch[position][0], 'dates': prediction_period.strftime('%Y-%m-%d').tolist(), 'predictions': meter_predictions.tolist()}
+
+    for result in results:
+      yield result
@@ -0,0 +1,117 @@
+import os
+import copy
+import pickle
+import random
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from src.water_consumption_prediction.dataset.normalization_utilites import Scaler
+
+
+def atomic_save(checkpoint, path):
+  # readers of path only ever see a complete file
+  torch.save(checkpoint, path + '.tmp')
+  os.replace(path + '.tmp', path)
+
+
+def save_checkpoint(path, model_state_dict, scalers=None):
+  atomic_save({'model_state_dict': model_state_dict, 'scalers': scalers or {}}, path)
+
+
+def load_checkpoint(path, device):
+  checkpoint = torch.load(path, map_location=device)
+  if 'model_state_dict' not in checkpoint:          # plain state_dict saved by older runs, scalers live in text files
+    return checkpoint, {}
+  scalers = {role: Scaler.from_state_dict(state) for role, state in checkpoint['scalers'].items()}
+  return checkpoint['model_state_dict'], scalers
+
+
+def is_model_checkpoint(path):
+  # weights and scalers like best_model.pt, or a plain state_dict; not the resume state of save_last
+  try:
+    checkpoint = torch.load(path, map_location='cpu')
+  except pickle.UnpicklingError:             # resume checkpoints carry the numpy/python RNG state
+    return False
+  return isinstance(checkpoint, dict) and 'optimizer_state_dict' not in checkpoint
+
+
+def cpu_copy(state):
+  # detached CPU copies of every tensor in a (nested) state dict, training can go on while they are written
+  if isinstance(state, torch.Tensor):
+    return state.detach().to('cpu', copy=True)
+  if isinstance(state, dict):
+    return {key: cpu_copy(value) for key, value in state.items()}
+  if isinstance(state, (list, tuple)):
+    return type(state)(cpu_copy(value) for value in state)
+  return state
+
+
+def rng_state():
+  state = {'torch': torch.get_rng_state(), 'python': random.getstate(), 'numpy': np.random.get_state()}
+  if torch.cuda.is_available():
+    state['cuda'] = torch.cuda.get_rng_state_all()
+  return state
+
+
+def set_rng_state(state):
+  torch.set_rng_state(state['torch'])
+  random.setstate(state['python'])
+  np.random.set_state(state['numpy'])
+  if 'cuda' in state and torch.cuda.is_available():
+    torch.cuda.set_rng_state_all(state['cuda'])
+
+
+class CheckpointManager:
+  """
+  Saves training checkpoints from a background thread. The state is copied to CPU memory when a save is
+  requested, so the file write overlaps the next epoch.
+  # Parameters
+  checkpoint_dir : `str`
+      Gets best_model.pt, the best weights with their scalers as served by the API, and resume/last_checkpoint.pt,
+      everything needed to resume: weights, optimizer, epoch, early-stopping counters and RNG state. It lives
+      in a subdirectory so a service reading checkpoint_dir as its model_dir never sees it.
+  """
+  def __init__(self, checkpoint_dir, scalers=None):
+    self.best_path = os.path.join(checkpoint_dir, 'best_model.pt')
+    self.last_path = os.path.join(checkpoint_dir, 'resume', 'last_checkpoint.pt')
+    os.makedirs(os.path.dirname(self.last_path), exist_ok=True)
+    self.scalers = scalers or {}
+    self.writer = ThreadPoolExecutor(max_workers=1)     # a single writer keeps the files in request order
+    self.pending = []
+
+  def submit(self, checkpoint, path):
+    for future in [future for future in self.pending if future.done()]:
+      future.result()                                   # raise write errors of earlier saves here
+      self.pending.remove(future)
+    self.pending.append(self.writer.submit(atomic_save, checkpoint, path))
+
+  def save_best(self, model_state_dict):
+    snapshot = cpu_copy(model_state_dict)
+    self.submit({'model_state_dict': snapshot, 'scalers': self.scalers}, self.best_path)
+    return snapshot
+
+  def save_last(self, model, optimizer, training_state, model_snapshot=None):
+    # model_snapshot: the CPU copy save_best just made of the same weights
+    model_snapshot = cpu_copy(model.state_dict()) if model_snapshot is None else model_snapshot
+    checkpoint = {'model_state_dict': model_snapshot, 'optimizer_state_dict': cpu_copy(optimizer.state_dict()),
+                  'training_state': copy.deepcopy(training_state), 'rng_state': rng_state(), 'scalers': self.scalers}
+    self.submit(checkpoint, self.last_path)
+
+  def resume(self, model, optimizer):
+    # loaded on the CPU for the RNG state, load_state_dict moves weights and optimizer state to the model's device
+    checkpoint = torch.load(self.last_path, map_location='cpu', weights_only=False)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+    set_rng_state(checkpoint['rng_state'])
+    best_state_dict, _ = load_checkpoint(self.best_path, 'cpu')
+    print(f"Resuming from {self.last_path} after epoch {checkpoint['training_state']['epoch'] - 1}")
+    return checkpoint['training_state'], best_state_dict
+
+  def wait(self):
+    for future in self.pending:
+      future.result()
+    self.pending = []
+
+  def close(self):
+    self.wait()
+    self.writer.shutdown()
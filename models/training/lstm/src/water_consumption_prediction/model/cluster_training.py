@@ -0,0 +1,130 @@
+import os
+import io
+import json
+import time
+import contextlib
+import numpy as np
+import pandas as pd
+import torch
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pydash import at
+from src.water_consumption_prediction.dataset.load_dataset import load_school_consumptions, school_windows, create_validation_test, create_dataloader
+from src.water_consumption_prediction.dataset.sliding_windows import build_windows
+from src.water_consumption_prediction.dataset.normalization_utilites import fit_scaler
+from src.water_consumption_prediction.model.create_model import create_model
+from src.water_consumption_prediction.model.train_model import train
+from src.water_consumption_prediction.model.checkpoint import CheckpointManager
+from src.water_consumption_prediction.model.evaluate_model import rmse_evaluation
+
+manifest_file = 'clusters.json'
+
+
+def cap_threads(threads):
+  # pool initializer: every process gets `threads` intra-op threads so concurrent trainings don't oversubscribe
+  for variable in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+    os.environ[variable] = str(threads)
+  torch.set_num_threads(threads)
+
+
+def read_cluster_assignment(path, cluster_column='cl'):
+  # clustered_df.csv of the gower clustering notebook: school id in the first column, cluster in `cluster_column`
+  clusters = pd.read_csv(path)
+  return dict(zip(clusters.iloc[:, 0].astype(int), clusters[cluster_column].astype(int)))
+
+
+def cluster_datasets(path_to_data, default_dict, assignment):
+  """
+  Windows every school once, like get_dataset, and splits them by cluster. Schools keep their own
+  train/validation/test split, schools without a cluster are left out.
+  # Returns
+  `dict` cluster -> {'schools': [...], 'sets': (X_train, y_train, X_valid, y_valid, X_test, y_test) as float32 arrays}
+  """
+  data_type, time_steps, horizon, val_ptg, test_ptg = at(default_dict, 'data_type', 'time_steps', 'horizon', 'val_ptg', 'test_ptg')
+  horizon = horizon or 1
+  school_consumptions = load_school_consumptions(path_to_data, default_dict)
+  values, targets, school_ids, school_targets = build_windows(school_consumptions, time_steps, data_type, horizon)
+
+  members = {}
+  for position, school_id in enumerate(school_ids):
+    if int(school_id) in assignment:
+      members.setdefault(assignment[int(school_id)], []).append(position)
+
+  datasets = {}
+  for cluster, positions in sorted(members.items()):
+    _, _, smashed_data_schools, smashed_data_targets = school_windows(values, targets, [school_targets[position] for position in positions], time_steps, horizon)
+    train_data, train_targets, test_data, test_targets, validation_data, validation_targets = create_validation_test(smashed_data_schools, smashed_data_targets, val_ptg, test_ptg)
+    window_shape = (0, time_steps, values.shape[-1])
+    sets = [np.stack(data) if data else np.empty(window_shape, dtype='float32') for data in (train_data, validation_data, test_data)]
+    labels = [np.asarray(data, dtype='float32').reshape(-1, horizon) for data in (train_targets, validation_targets, test_targets)]
+    datasets[cluster] = {'schools': [int(school_ids[position]) for position in positions],
+                         'sets': (sets[0], labels[0], sets[1], labels[1], sets[2], labels[2])}
+  return datasets
+
+
+def scale_sets(sets, default_dict):
+  # scalers are fitted on the cluster's own training windows and stored in its checkpoint
+  normalize_input, normalize_target, inp_norm_technique, targ_norm_technique = at(default_dict, 'normalize_input', 'normalize_target', 'input_normalization', 'target_normalization')
+  X_train, y_train, X_valid, y_valid, X_test, y_test = [torch.from_numpy(data) for data in sets]
+  scalers = {}
+  if normalize_input:
+    scalers['input'] = fit_scaler(X_train, inp_norm_technique)
+    X_train, X_valid, X_test = [scalers['input'].transform(data) for data in (X_train, X_valid, X_test)]
+  if normalize_target:
+    scalers['target'] = fit_scaler(y_train.reshape(-1, 1), targ_norm_technique)       # one factor for all days of the horizon
+    y_train, y_valid, y_test = [scalers['target'].transform(data) for data in (y_train, y_valid, y_test)]
+  return (X_train, y_train, X_valid, y_valid, X_test, y_test), scalers
+
+
+def train_cluster(cluster, sets, default_dict, rnn_dictionary, cluster_dir):
+  start = time.perf_counter()
+  device = torch.device('cpu')
+  time_steps, learning_rate, batch_size, epochs, early_stopping_epochs, loss_type, reduction, random_seed_number, resume = at(default_dict, 'time_steps', 'learning_rate', 'batch_size', 'epochs', 'early_stopping_epochs', 'loss_type', 'reduction', 'random_seed_number', 'resume')
+  torch.manual_seed(random_seed_number)
+  os.makedirs(cluster_dir, exist_ok=True)
+
+  with open(os.path.join(cluster_dir, 'train.log'), 'a') as log, contextlib.redirect_stdout(log):
+    (X_train, y_train, X_valid, y_valid, X_test, y_test), scalers = scale_sets(sets, default_dict)
+    rnn_model, optimizer, criterion = create_model(X_train.shape[-1], y_train.shape[-1], time_steps, learning_rate, loss_type, reduction, rnn_dictionary, device)
+    dataloaders = (create_dataloader(X_train, y_train, batch_size=batch_size, shuffle=True), create_dataloader(X_valid, y_valid, batch_size=batch_size, shuffle=True))
+    checkpoints = CheckpointManager(cluster_dir, {role: scaler.state_dict() for role, scaler in scalers.items()})
+    best_model, train_loss, validation_loss, _ = train(device, rnn_model, epochs, optimizer, criterion, dataloaders, early_stopping_epochs, rnn_dictionary['gradient_clipping'], checkpoints, resume)
+    checkpoints.close()
+
+    test_rmse = None
+    if len(X_test) > 0:
+      with torch.no_grad():
+        predictions = best_model(X_test, None, device)
+      if 'target' in scalers:
+        predictions, y_test = scalers['target'].inverse_transform(predictions), scalers['target'].inverse_transform(y_test)
+      test_rmse = rmse_evaluation(predictions, y_test).item()
+
+  return {'cluster': cluster, 'checkpoint': checkpoints.best_path, 'train_windows': len(X_train), 'epochs': len(validation_loss),
+          'validation_loss': min(validation_loss) if validation_loss else None, 'test_rmse': test_rmse, 'seconds': time.perf_counter() - start}
+
+
+def train_clusters(path_to_data, default_dict, rnn_dictionary, assignment, output_dir, workers, threads_per_worker):
+  """
+  Trains one RNN per cluster on a process pool, largest cluster first so the run takes about as long as
+  that cluster alone. Every cluster gets output_dir/cluster_<cl>/ with its checkpoints (weights and
+  scalers) and train.log; clusters.json maps schools to their cluster's checkpoint for the service.
+  """
+  with contextlib.redirect_stdout(io.StringIO()):
+    datasets = cluster_datasets(path_to_data, default_dict, assignment)
+  order = sorted(datasets, key=lambda cluster: -len(datasets[cluster]['sets'][0]))
+  for cluster in order:
+    print(f"Cluster {cluster}: {len(datasets[cluster]['schools'])} schools , {len(datasets[cluster]['sets'][0])} training windows")
+
+  results = {}
+  with ProcessPoolExecutor(max_workers=workers, initializer=cap_threads, initargs=(threads_per_worker,)) as pool:
+    futures = [pool.submit(train_cluster, cluster, datasets[cluster]['sets'], default_dict, rnn_dictionary, os.path.join(output_dir, f'cluster_{cluster}')) for cluster in order]
+    for future in as_completed(futures):
+      result = future.result()
+      results[result['cluster']] = result
+      print(f"Cluster {result['cluster']}: {result['epochs']} epochs in {result['seconds']:.1f}s , test RMSE {result['test_rmse']}")
+
+  manifest = {'models': {str(cluster): os.path.relpath(results[cluster]['checkpoint'], output_dir) for cluster in sorted(results)},
+              'assignment': {str(school): cluster for cluster in sorted(datasets) for school in datasets[cluster]['schools']},
+              'results': [results[cluster] for cluster in sorted(results)]}
+  with open(os.path.join(output_dir, manifest_file), 'w') as f:
+    json.dump(manifest, f, indent=2)
+  return results
@@ -28,12 +28,23 @@ def masked_flip(padded_sequence: torch.Tensor, sequence_lengths: List[int], max_
       sequences.append(flipped_padded_sequence[i, num_timesteps - length :])
     return torch.nn.utils.rnn.pad_sequence(sequences, batch_first=True,padding_value=1)
 
+def unpack(sequence):
+  # padded batch_first tensor and lengths of a PackedSequence; a dense fixed-length batch passes through
+  if isinstance(sequence, nn.utils.rnn.PackedSequence):
+    return nn.utils.rnn.pad_packed_sequence(sequence, batch_first=True)
+  return sequence, None
+
+def repack(sequence, lengths):
+  if lengths is None:
+    return sequence
+  return nn.utils.rnn.pack_padded_sequence(sequence, lengths, batch_first=True, enforce_sorted=False)
+
 class attention_layer(nn.Module):
   def __init__(self):
     super().__init__()
 
   def forward(self, hidden_n, lstm_outputs):
-    unpacked_output,len = nn.utils.rnn.pad_packed_sequence(lstm_outputs,batch_first=True)
+    unpacked_output,len = unpack(lstm_outputs)
     hidden_attention = torch.bmm(unpacked_output, hidden_n[...,None])
     hidden_attention = torch.squeeze(hidden_attention,dim=-1)
     softmax_module = nn.Softmax(dim = 1)
@@ -61,22 +72,23 @@ class gruRNN(nn.Module):
     sent_variable = input_data
     for i in range(self.num_layers):          # for each GRU
       if i != 0: 
-        sent_variable,len = nn.utils.rnn.pad_packed_sequence(sent_variable,batch_first=True)     # R ^ (B x T x * input)
+        sent_variable,len = unpack(sent_variable)     # R ^ (B x T x * input)
         if self.skip_connections:                             # save input for skip connection
           unpacked_skip = sent_variable                       
           hidden_skip = hidden_n
         sent_variable = nn.functional.dropout(sent_variable, p=self.dropout, training=True)     # dropout layer
-        sent_variable = nn.utils.rnn.pack_padded_sequence(sent_variable, len, batch_first=True, enforce_sorted=False)
+        sent_variable = repack(sent_variable, len)
 
-      hidden_0 = torch.zeros(1, input_shape, self.hidden_dimension).to(device)
+      hidden_0 = torch.zeros(1, input_shape, self.hidden_dimension, device=device)
 
-      self.gru_rnns[i].flatten_parameters()
+      if isinstance(self.gru_rnns[i], nn.RNNBase):        # dynamically quantized cells keep no flat weights
+        self.gru_rnns[i].flatten_parameters()
       gru_out,hidden_n = self.gru_rnns[i](sent_variable, hidden_0)
 
       if self.skip_connections==True and i != 0:
-        unpacked_gru_out,len = nn.utils.rnn.pad_packed_sequence(gru_out,batch_first=True)
+        unpacked_gru_out,len = unpack(gru_out)
         sent_variable = torch.add(unpacked_gru_out,unpacked_skip)
-        sent_variable = nn.utils.rnn.pack_padded_sequence(sent_variable,len,batch_first=True,enforce_sorted=False)
+        sent_variable = repack(sent_variable,len)
         if i == self.num_layers - 1:
           hidden_n = torch.add(hidden_n, hidden_skip)
       else:
@@ -103,23 +115,24 @@ class lstmRNN(nn.Module):
     sent_variable = padded_input
     for i in range(self.num_layers):
       if i != 0:
-        sent_variable,len = nn.utils.rnn.pad_packed_sequence(sent_variable,batch_first=True)
+        sent_variable,len = unpack(sent_variable)
         if self.skip_connections:
           unpacked_skip = sent_variable
           hidden_skip = hidden_n
         sent_variable = nn.functional.dropout(sent_variable, p=self.dropout, training=True)
-        sent_variable = nn.utils.rnn.pack_padded_sequence(sent_variable,len,batch_first=True,enforce_sorted=False)
+        sent_variable = repack(sent_variable,len)
 
-      hidden_0 = torch.zeros(1, input_shape, self.hidden_dimension).to(device)
-      cell_0 = torch.zeros(1, input_shape, self.hidden_dimension).to(device)
+      hidden_0 = torch.zeros(1, input_shape, self.hidden_dimension, device=device)
+      cell_0 = torch.zeros(1, input_shape, self.hidden_dimension, device=device)
 
-      self.lstm_rnns[i].flatten_parameters()
+      if isinstance(self.lstm_rnns[i], nn.RNNBase):        # dynamically quantized cells keep no flat weights
+        self.lstm_rnns[i].flatten_parameters()
       lstm_out,(hidden_n,cell_n) = self.lstm_rnns[i](sent_variable, (hidden_0, cell_0))
 
       if self.skip_connections==True and i != 0:
-        unpacked_lstm_out,len = nn.utils.rnn.pad_packed_sequence(lstm_out,batch_first=True)
+        unpacked_lstm_out,len = unpack(lstm_out)
         sent_variable = torch.add(unpacked_lstm_out,unpacked_skip)
-        sent_variable = nn.utils.rnn.pack_padded_sequence(sent_variable,len,batch_first=True,enforce_sorted=False)
+        sent_variable = repack(sent_variable,len)
         if i == self.num_layers - 1:
           hidden_n = torch.add(hidden_n, hidden_skip)
       else:
@@ -150,16 +163,22 @@ class RNN(nn.Module):
 
 
   def forward(self,input_vec,batch_len, device):
-
-    padded_input = nn.utils.rnn.pack_padded_sequence(input_vec, batch_len, batch_first=True, enforce_sorted=False)
+    # batch_len=None: every sequence has the full length, dense tensors go straight through the cells
+    if batch_len is None:
+      padded_input = input_vec
+    else:
+      padded_input = nn.utils.rnn.pack_padded_sequence(input_vec, batch_len, batch_first=True, enforce_sorted=False)
     rnn_out, hidden_n = self.cell(padded_input, input_vec.shape[0], device)
     hidden_n = torch.squeeze(hidden_n,dim=0)
     if self.attention:
       attention_out = self.attention_layer(hidden_n, rnn_out)
       hidden_n = torch.cat((attention_out, hidden_n), dim=1)
     if self.bidirectional:
-      flipped_input = masked_flip(input_vec, batch_len, self.max_seq_length)
-      flipped_padded_input = nn.utils.rnn.pack_padded_sequence(flipped_input,batch_len.cpu(),batch_first=True,enforce_sorted=False)
+      if batch_len is None:
+        flipped_padded_input = torch.flip(input_vec, [1])
+      else:
+        flipped_input = masked_flip(input_vec, batch_len, self.max_seq_length)
+        flipped_padded_input = nn.utils.rnn.pack_padded_sequence(flipped_input,batch_len.cpu(),batch_first=True,enforce_sorted=False)
       rnn_out_bi, hidden_n_bi = self.cell(flipped_padded_input, input_vec.shape[0], device)
       hidden_n_bi = torch.squeeze(hidden_n_bi,dim=0)
       if self.attention:
@@ -170,10 +189,14 @@ class RNN(nn.Module):
     return output
 
 
+def build_rnn(D_in, D_out, time_steps, rnn_dictionary, device):
+  model_type, is_bidirectional, skip_connections, hidden_size, num_layers, dropout_p, attention = at(rnn_dictionary, 'model_type', 'bidirectional', 'skip_connections', 'hidden_size', 'num_layers', 'dropout_p', 'attention')
+  return RNN(D_in, hidden_size, num_layers, dropout_p, is_bidirectional, D_out, time_steps, attention, model_type, skip_connections).to(device)
+
+
 def create_model(D_in, D_out, time_steps, learning_rate, loss_type, reduction, rnn_dictionary, device):
-  model_type, is_bidirectional, skip_connections, graddient_clipping, hidden_size, num_layers, dropout_p, attention = at(rnn_dictionary, 'model_type', 'bidirectional', 'skip_connections', 'gradient_clipping', 'hidden_size', 'num_layers', 'dropout_p', 'attention')
   #Initialize model, loss, optimizer
-  model = RNN(D_in, hidden_size, num_layers, dropout_p, is_bidirectional, D_out, time_steps, attention, model_type, skip_connections).to(device)
+  model = build_rnn(D_in, D_out, time_steps, rnn_dictionary, device)
   optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate, weight_decay=1e-5)
   print(loss_type)
   if loss_type == 'l1_norm':
@@ -1,5 +1,7 @@
 from src.water_consumption_prediction.model.train_model import calculate_loss
 from src.water_consumption_prediction.dataset.normalization_utilites import inverse_normalized_data 
+from src.water_consumption_prediction.model.checkpoint import load_checkpoint
+from src.water_consumption_prediction.utils.profiling import stage
 import matplotlib
 # matplotlib.use('Webagg')
 import matplotlib.pyplot as plt
@@ -8,9 +10,9 @@ import torch.nn as nn
 import numpy as np
 
 
-def load_model():
-  model = torch.load('../trained_models/best_model.pt')
-  return model
+def load_model(device='cpu'):
+  model_state_dict, scalers = load_checkpoint('../trained_models/best_model.pt', device)
+  return model_state_dict, scalers
   
 def plot_ground_truth_prediction(input_targets, target_predictions, device, logs_dir):
   fig,ax = plt.subplots()
@@ -43,14 +45,22 @@ def smape_evaluation(output, target):
     return  torch.mean(2 * (output - target).abs() / (output.abs() + target.abs() + 1e-8))
 
 
+def horizon_errors(output, target):
+  # RMSE and SMAPE of every forecast day, (windows x horizon) predictions and targets
+  return {'rmse': [rmse_evaluation(output[:, day], target[:, day]).item() for day in range(target.shape[-1])],
+          'smape': [smape_evaluation(output[:, day], target[:, day]).item() for day in range(target.shape[-1])]}
+
+
 def evaluation(model, criterion, input_data, input_targets, device, logs_dir, target_norm, norm_technique, data_type):
-  loss, _ , target_predictions = calculate_loss(model, device, criterion, (input_data.to(device), input_targets.to(device)))
+  with stage('evaluation.forward'):
+    loss, _ , target_predictions = calculate_loss(model, device, criterion, (input_data.to(device), input_targets.to(device)))
 
   # max_value = torch.max(input_targets)
   # eval_metric = (max_value - loss) / max_value
   if target_norm:
-    input_targets = inverse_normalized_data(input_targets, norm_technique, f'{data_type}_{norm_technique}_target_scaler')
-    target_predictions = inverse_normalized_data(target_predictions, norm_technique, f'{data_type}_{norm_technique}_target_scaler')
+    with stage('evaluation.inverse_scaling'):
+      input_targets = inverse_normalized_data(input_targets, norm_technique, f'{data_type}_{norm_technique}_target_scaler')
+      target_predictions = inverse_normalized_data(target_predictions, norm_technique, f'{data_type}_{norm_technique}_target_scaler')
   
   print(loss.item())
   rmse_evaluation(target_predictions.to(device), input_targets.to(device))
@@ -59,8 +69,12 @@ def evaluation(model, criterion, input_data, input_targets, device, logs_dir, ta
 
   print('Root mean squared error = ', rmse[0])
   print('Symmetric mean absolute percentage error = ', smape[0])
+  if input_targets.shape[-1] > 1:
+    day_errors = horizon_errors(target_predictions.to(device), input_targets.to(device))
+    print('Root mean squared error per horizon day = ', np.round(day_errors['rmse'], 4))
   with open(f"{logs_dir}rmse", "a") as f:
     np.savetxt(f, rmse)
 
   # print('Evaluation metric: ', eval_metric.item())
-  plot_ground_truth_prediction(input_targets, target_predictions, device, logs_dir)
\ No newline at end of file
+  with stage('evaluation.plot'):
+    plot_ground_truth_prediction(input_targets[:, 0], target_predictions[:, 0], device, logs_dir)
\ No newline at end of file
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import torch
+import torch.nn as nn
+import numpy as np
+from src.water_consumption_prediction.model.create_model import build_rnn
+from src.water_consumption_prediction.model.checkpoint import load_checkpoint
+from src.water_consumption_prediction.dataset.normalization_utilites import Scaler
+
+extensions = {'torchscript': '.torchscript', 'onnx': '.onnx'}
+scalers_key = 'scalers.json'
+horizon_key = 'horizon'             # days per forward pass, artifacts without it are one-step models
+
+
+def without_dropout(model):
+  # the cells apply their inter-layer dropout even in eval mode
+  for cell in [model.cell] + ([model.cell_bi] if model.bidirectional else []):
+    cell.dropout = 0.0
+  return model.eval()
+
+
+class InferenceModel(nn.Module):
+  """
+  The dense forward pass the forecast engine runs, `model(windows, None, device)`, as a module of the
+  windows alone so it can be traced. Dropout is switched off so the exported graph is deterministic.
+  """
+  def __init__(self, model):
+    super().__init__()
+    self.model = without_dropout(model)
+
+  def forward(self, windows):
+    return self.model(windows, None, torch.device('cpu'))
+
+
+def checkpoint_sizes(model_state_dict):
+  # D_in from the first cell's input weights, D_out from the output layer
+  first_weights = next(value for key, value in model_state_dict.items() if key.endswith('weight_ih_l0'))
+  return first_weights.shape[1], model_state_dict['output_layer.weight'].shape[0]
+
+
+def load_eager(checkpoint_path, time_steps, rnn_dictionary):
+  model_state_dict, scalers = load_checkpoint(checkpoint_path, torch.device('cpu'))
+  D_in, D_out = checkpoint_sizes(model_state_dict)
+  model = build_rnn(D_in, D_out, time_steps, rnn_dictionary, torch.device('cpu'))
+  model.load_state_dict(model_state_dict)
+  return InferenceModel(model), scalers
+
+
+def quantize(model):
+  # int8 weights for the LSTM/GRU cells and the output layer, activations are quantized per call
+  return torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.GRU, nn.Linear}, dtype=torch.qint8)
+
+
+def scalers_json(scalers):
+  states = {role: scaler.state_dict() for role, scaler in scalers.items()}
+  return json.dumps({role: {**state, 'a': state['a'].tolist(), 'b': state['b'].tolist()} for role, state in states.items()})
+
+
+def scalers_from_json(text):
+  return {role: Scaler.from_state_dict(state) for role, state in json.loads(text).items()} if text else {}
+
+
+def export_torchscript(model, example_windows, path, scalers):
+  with torch.no_grad():
+    traced = torch.jit.trace(model, example_windows, check_trace=False)
+    horizon = traced(example_windows).shape[-1]
+  torch.jit.save(traced, path + '.tmp', _extra_files={scalers_key: scalers_json(scalers), horizon_key: str(horizon)})
+  os.replace(path + '.tmp', path)
+
+
+def export_onnx(model, example_windows, path, scalers, quantized=False):
+  """
+  Exports the fp32 graph with a dynamic batch axis. `quantized` runs onnxruntime's dynamic int8
+  quantization over it, torch's quantized modules have no ONNX export.
+  """
+  import onnx
+  with torch.no_grad():
+    horizon = model(example_windows).shape[-1]
+  torch.onnx.export(model, (example_windows,), path + '.tmp', dynamo=False, input_names=['windows'], output_names=['prediction'],
+                    dynamic_axes={'windows': {0: 'batch'}, 'prediction': {0: 'batch'}})
+  if quantized:
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(path + '.tmp', path + '.tmp', weight_type=QuantType.QInt8)
+  graph = onnx.load(path + '.tmp')
+  onnx.helper.set_model_props(graph, {scalers_key: scalers_json(scalers), horizon_key: str(horizon)})
+  onnx.save(graph, path + '.tmp')
+  os.replace(path + '.tmp', path)
+
+
+class ExportedModel:
+  """
+  A TorchScript or ONNX artifact behind the eager model's call signature, so the forecast engine runs
+  it unchanged. Exports are traced for dense CPU windows: `batch_len` must be None.
+  """
+  def __init__(self, path, threads=None):
+    self.path = path
+    self.format = 'onnx' if path.endswith(extensions['onnx']) else 'torchscript'
+    if self.format == 'onnx':
+      import onnxruntime
+      options = onnxruntime.SessionOptions()
+      if threads:
+        options.intra_op_num_threads = threads
+      self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+      metadata = self.session.get_modelmeta().custom_metadata_map
+      self.scalers = scalers_from_json(metadata.get(scalers_key))
+      self.horizon = int(metadata.get(horizon_key) or 1)
+    else:
+      extra_files = {scalers_key: '', horizon_key: ''}
+      self.module = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+      self.module.eval()
+      self.scalers = scalers_from_json(extra_files[scalers_key])
+      self.horizon = int(extra_files[horizon_key] or 1)
+
+  def __call__(self, windows, batch_len=None, device=None):
+    if self.format == 'onnx':
+      prediction = self.session.run(None, {'windows': windows.detach().cpu().numpy()})[0]
+      output = torch.from_numpy(prediction)
+    else:
+      with torch.no_grad():
+        output = self.module(windows.cpu())
+    return output if device is None else output.to(device)
+
+  def eval(self):
+    return self
+
+
+def parity_check(reference, candidate, windows, batch_size=1024):
+  # largest absolute and relative difference of the predictions over `windows`
+  with torch.no_grad():
+    expected = torch.cat([reference(windows[start : start + batch_size]) for start in range(0, len(windows), batch_size)])
+    actual = torch.cat([candidate(windows[start : start + batch_size]) for start in range(0, len(windows), batch_size)])
+  max_abs = (expected - actual).abs().max().item()
+  return {'windows': len(windows), 'max_abs_error': max_abs, 'max_rel_error': max_abs / max(expected.abs().max().item(), 1e-12),
+          'rmse': torch.sqrt(((expected - actual) ** 2).mean()).item()}
+
+
+def benchmark(model, time_steps, D_in, batch_sizes, repeats=50):
+  """
+  Latency of one forward pass and windows per second at every batch size, after two warm-up calls.
+  """
+  results = []
+  for batch_size in batch_sizes:
+    windows = torch.randn(batch_size, time_steps, D_in)
+    with torch.no_grad():
+      for _ in range(2):
+        model(windows)
+      timings = []
+      for _ in range(repeats):
+        start = time.perf_counter()
+        model(windows)
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings)
+    results.append({'batch_size': batch_size, 'mean_ms': timings.mean() * 1000, 'p95_ms': np.percentile(timings, 95) * 1000,
+                    'windows_per_second': batch_size / timings.mean()})
+  return results
@@ -0,0 +1,153 @@
+import time
+import json
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from src.water_consumption_prediction.utils import profiling
+
+
+def digest(*parts):
+  sha = hashlib.sha1()
+  for part in parts:
+    sha.update(part if isinstance(part, bytes) else str(part).encode())
+  return sha.hexdigest()
+
+
+def meter_hash(history, time_steps):
+  # the forecast only depends on the dates and values of the last `time_steps` days
+  history = history.iloc[-time_steps:]
+  return digest(history['Date'].to_numpy(dtype='datetime64[ns]').tobytes(), history['Value'].to_numpy(dtype='float64').tobytes())
+
+
+def model_fingerprint(model_entry):
+  # versions restart at 1 with the service; the checkpoint path and the mtimes of its files do not
+  return digest(model_entry.path, json.dumps(sorted(model_entry.source_mtimes.items())))
+
+
+def scaler_fingerprint(model_entry):
+  factors = [scaler for scaler in (model_entry.input_scaler, model_entry.target_scaler) if scaler is not None]
+  return digest(*[part if isinstance(part, str) else part.cpu().numpy().tobytes() for scaler in factors for part in scaler])
+
+
+def cache_key(model_entry, history):
+  last_date = history.index.max().strftime('%Y-%m-%d')
+  return '|'.join([meter_hash(history, model_entry.forecaster.time_steps), last_date, model_entry.name, model_fingerprint(model_entry), scaler_fingerprint(model_entry)])
+
+
+class ForecastCache:
+  """
+  Forecasts by meter content, last observed day and model/scaler fingerprint, kept in LRU order until
+  they use more than `max_bytes` or are older than `ttl` seconds. One entry per key holds the longest
+  horizon forecast so far: shorter horizons are its prefix and longer ones resume from its last day.
+  # Parameters
+  db_path : `str`, optional
+      SQLite file of a second tier that outlives the process and is shared by its workers.
+  """
+  def __init__(self, max_bytes=64 << 20, ttl=3600.0, db_path=None):
+    self.max_bytes = max_bytes
+    self.ttl = ttl
+    self.entries = OrderedDict()                # key -> (created, predictions)
+    self.size = 0
+    self.lock = threading.Lock()
+    self.db = None
+    if db_path is not None:
+      self.db = sqlite3.connect(db_path, check_same_thread=False)
+      self.db.execute('CREATE TABLE IF NOT EXISTS forecasts (key TEXT PRIMARY KEY, created REAL, predictions BLOB)')
+      self.db.commit()
+
+  def expired(self, created):
+    return self.ttl > 0 and time.time() - created > self.ttl
+
+  def get(self, key):
+    with self.lock:
+      if key in self.entries:
+        created, predictions = self.entries[key]
+        if not self.expired(created):
+          self.entries.move_to_end(key)
+          return predictions, 'memory'
+        self.remove(key)
+      if self.db is None:
+        return None, None
+      row = self.db.execute('SELECT created, predictions FROM forecasts WHERE key = ?', (key,)).fetchone()
+    if row is None or self.expired(row[0]):
+      return None, None
+    predictions = np.frombuffer(row[1], dtype='float32')
+    self.put(key, predictions, row[0], write_through=False)
+    return predictions, 'disk'
+
+  def remove(self, key):
+    _, predictions = self.entries.pop(key)
+    self.size -= predictions.nbytes
+
+  def put(self, key, predictions, created=None, write_through=True):
+    created = time.time() if created is None else created
+    predictions = np.ascontiguousarray(predictions, dtype='float32')
+    with self.lock:
+      if key in self.entries:
+        if len(self.entries[key][1]) > len(predictions):     # a concurrent request already stored a longer horizon
+          return
+        self.remove(key)
+      self.entries[key] = (created, predictions)
+      self.size += predictions.nbytes
+      while self.size > self.max_bytes and len(self.entries) > 1:
+        self.remove(next(iter(self.entries)))
+        profiling.count('forecast_cache_evictions')
+      if self.db is not None and write_through:
+        self.db.execute('INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?)', (key, created, predictions.tobytes()))
+        self.db.commit()
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.size = 0
+      if self.db is not None:
+        self.db.execute('DELETE FROM forecasts')
+        self.db.commit()
+
+  def stats(self):
+    with self.lock:
+      stats = {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes, 'ttl': self.ttl}
+      if self.db is not None:
+        stats['disk_entries'] = self.db.execute('SELECT COUNT(*) FROM forecasts').fetchone()[0]
+    with profiling.lock:
+      counters = dict(profiling.counters)
+    stats['lookups'] = {'/'.join(value for _, value in labels): count for (name, labels), count in sorted(counters.items()) if name == 'forecast_cache_lookups'}
+    return stats
+
+
+def extend_history(history, prediction_period, predictions):
+  # the predicted days appended as observed ones, the forecasters read only Date and Value
+  predicted = pd.DataFrame({'Date': prediction_period, 'Value': predictions.astype('float64')}, index=prediction_period)
+  return pd.concat([history[['Date', 'Value']], predicted])
+
+
+def cached_forecast(cache, model_entry, history, num_predictions):
+  """
+  model_entry.forecaster.forecast(history, num_predictions) through `cache`. A cached forecast at least
+  as long is cut to `num_predictions` days; a shorter one is resumed from its last day, the same
+  recursion the uncached forecast runs, and replaced by the longer one. Direct multi-day models resume
+  from the last whole block of `forecaster.horizon` days, where the uncached forecast starts a pass too.
+  """
+  forecaster = model_entry.forecaster
+  key = cache_key(model_entry, history)
+  prediction_period = forecaster.prediction_period(history, num_predictions)
+  cached, tier = cache.get(key)
+  if cached is not None and len(cached) >= num_predictions:
+    profiling.count('forecast_cache_lookups', result='hit', tier=tier)
+    return prediction_period, cached[:num_predictions]
+
+  resumed_days = 0 if cached is None else len(cached) - len(cached) % forecaster.horizon
+  if resumed_days:
+    profiling.count('forecast_cache_lookups', result='resumed', tier=tier)
+    cached = cached[:resumed_days]
+    resumed_history = extend_history(history, prediction_period[:resumed_days], cached)
+    _, remaining = forecaster.forecast(resumed_history, num_predictions - resumed_days)
+    predictions = np.concatenate([cached, remaining])
+  else:
+    profiling.count('forecast_cache_lookups', result='miss')
+    _, predictions = forecaster.forecast(history, num_predictions)
+  cache.put(key, predictions)
+  return prediction_period, predictions
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import torch
+from src.water_consumption_prediction.dataset.calendar_features import create_features
+from src.water_consumption_prediction.dataset.normalization_utilites import rescale_with_factors, inverse_with_factors
+from src.water_consumption_prediction.utils.profiling import stage
+
+FEATURES = ['Date', 'Value', 'isCovid', 'isHoliday', 'isChristmas', 'isWeekday', 'isSummer']
+
+
+def factors_to(scaling_factors, device):
+  if scaling_factors is None:
+    return None
+  rescale_method, a_val, b_val = scaling_factors
+  return rescale_method, a_val.to(device), b_val.to(device)
+
+
+def column_factors(scaling_factors, column):
+  # z_score keeps one factor per feature, minmax a single factor for all of them
+  rescale_method, a_val, b_val = scaling_factors
+  if a_val.dim() > 0:
+    a_val, b_val = a_val[column], b_val[column]
+  return rescale_method, a_val, b_val
+
+
+class ForecastEngine:
+  """
+  Recursive multi-day forecast, equivalent to appending a day to the meter's DataFrame and rebuilding
+  its features for every step. Calendar features for the last `time_steps` observed days and the whole
+  horizon are built once into one preallocated, already scaled (meters x days x features) buffer; step k
+  reads the windows buffer[:, k : k + time_steps] as a view and writes the predictions into day
+  k + time_steps, so each step is one batched forward pass whatever the horizon or number of meters.
+  A direct model trained with --horizon H predicts H days per pass: steps advance H days at a time and
+  a forecast of at most H days is a single forward call.
+  """
+  def __init__(self, model, time_steps, input_scaler, target_scaler, device, horizon=1):
+    self.model = model
+    self.time_steps = time_steps
+    self.horizon = horizon                      # days per forward pass, the model's output size
+    self.device = device
+    self.input_scaler = factors_to(input_scaler, device)
+    self.value_scaler = column_factors(self.input_scaler, 0) if input_scaler is not None else None
+    self.target_scaler = factors_to(target_scaler, device)
+
+  def prediction_period(self, history, num_predictions):
+    end_date = history.index.max() + pd.DateOffset(days=1)
+    return pd.date_range(start=end_date, periods=num_predictions, freq='D')
+
+  def feature_buffer(self, histories, prediction_periods):
+    dates, values = [], []
+    for history, prediction_period in zip(histories, prediction_periods):
+      history = history.iloc[-self.time_steps:]
+      dates.extend([history['Date'].to_numpy(dtype='datetime64[ns]'), prediction_period.to_numpy(dtype='datetime64[ns]')])
+      values.extend([history['Value'].to_numpy(dtype='float64'), np.zeros(len(prediction_period))])
+    frame = create_features(pd.DataFrame({'Date': np.concatenate(dates), 'Value': np.concatenate(values)}))
+    buffer = torch.from_numpy(frame[FEATURES[1:]].to_numpy(dtype='float32')).to(self.device)
+    buffer = buffer.reshape(len(histories), -1, buffer.shape[-1])
+    if self.input_scaler is not None:
+      buffer = rescale_with_factors(buffer, self.input_scaler)
+    return buffer
+
+  def forecast_batch(self, histories, num_predictions):
+    for history in histories:
+      if len(history) < self.time_steps:
+        raise ValueError(f'Need at least {self.time_steps} valid days to forecast, got {len(history)}')
+    prediction_periods = [self.prediction_period(history, num_predictions) for history in histories]
+    with stage('forecast.features'):
+      buffer = self.feature_buffer(histories, prediction_periods)
+    with torch.no_grad(), stage('forecast.model'):
+      predictions = self.roll(buffer, num_predictions)
+    return prediction_periods, predictions.cpu().numpy()
+
+  def roll(self, buffer, num_predictions):
+    """
+    The forecast loop over a scaled (meters x time_steps + num_predictions x features) buffer whose
+    first `time_steps` days are observed; the Value column of the later days is overwritten.
+    # Returns
+    `torch.Tensor` (meters x num_predictions) unscaled predictions
+    """
+    predictions = torch.empty(len(buffer), num_predictions, device=self.device)
+    for step in range(0, num_predictions, self.horizon):
+      X = buffer[:, step : step + self.time_steps]
+      predicted_values = self.model(X, None, device=self.device).reshape(len(buffer), -1)[:, : num_predictions - step]
+      if self.target_scaler is not None:
+        predicted_values = inverse_with_factors(predicted_values, self.target_scaler)
+      predictions[:, step : step + predicted_values.shape[1]] = predicted_values
+      next_values = predicted_values.clamp(min=0)          # later windows see the predictions clipped like observed values
+      if self.value_scaler is not None:
+        next_values = rescale_with_factors(next_values, self.value_scaler)
+      buffer[:, step + self.time_steps : step + self.time_steps + predicted_values.shape[1], 0] = next_values
+    return predictions
+
+  def forecast(self, history, num_predictions):
+    prediction_periods, predictions = self.forecast_batch([history], num_predictions)
+    return prediction_periods[0], predictions[0]
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import threading
+import torch
+from pydash import at
+from src.water_consumption_prediction.model.create_model import build_rnn
+from src.water_consumption_prediction.model.forecast_engine import ForecastEngine
+from src.water_consumption_prediction.model.xgboost_forecast import XGBoostForecaster, load_booster
+from src.water_consumption_prediction.model.export_model import extensions, ExportedModel, checkpoint_sizes
+from src.water_consumption_prediction.model.checkpoint import load_checkpoint, is_model_checkpoint
+from src.water_consumption_prediction.dataset.normalization_utilites import load_scaling_factors
+from src.water_consumption_prediction.utils.profiling import stage
+
+
+class ModelEntry:
+  def __init__(self, name, version, path, model, input_scaler, target_scaler, forecaster, source_mtimes, load_seconds):
+    self.name = name
+    self.version = version
+    self.path = path
+    self.model = model
+    self.input_scaler = input_scaler            # (method, a, b) or None when inputs are not normalized
+    self.target_scaler = target_scaler
+    self.forecaster = forecaster
+    self.source_mtimes = source_mtimes
+    self.load_seconds = load_seconds
+    self.loaded_at = time.time()
+
+  def describe(self):
+    return {'name': self.name, 'version': self.version, 'path': self.path, 'load_seconds': round(self.load_seconds, 4), 'loaded_at': self.loaded_at}
+
+
+class ModelRegistry:
+  """
+  Keeps every checkpoint of a model directory loaded in eval mode, together with its scalers.
+  Each reload of a changed checkpoint becomes a new version of that name; the newest `max_versions`
+  versions stay loaded. Readers take a whole ModelEntry from `get`, so a request never sees a model
+  from one version and scalers from another.
+  """
+  def __init__(self, model_dir, D_in, D_out, default_dict, rnn_dictionary, device, max_versions=3, model_format='eager'):
+    self.model_dir = model_dir
+    self.model_format = model_format            # eager serves the .pt checkpoints, torchscript/onnx the exports of export_model.py
+    self.extension = extensions.get(model_format, '.pt')
+    self.D_in, self.D_out = D_in, D_out
+    self.default_dict = default_dict
+    self.rnn_dictionary = rnn_dictionary
+    self.device = device
+    self.max_versions = max_versions
+    self.models = {}                            # name -> {version: ModelEntry}
+    self.latest = {}                            # name -> newest version
+    self.cluster_models = {}                    # cluster_<cl> -> checkpoint path, from load_clusters
+    self.cluster_assignment = {}                # school id -> cluster_<cl>
+    self.xgboost_models = {}                    # name -> booster file, from load_xgboost
+    self.checkpoint_kinds = {}                  # .pt path -> (mtime, holds model weights), see is_servable
+    self.lock = threading.Lock()
+    self.watcher = None
+
+  def is_servable(self, path):
+    # resume checkpoints of older runs share the .pt extension; each file version is only opened once
+    if self.model_format != 'eager':
+      return True
+    mtime = os.path.getmtime(path)
+    if self.checkpoint_kinds.get(path, (None,))[0] != mtime:
+      try:
+        servable = is_model_checkpoint(path)
+      except Exception as error:             # checkpoints are replaced atomically, a new version gets a new mtime
+        print(f'Not serving {path}, it is not a readable checkpoint: {error}')
+        servable = False
+      self.checkpoint_kinds[path] = (mtime, servable)
+    return self.checkpoint_kinds[path][1]
+
+  def model_files(self):
+    files = [(file_name[:-len(self.extension)], os.path.join(self.model_dir, file_name)) for file_name in sorted(os.listdir(self.model_dir)) if file_name.endswith(self.extension)]
+    files = [(name, path) for name, path in files if self.is_servable(path)]
+    cluster_files = [(name, os.path.splitext(path)[0] + self.extension) for name, path in sorted(self.cluster_models.items())]
+    return files + cluster_files + sorted(self.xgboost_models.items())
+
+  def scaler_files(self):
+    data_type, normalize_input, normalize_target, inp_norm_technique, targ_norm_technique = at(self.default_dict, 'data_type', 'normalize_input', 'normalize_target', 'input_normalization', 'target_normalization')
+    input_file = f'{data_type}_{inp_norm_technique}_input_scaler' if normalize_input else None
+    target_file = f'{data_type}_{targ_norm_technique}_target_scaler' if normalize_target else None
+    return (inp_norm_technique, input_file), (targ_norm_technique, target_file)
+
+  def source_mtimes(self, path):
+    files = [path] if path in self.xgboost_models.values() else [path] + [scaler_file for _, scaler_file in self.scaler_files() if scaler_file is not None]
+    return {file_name: os.path.getmtime(file_name) for file_name in files if os.path.isfile(file_name)}
+
+  def load_entry(self, name, version, path):
+    start = time.perf_counter()
+    source_mtimes = self.source_mtimes(path)
+    if name in self.xgboost_models:
+      with stage('registry.load_booster'):
+        booster = load_booster(path)
+      return ModelEntry(name, version, path, booster, None, None, XGBoostForecaster(booster), source_mtimes, time.perf_counter() - start)
+    if self.model_format != 'eager':
+      with stage('registry.load_export'):
+        model = ExportedModel(path)
+      scalers, horizon = model.scalers, model.horizon
+    else:
+      with stage('registry.load_checkpoint'):
+        model_state_dict, scalers = load_checkpoint(path, self.device)
+      # direct multi-day checkpoints predict output_layer.out_features days per forward pass
+      horizon = checkpoint_sizes(model_state_dict)[1]
+      with stage('registry.build_model'):
+        model = build_rnn(self.D_in, horizon, self.default_dict['time_steps'], self.rnn_dictionary, self.device)
+        model.load_state_dict(model_state_dict)
+    model.eval()
+    if scalers:
+      input_scaler = scalers['input'].scaling_factors() if 'input' in scalers else None
+      target_scaler = scalers['target'].scaling_factors() if 'target' in scalers else None
+    else:
+      (inp_norm_technique, input_file), (targ_norm_technique, target_file) = self.scaler_files()
+      with stage('registry.load_scalers'):
+        input_scaler = load_scaling_factors(inp_norm_technique, input_file) if input_file else None
+        target_scaler = load_scaling_factors(targ_norm_technique, target_file) if target_file else None
+    forecaster = ForecastEngine(model, self.default_dict['time_steps'], input_scaler, target_scaler, self.device, horizon)
+    return ModelEntry(name, version, path, model, input_scaler, target_scaler, forecaster, source_mtimes, time.perf_counter() - start)
+
+  def register(self, name, path):
+    version = self.latest.get(name, 0) + 1
+    entry = self.load_entry(name, version, path)
+    with self.lock:
+      versions = dict(self.models.get(name, {}))
+      versions[version] = entry
+      for old_version in sorted(versions)[:-self.max_versions]:
+        del versions[old_version]
+      self.models[name] = versions
+      self.latest[name] = version
+    print(f'Loaded model {name} v{version} from {path} in {entry.load_seconds:.3f}s')
+    return entry
+
+  def load_directory(self):
+    # a checkpoint that fails to load is skipped so the others are still served; refresh tries it again
+    for name, path in self.model_files():
+      try:
+        self.register(name, path)
+      except Exception as error:
+        print(f'Could not load model {name} from {path}: {error}')
+
+  def load_clusters(self, cluster_dir):
+    # clusters.json of train_clusters.py: each cluster model is served as cluster_<cl>, or its export next to the checkpoint
+    with open(os.path.join(cluster_dir, 'clusters.json')) as f:
+      clusters = json.load(f)
+    self.cluster_models = {f'cluster_{cluster}': os.path.join(cluster_dir, path) for cluster, path in clusters['models'].items()}
+    self.cluster_assignment = {school: f'cluster_{cluster}' for school, cluster in clusters['assignment'].items()}
+    for name, path in sorted(self.cluster_models.items()):
+      try:
+        self.register(name, os.path.splitext(path)[0] + self.extension)
+      except Exception as error:
+        print(f'Could not load model {name} from {path}: {error}')
+
+  def load_xgboost(self, path, name='xgboost'):
+    # the booster is loaded once and served like the RNN checkpoints, reloaded when the file changes
+    self.xgboost_models[name] = path
+    self.register(name, path)
+
+  def model_for(self, school, default_name='best_model'):
+    # the model of the school's cluster, `default_name` for schools without one
+    return self.cluster_assignment.get(str(school), default_name)
+
+  def refresh(self):
+    # reload checkpoints whose file or scalers changed, and pick up new checkpoint files
+    for name, path in self.model_files():
+      current = self.get(name) if name in self.latest else None
+      if current is not None and current.source_mtimes == self.source_mtimes(path):
+        continue
+      try:
+        self.register(name, path)
+      except Exception as error:               # checkpoint still being written, keep serving the previous version
+        print(f'Could not reload model {name}: {error}')
+
+  def start_watcher(self, interval):
+    def watch():
+      while True:
+        time.sleep(interval)
+        self.refresh()
+    self.watcher = threading.Thread(target=watch, daemon=True)
+    self.watcher.start()
+
+  def get(self, name='best_model', version=None):
+    with self.lock:
+      if name not in self.models:
+        raise KeyError(f'Unknown model {name}')
+      versions = self.models[name]
+      if version is None:
+        version = self.latest[name]
+      elif not str(version).isdigit():
+        raise KeyError(f'Model {name} has no version {version}, versions are positive integers: {sorted(versions)}')
+      version = int(version)
+      if version not in versions:
+        raise KeyError(f'Model {name} has no loaded version {version}, available: {sorted(versions)}')
+      return versions[version]
+
+  def report(self):
+    with self.lock:
+      return {name: {'latest': self.latest[name], 'versions': [entry.describe() for entry in versions.values()]} for name, versions in self.models.items()}
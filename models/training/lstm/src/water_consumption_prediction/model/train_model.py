@@ -1,15 +1,70 @@
 import torch
 import copy
+import time
 import matplotlib.pyplot as plt
+from pydash import at
+from src.water_consumption_prediction.model.checkpoint import CheckpointManager
+from src.water_consumption_prediction.utils.profiling import stage, profile_step
 
 def calculate_loss(model, device, loss_function, batch):
   x_batch, y_batch = batch
-  batch_len = torch.Tensor([elem.shape[-2] for elem in x_batch]).int()
-  batch_raw_output = model(x_batch,batch_len, device)
+  batch_raw_output = model(x_batch, None, device).float()     # windows all have time_steps rows, no packing needed; float32 loss under autocast
   
   loss = torch.sqrt(loss_function(batch_raw_output, y_batch))
   return loss, y_batch, batch_raw_output
 
+def fast_epoch(model, device, loss_function, loader, optimizer=None, gradient_clipping=False, autocast=False):
+  # losses stay on the device, the caller reads them once per epoch
+  loss_sum = torch.zeros((), device=device)
+  batches, samples, raw_output = 0, 0, None
+  for x_batch, y_batch in loader:
+    x_batch, y_batch = x_batch.to(device, non_blocking=True), y_batch.to(device, non_blocking=True)
+    with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=autocast):
+      loss, _, raw_output = calculate_loss(model, device, loss_function, (x_batch, y_batch))
+    loss_sum += loss.detach()
+    batches, samples = batches + 1, samples + len(x_batch)
+    if optimizer is not None:
+      optimizer.zero_grad(set_to_none=True)
+      loss.backward()
+      if gradient_clipping:
+        torch.nn.utils.clip_grad_norm_(model.parameters(),2.0)
+      optimizer.step()
+      profile_step()
+  return loss_sum, batches, samples, raw_output
+
+def standard_epoch(model, device, loss_function, data_iterators, optimizer, gradient_clipping):
+  train_loader, validation_loader = data_iterators
+  model.train()
+  train_batch_losses = []
+  val_batch_losses = []
+  epoch_val_loss = 0
+
+  with stage('train.train_pass'):
+    for x_batch, y_batch in train_loader:
+      x_batch, y_batch = x_batch.to(device), y_batch.to(device)
+      loss, _, _  = calculate_loss(model, device, loss_function, (x_batch, y_batch))
+      train_batch_losses.append(loss.item())
+
+      optimizer.zero_grad()             #Delete previously stored gradients
+      loss.backward()                   #Perform backpropagation starting from the loss calculated in this epoch
+      if gradient_clipping:
+        torch.nn.utils.clip_grad_norm_(model.parameters(),2.0) #gradient clipping
+      optimizer.step()                  #Update model's weights based on the gradients calculated during backprop
+      profile_step()
+  
+  model.eval()
+  with torch.no_grad(), stage('train.validation_pass'):
+    for x_val_batch,y_val_batch in validation_loader:
+      x_val_batch, y_val_batch = x_val_batch.to(device), y_val_batch.to(device)
+
+      val_loss, val_actual_labels, val_raw_output = calculate_loss(model, device, loss_function, (x_val_batch, y_val_batch))
+      val_batch_losses.append(val_loss.item())
+      epoch_val_loss += val_loss
+  
+  epoch_train_loss = sum(train_batch_losses) / len(train_batch_losses)
+  epoch_val_loss = sum(val_batch_losses) / len(val_batch_losses)
+  return epoch_train_loss, epoch_val_loss, val_raw_output
+
 def print_metrics(epoch, batch_loss, val_loss):
   print(f"Epoch {epoch:3}: Loss = {batch_loss:.5f} , Validation Loss = {val_loss:.5f}")
 
@@ -19,41 +74,44 @@ def plot_learning_curves(train_loss, validation_loss, logs_dir):
     # plt.show()
     plt.savefig(f'{logs_dir}learning_curves.png')
 
-def train(device, model, epochs, optimizer, loss_function, data_iterators, patience, gradient_clipping):
+def train(device, model, epochs, optimizer, loss_function, data_iterators, patience, gradient_clipping, checkpoints=None, resume=False, fast_options=None):
+  """
+  # Parameters
+  fast_options : `dict`, optional
+      Runs the --fast epoch loop: losses accumulated on the device, `autocast_bf16` for bf16 autocast and
+      `compile` for a torch.compile'd forward pass. Checkpoints still hold the weights of `model`.
+  """
   train_loader, validation_loader = data_iterators
+  checkpoints = checkpoints or CheckpointManager('../trained_models/')
   previous_val_loss = float('inf')
   notimprovedtimes = 0                      # for early stopping
   validation_loss = []                      # list of storing validation loss of each epoch
   train_loss = []                           # list of storing train loss of each epoch
+  start_epoch, best_state_dict, val_raw_output = 0, None, None
 
-  for epoch in range(epochs):
-    model.train()
-    train_batch_losses = []
-    val_batch_losses = []
-    epoch_val_loss = 0
+  if resume:
+    training_state, best_state_dict = checkpoints.resume(model, optimizer)
+    start_epoch, previous_val_loss, notimprovedtimes, train_loss, validation_loss = at(training_state, 'epoch', 'previous_val_loss', 'notimprovedtimes', 'train_loss', 'validation_loss')
+    if training_state['stopped']:
+      start_epoch = epochs
 
-    for x_batch, y_batch in train_loader:
-      x_batch, y_batch = x_batch.to(device), y_batch.to(device)
-      loss, _, _  = calculate_loss(model, device, loss_function, (x_batch, y_batch))
-      train_batch_losses.append(loss.item())
+  if fast_options is not None:
+    autocast = fast_options.get('autocast_bf16', False)
+    forward_model = torch.compile(model) if fast_options.get('compile') else model
 
-      optimizer.zero_grad()             #Delete previously stored gradients
-      loss.backward()                   #Perform backpropagation starting from the loss calculated in this epoch
-      if gradient_clipping:
-        torch.nn.utils.clip_grad_norm_(model.parameters(),2.0) #gradient clipping
-      optimizer.step()                  #Update model's weights based on the gradients calculated during backprop
-    
-    model.eval()
-    with torch.no_grad():
-      for x_val_batch,y_val_batch in validation_loader:
-        x_val_batch, y_val_batch = x_val_batch.to(device), y_val_batch.to(device)
-
-        val_loss, val_actual_labels, val_raw_output = calculate_loss(model, device, loss_function, (x_val_batch, y_val_batch))
-        val_batch_losses.append(val_loss.item())
-        epoch_val_loss += val_loss
-    
-    epoch_train_loss = sum(train_batch_losses) / len(train_batch_losses)
-    epoch_val_loss = sum(val_batch_losses) / len(val_batch_losses)
+  for epoch in range(start_epoch, epochs):
+    if fast_options is not None:
+      epoch_start = time.perf_counter()
+      model.train()
+      with stage('train.train_pass'):
+        train_sum, train_batches, samples, _ = fast_epoch(forward_model, device, loss_function, train_loader, optimizer, gradient_clipping, autocast)
+      model.eval()
+      with torch.no_grad(), stage('train.validation_pass'):
+        val_sum, val_batches, _, val_raw_output = fast_epoch(forward_model, device, loss_function, validation_loader, autocast=autocast)
+      epoch_train_loss, epoch_val_loss = (torch.stack([train_sum, val_sum]) / torch.tensor([train_batches, val_batches], device=device)).tolist()
+      print(f"Epoch {epoch:3}: {samples / (time.perf_counter() - epoch_start):.0f} training samples/s")
+    else:
+      epoch_train_loss, epoch_val_loss, val_raw_output = standard_epoch(model, device, loss_function, data_iterators, optimizer, gradient_clipping)
 
     # Early stopping
     if epoch_val_loss > previous_val_loss:
@@ -62,10 +120,12 @@ def train(device, model, epochs, optimizer, loss_function, data_iterators, patie
         print("Earling stopping, patience=" + str(patience))
         
         print_metrics(epoch, epoch_train_loss, epoch_val_loss)
+        checkpoints.save_last(model, optimizer, {'epoch': epoch + 1, 'previous_val_loss': previous_val_loss, 'notimprovedtimes': notimprovedtimes,
+                                                 'train_loss': train_loss, 'validation_loss': validation_loss, 'stopped': True})
         break;
     else:
-      best_model = copy.deepcopy(model)  # save best model
-      torch.save(best_model.state_dict(), '../trained_models/best_model.pt')
+      with stage('train.checkpoint'):
+        best_state_dict = checkpoints.save_best(model.state_dict())  # save best model, written in the background
 
       # best_model_metrics = (epoch_val_loss, val_pred_labels, val_actual_labels)
       notimprovedtimes = 0
@@ -74,4 +134,13 @@ def train(device, model, epochs, optimizer, loss_function, data_iterators, patie
     train_loss.append(epoch_train_loss)
     validation_loss.append(epoch_val_loss)
     print_metrics(epoch,epoch_train_loss, epoch_val_loss)
+    with stage('train.checkpoint'):
+      checkpoints.save_last(model, optimizer, {'epoch': epoch + 1, 'previous_val_loss': previous_val_loss, 'notimprovedtimes': notimprovedtimes,
+                                               'train_loss': train_loss, 'validation_loss': validation_loss, 'stopped': False},
+                            best_state_dict if notimprovedtimes == 0 else None)
+
+  with stage('train.checkpoint_wait'):
+    checkpoints.wait()
+  best_model = copy.deepcopy(model)
+  best_model.load_state_dict(best_state_dict)
   return best_model, train_loss, validation_loss, val_raw_output
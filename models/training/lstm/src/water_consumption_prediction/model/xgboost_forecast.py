@@ -0,0 +1,80 @@
+import pickle
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from src.water_consumption_prediction.dataset.xgboost_features import xgboost_features
+from src.water_consumption_prediction.utils.profiling import stage
+
+# rolling windows of the notebook's create_features, in days
+windows = {'rolling_month': 30, 'rolling_3month': 90, 'rolling_week': 7}
+history_days = max(windows.values())
+
+
+def load_booster(path):
+  # the notebook pickles the fitted XGBRegressor (average_model.dat); native .json/.ubj boosters load directly
+  if path.endswith('.json') or path.endswith('.ubj'):
+    return xgb.Booster(model_file=path)
+  with open(path, 'rb') as f:
+    model = pickle.load(f)
+  return model.get_booster() if isinstance(model, xgb.XGBModel) else model
+
+
+class RollingWindows:
+  """
+  The last `history_days` values of every meter in a ring buffer, with running sums for each rolling
+  window. Appending a day updates every sum by the value entering and the value leaving the window,
+  so one step costs the same for a 7 day or a 365 day forecast.
+  """
+  def __init__(self, values):
+    self.buffer = np.array(values, dtype='float64')             # meters x history_days, oldest first
+    self.position = 0                                           # index of the oldest value
+    self.sums = {name: self.buffer[:, -days:].sum(axis=1) for name, days in windows.items()}
+    self.last = self.buffer[:, -1].copy()
+
+  def features(self):
+    columns = {name: self.sums[name] / days for name, days in windows.items()}
+    columns['shift1'] = self.last
+    return np.stack([columns[name] for name in xgboost_features], axis=1).astype('float32')
+
+  def push(self, values):
+    for name, days in windows.items():
+      self.sums[name] += values - self.buffer[:, (self.position - days) % history_days]
+    self.buffer[:, self.position] = values
+    self.position = (self.position + 1) % history_days
+    self.last = np.asarray(values, dtype='float64').copy()
+
+
+class XGBoostForecaster:
+  """
+  Recursive multi-day forecast with the averaged-consumption booster. The features of a forecast day
+  are the rolling means and the value of the days before it, the observed ones first and then the
+  predictions; every step predicts all meters of the batch with one DMatrix.
+  """
+  def __init__(self, booster):
+    self.booster = booster
+    self.time_steps = history_days           # forecast_meters checks histories against this
+    self.horizon = 1                         # one day per booster call
+
+  def prediction_period(self, history, num_predictions):
+    end_date = history.index.max() + pd.DateOffset(days=1)
+    return pd.date_range(start=end_date, periods=num_predictions, freq='D')
+
+  def forecast_batch(self, histories, num_predictions):
+    for history in histories:
+      if len(history) < history_days:
+        raise ValueError(f'Need at least {history_days} valid days to forecast, got {len(history)}')
+    prediction_periods = [self.prediction_period(history, num_predictions) for history in histories]
+    with stage('forecast.features'):
+      rolling = RollingWindows(np.stack([history['Value'].to_numpy(dtype='float64')[-history_days:] for history in histories]))
+    predictions = np.empty((len(histories), num_predictions), dtype='float32')
+
+    with stage('forecast.model'):
+      for step in range(num_predictions):
+        predicted_value = self.booster.predict(xgb.DMatrix(rolling.features(), feature_names=xgboost_features))
+        predictions[:, step] = predicted_value
+        rolling.push(predicted_value.astype('float64'))
+    return prediction_periods, predictions
+
+  def forecast(self, history, num_predictions):
+    prediction_periods, predictions = self.forecast_batch([history], num_predictions)
+    return prediction_periods[0], predictions[0]
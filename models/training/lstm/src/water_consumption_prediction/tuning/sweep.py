@@ -0,0 +1,66 @@
+import math
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.water_consumption_prediction.tuning.trials import init_worker, trial_runners
+
+# the 729 point grid of the "xgboost save model" notebook
+xgboost_grid = {'gamma': [0, 3, 6], 'max_depth': [5, 6, 7], 'eta': [0.03, 0.01, 0.001],
+                'min_child_weight': [1, 2, 4], 'subsample': [0.5, 0.7, 0.9], 'alpha': [0.01, 10, 100]}
+
+
+def expand_grid(space):
+  # trial ids are positions in this list, the same space always gives the same ids
+  names = sorted(space)
+  return [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+
+def rung_budgets(min_budget, max_budget, eta):
+  budgets = []
+  budget = min_budget
+  while budget < max_budget:
+    budgets.append(int(budget))
+    budget *= eta
+  return budgets + [max_budget]
+
+
+def check_space(space, model, known_options):
+  for name, values in space.items():
+    if not isinstance(values, list) or len(values) == 0:
+      raise ValueError(f'Search space entry {name} must be a non-empty list')
+    if model == 'rnn' and name not in known_options:
+      raise ValueError(f'{name} is not a collect_default_arguments/collect_rnn_arguments option')
+    if model == 'rnn' and name == 'epochs':
+      raise ValueError('epochs is the successive halving budget, set --min_budget/--max_budget instead')
+
+
+def run_sweep(store, study, model, space, context, budgets, eta, workers, threads_per_trial):
+  """
+  Successive halving over the grid of `space`: every configuration runs with budgets[0], the best
+  1/eta by validation RMSE move on to the next budget, until budgets[-1]. Finished trials are read back
+  from `store`, so a rerun of an interrupted sweep only runs what is missing.
+  # Parameters
+  context : `tuple`
+      What the pool processes need to run trials, see trials.init_worker.
+  """
+  configs = expand_grid(space)
+  survivors = list(range(len(configs)))
+  run_trial = trial_runners[model]
+  with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(threads_per_trial, context)) as pool:
+    for rung, budget in enumerate(budgets):
+      done = store.completed(study, rung)
+      pending = [trial for trial in survivors if trial not in done]
+      print(f'Rung {rung}: {len(survivors)} trials with budget {budget}, {len(survivors) - len(pending)} already done')
+      futures = [pool.submit(run_trial, trial, configs[trial], budget, rung) for trial in pending]
+      for future in as_completed(futures):
+        trial, rmse, seconds, error = future.result()
+        store.record(study, trial, rung, budget, configs[trial], rmse, seconds, error)
+        if error is not None:
+          print(f'Trial {trial} failed: {error}')
+
+      done = store.completed(study, rung)
+      survivors = sorted(survivors, key=lambda trial: done[trial])
+      if rung < len(budgets) - 1:
+        survivors = survivors[:max(1, math.floor(len(survivors) / eta))]
+
+  best = survivors[0]
+  return best, configs[best], done[best]
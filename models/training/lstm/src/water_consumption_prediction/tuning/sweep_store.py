@@ -0,0 +1,41 @@
+import json
+import time
+import sqlite3
+
+schema = """
+CREATE TABLE IF NOT EXISTS studies (name TEXT PRIMARY KEY, model TEXT, space TEXT, settings TEXT, created REAL);
+CREATE TABLE IF NOT EXISTS results (study TEXT, trial INTEGER, rung INTEGER, budget INTEGER, params TEXT, rmse REAL,
+                                    seconds REAL, error TEXT, finished REAL, PRIMARY KEY (study, trial, rung));
+"""
+
+
+class SweepStore:
+  """
+  Every finished (trial, rung) of a sweep in a local SQLite file. Rows are written as trials finish, so an
+  interrupted sweep resumes with the trials that have no row yet. Only the sweep's main process writes.
+  """
+  def __init__(self, path):
+    self.connection = sqlite3.connect(path)
+    self.connection.executescript(schema)
+
+  def open_study(self, name, model, space, settings):
+    row = self.connection.execute('SELECT model, space FROM studies WHERE name = ?', (name,)).fetchone()
+    if row is None:
+      with self.connection:
+        self.connection.execute('INSERT INTO studies VALUES (?, ?, ?, ?, ?)', (name, model, json.dumps(space, sort_keys=True), json.dumps(settings, sort_keys=True), time.time()))
+    elif row[0] != model or json.loads(row[1]) != json.loads(json.dumps(space, sort_keys=True)):
+      raise ValueError(f'Study {name} already exists with another model or search space')
+
+  def record(self, study, trial, rung, budget, params, rmse, seconds, error=None):
+    with self.connection:
+      self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (study, trial, rung, budget, json.dumps(params, sort_keys=True), rmse, seconds, error, time.time()))
+
+  def completed(self, study, rung):
+    rows = self.connection.execute('SELECT trial, rmse FROM results WHERE study = ? AND rung = ?', (study, rung))
+    return {trial: float('inf') if rmse is None else rmse for trial, rmse in rows}
+
+  def results(self, study):
+    rows = self.connection.execute('SELECT trial, rung, budget, params, rmse, seconds, error FROM results WHERE study = ? ORDER BY rung DESC, rmse', (study,))
+    return [{'trial': trial, 'rung': rung, 'budget': budget, 'params': json.loads(params), 'rmse': rmse, 'seconds': seconds, 'error': error}
+            for trial, rung, budget, params, rmse, seconds, error in rows]
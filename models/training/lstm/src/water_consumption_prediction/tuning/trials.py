@@ -0,0 +1,121 @@
+import os
+import io
+import math
+import time
+import json
+import contextlib
+import torch
+import pandas as pd
+import xgboost as xgb
+from pydash import at
+from src.water_consumption_prediction.dataset.load_dataset import get_dataset, create_dataloader
+from src.water_consumption_prediction.dataset.window_cache import cache_settings
+from src.water_consumption_prediction.dataset.xgboost_features import xgboost_datasets
+from src.water_consumption_prediction.dataset import normalization_utilites
+from src.water_consumption_prediction.model.create_model import create_model
+from src.water_consumption_prediction.model.train_model import train
+from src.water_consumption_prediction.model.checkpoint import CheckpointManager, load_checkpoint
+from src.water_consumption_prediction.model.cluster_training import cap_threads
+
+# settings that change the windows or their scaling, trials sharing them share one loaded dataset
+dataset_settings = cache_settings + ['normalize_input', 'normalize_target', 'input_normalization', 'target_normalization', 'lazy_windows']
+worker_state = {}
+
+
+def init_worker(threads, context):
+  # runs once in every pool process; trials share the process' threads and loaded data
+  cap_threads(threads)
+  worker_state.update({'threads': threads, 'context': context, 'datasets': {}})
+
+
+def split_params(params, default_dict, rnn_dictionary):
+  default_dict, rnn_dictionary = dict(default_dict), dict(rnn_dictionary)
+  for name, value in params.items():
+    (rnn_dictionary if name in rnn_dictionary else default_dict)[name] = value
+  return default_dict, rnn_dictionary
+
+
+def rnn_dataset(default_dict):
+  key = json.dumps(at(default_dict, *dataset_settings))
+  datasets = worker_state['datasets']
+  if key not in datasets:
+    datasets.clear()
+    normalization_utilites.fitted_scalers.clear()      # scalers are fitted on the first dataset of a process
+    with contextlib.redirect_stdout(io.StringIO()):
+      datasets[key] = (get_dataset(default_dict['data_dir'], dict(default_dict, create_data=False)), normalization_utilites.checkpoint_scalers(default_dict))
+  return datasets[key]
+
+
+def validation_rmse(model, input_data, input_targets, batch_size, target_scaler=None):
+  # RMSE in consumption units, so trials with different loss types and target scalings rank on the same scale
+  model.eval()
+  squared_error, count = 0.0, 0
+  with torch.no_grad():
+    for x_batch, y_batch in create_dataloader(input_data, input_targets, batch_size=batch_size, shuffle=False):
+      output = model(x_batch, None, torch.device('cpu')).float()
+      if target_scaler is not None:
+        output, y_batch = target_scaler.inverse_transform(output), target_scaler.inverse_transform(y_batch)
+      squared_error += ((output - y_batch) ** 2).sum().item()
+      count += y_batch.numel()
+  return math.sqrt(squared_error / count)
+
+
+def run_rnn_trial(trial, params, budget, rung):
+  """
+  Trains one RNN configuration up to `budget` epochs. Later rungs resume the trial's resume/last_checkpoint.pt,
+  so a promoted trial only trains the extra epochs. Returns the validation RMSE of the best weights in the
+  units of the readings, the targets and predictions scaled back with the trial's target scaler.
+  """
+  start = time.perf_counter()
+  default_dict, rnn_dictionary, sweep_dir = worker_state['context']
+  default_dict, rnn_dictionary = split_params(params, default_dict, rnn_dictionary)
+  trial_dir = os.path.join(sweep_dir, f'trial_{trial}')
+  os.makedirs(trial_dir, exist_ok=True)
+  try:
+    (X_train, y_train, X_valid, y_valid, X_test, y_test), scalers = rnn_dataset(default_dict)
+    time_steps, learning_rate, batch_size, early_stopping_epochs, loss_type, reduction, gradient_clipping, random_seed_number = at(default_dict, 'time_steps', 'learning_rate', 'batch_size', 'early_stopping_epochs', 'loss_type', 'reduction', 'gradient_clipping', 'random_seed_number')
+    torch.manual_seed(random_seed_number)
+    dataloaders = (create_dataloader(X_train, y_train, batch_size=batch_size, shuffle=True), create_dataloader(X_valid, y_valid, batch_size=batch_size, shuffle=True))
+    checkpoints = CheckpointManager(trial_dir, scalers)
+    resume = os.path.isfile(checkpoints.last_path)
+    with open(os.path.join(trial_dir, 'train.log'), 'a') as log, contextlib.redirect_stdout(log):
+      rnn_model, optimizer, criterion = create_model(X_train.shape[-1], y_train.shape[-1], time_steps, learning_rate, loss_type, reduction, rnn_dictionary, torch.device('cpu'))
+      train(torch.device('cpu'), rnn_model, budget, optimizer, criterion, dataloaders, early_stopping_epochs, gradient_clipping, checkpoints, resume)
+    checkpoints.close()
+    best_state_dict, _ = load_checkpoint(checkpoints.best_path, 'cpu')
+    rnn_model.load_state_dict(best_state_dict)
+    target_scaler = normalization_utilites.Scaler.from_state_dict(scalers['target']) if 'target' in scalers else None
+    return trial, validation_rmse(rnn_model, X_valid, y_valid, batch_size, target_scaler), time.perf_counter() - start, None
+  except Exception as error:
+    return trial, None, time.perf_counter() - start, repr(error)
+
+
+def xgboost_params(params, threads):
+  # the notebook's XGBRegressor settings with its grid names mapped to the native ones
+  return {'booster': 'gbtree', 'objective': 'reg:squarederror', 'eval_metric': 'rmse', 'seed': 123, 'nthread': threads,
+          'gamma': params.get('gamma', 0), 'max_depth': params.get('max_depth', 6), 'eta': params.get('eta', 0.3),
+          'min_child_weight': params.get('min_child_weight', 1), 'subsample': params.get('subsample', 1.0), 'alpha': params.get('alpha', 0)}
+
+
+def xgboost_matrices():
+  if 'matrices' not in worker_state:
+    concat_path, val_ptg, split_date = worker_state['context']
+    (X_train, y_train), (X_valid, y_valid), _ = xgboost_datasets(pd.read_csv(concat_path), val_ptg, split_date)
+    worker_state['matrices'] = (xgb.DMatrix(X_train, label=y_train), xgb.DMatrix(X_valid, label=y_valid))
+  return worker_state['matrices']
+
+
+def run_xgboost_trial(trial, params, budget, rung):
+  # budget is the number of boosting rounds; trees are cheap to regrow so every rung trains from scratch
+  start = time.perf_counter()
+  try:
+    train_matrix, validation_matrix = xgboost_matrices()
+    evaluations = {}
+    xgb.train(xgboost_params(params, worker_state['threads']), train_matrix, num_boost_round=budget, evals=[(validation_matrix, 'validation')],
+              early_stopping_rounds=10, evals_result=evaluations, verbose_eval=False)
+    return trial, min(evaluations['validation']['rmse']), time.perf_counter() - start, None
+  except Exception as error:
+    return trial, None, time.perf_counter() - start, repr(error)
+
+
+trial_runners = {'rnn': run_rnn_trial, 'xgboost': run_xgboost_trial}
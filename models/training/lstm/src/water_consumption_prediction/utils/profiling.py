@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextlib
+import torch
+
+stage_timings = {}              # stage -> [calls, total seconds, longest call]
+counters = {}                   # (name, labels) -> value
+histograms = {}                 # (name, labels) -> Histogram
+lock = threading.Lock()
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+active_profiler = None
+
+
+@contextlib.contextmanager
+def stage(name):
+  # a perf_counter pair and a dict update, cheap enough for per-request and per-epoch stages
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    record_stage(name, time.perf_counter() - start)
+
+
+def record_stage(name, seconds):
+  with lock:
+    timing = stage_timings.setdefault(name, [0, 0.0, 0.0])
+    timing[0] += 1
+    timing[1] += seconds
+    timing[2] = max(timing[2], seconds)
+
+
+def count(name, amount=1, **labels):
+  key = (name, tuple(sorted(labels.items())))
+  with lock:
+    counters[key] = counters.get(key, 0) + amount
+
+
+class Histogram:
+  def __init__(self, buckets):
+    self.buckets = buckets
+    self.bucket_counts = [0] * (len(buckets) + 1)       # the last one is +Inf
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+
+def observe(name, value, buckets=latency_buckets, **labels):
+  key = (name, tuple(sorted(labels.items())))
+  with lock:
+    if key not in histograms:
+      histograms[key] = Histogram(buckets)
+    histograms[key].observe(value)
+
+
+def reset():
+  with lock:
+    stage_timings.clear()
+    counters.clear()
+    histograms.clear()
+
+
+def timing_report():
+  with lock:
+    timings = sorted(stage_timings.items(), key=lambda item: -item[1][1])
+  return [{'stage': name, 'calls': calls, 'total_seconds': total, 'mean_seconds': total / calls, 'max_seconds': longest} for name, (calls, total, longest) in timings]
+
+
+def write_timing_report(logs_dir, run_name):
+  report = timing_report()
+  with open(os.path.join(logs_dir, f'timing_report_{run_name}.json'), 'w') as f:
+    json.dump({'run': run_name, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'stages': report}, f, indent=2)
+  print(f"{'stage':32} {'calls':>7} {'total s':>10} {'mean ms':>10} {'max ms':>10}")
+  for row in report:
+    print(f"{row['stage']:32} {row['calls']:7} {row['total_seconds']:10.3f} {row['mean_seconds'] * 1000:10.2f} {row['max_seconds'] * 1000:10.2f}")
+
+
+def label_text(labels, extra=()):
+  labels = list(labels) + list(extra)
+  if not labels:
+    return ''
+  return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def prometheus_text(prefix='hydroforecast'):
+  # the Prometheus text exposition format: stages as summaries, counters, and histograms with cumulative buckets
+  with lock:
+    timings = dict(stage_timings)
+    counter_values = dict(counters)
+    histogram_values = {key: (histogram.buckets, list(histogram.bucket_counts), histogram.sum, histogram.count) for key, histogram in histograms.items()}
+
+  lines = [f'# HELP {prefix}_stage_seconds Time spent in each instrumented stage', f'# TYPE {prefix}_stage_seconds summary']
+  for name, (calls, total, _) in sorted(timings.items()):
+    lines.append(f'{prefix}_stage_seconds_sum{label_text([("stage", name)])} {total}')
+    lines.append(f'{prefix}_stage_seconds_count{label_text([("stage", name)])} {calls}')
+
+  for name in sorted({name for name, _ in counter_values}):
+    lines.append(f'# TYPE {prefix}_{name}_total counter')
+    for (counter_name, labels), value in sorted(counter_values.items()):
+      if counter_name == name:
+        lines.append(f'{prefix}_{name}_total{label_text(labels)} {value}')
+
+  for name in sorted({name for name, _ in histogram_values}):
+    lines.append(f'# TYPE {prefix}_{name} histogram')
+    for (histogram_name, labels), (buckets, bucket_counts, total, calls) in sorted(histogram_values.items()):
+      if histogram_name != name:
+        continue
+      cumulative = 0
+      for bound, bucket_count in zip(list(buckets) + ['+Inf'], bucket_counts):
+        cumulative += bucket_count
+        lines.append(f'{prefix}_{name}_bucket{label_text(labels, [("le", bound)])} {cumulative}')
+      lines.append(f'{prefix}_{name}_sum{label_text(labels)} {total}')
+      lines.append(f'{prefix}_{name}_count{label_text(labels)} {calls}')
+  return '\n'.join(lines) + '\n'
+
+
+class BatchProfiler:
+  """
+  torch.profiler over the first `num_batches` training batches after one warm-up batch. The chrome trace
+  and the operator table are written to `logs_dir` and the profiler stops, so later batches run unprofiled.
+  """
+  def __init__(self, num_batches, logs_dir):
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+      activities.append(torch.profiler.ProfilerActivity.CUDA)
+    self.logs_dir = logs_dir
+    self.remaining = num_batches + 1
+    self.profiler = torch.profiler.profile(activities=activities, record_shapes=True, schedule=torch.profiler.schedule(wait=0, warmup=1, active=num_batches, repeat=1),
+                                           on_trace_ready=self.write)
+    self.profiler.start()
+
+  def write(self, profiler):
+    profiler.export_chrome_trace(os.path.join(self.logs_dir, 'torch_trace.json'))
+    with open(os.path.join(self.logs_dir, 'torch_profile.txt'), 'w') as f:
+      f.write(profiler.key_averages().table(sort_by='self_cpu_time_total', row_limit=40))
+
+  def step(self):
+    self.profiler.step()
+    self.remaining -= 1
+    return self.remaining > 0
+
+  def stop(self):
+    self.profiler.stop()
+
+
+def start_torch_profiler(num_batches, logs_dir):
+  global active_profiler
+  if num_batches > 0:
+    active_profiler = BatchProfiler(num_batches, logs_dir)
+
+
+def profile_step():
+  # called after every training batch; a no-op unless start_torch_profiler is running
+  global active_profiler
+  if active_profiler is not None and not active_profiler.step():
+    active_profiler.stop()
+    active_profiler = None
@@ -17,6 +17,7 @@ def collect_default_arguments(parser):
     parser.add_argument("--logs_dir", default='../logs/')
     parser.add_argument("--create_data", action='store_true')
     parser.add_argument("--time_steps", type=int, help='number of timesteps of the training vectors', default=6)
+    parser.add_argument("--horizon", type=int, help='days predicted at once by each window, 1 trains the recursive one-step model', default=1)
     parser.add_argument("--batch_size", type=int, default=128)
     parser.add_argument("--epochs", type=int, default=100)
     parser.add_argument("--early_stopping_epochs", type=int, default=7)
@@ -32,6 +33,16 @@ def collect_default_arguments(parser):
     parser.add_argument("--random_seed", type=int, default=17)
     parser.add_argument("--include_students", action='store_true')
     parser.add_argument('--extra_column', action='store_true')
+    parser.add_argument('--lazy_windows', action='store_true', help='Slice training windows on demand instead of storing time_steps copies of every row')
+    parser.add_argument("--checkpoint_dir", help='Directory for best_model.pt and resume/last_checkpoint.pt', default='../trained_models/')
+    parser.add_argument('--resume', action='store_true', help='Continue training from resume/last_checkpoint.pt in checkpoint_dir')
+    parser.add_argument('--fast', action='store_true', help='Accumulate losses on the device and report samples/s, see the options below')
+    parser.add_argument("--num_workers", type=int, help='DataLoader worker processes in --fast mode', default=0)
+    parser.add_argument('--pin_memory', action='store_true', help='Pin DataLoader batches in --fast mode')
+    parser.add_argument("--validation_batch_size", type=int, help='Validation batch size in --fast mode, batch_size when not given; the validation loss averages per-batch RMSE, so another size shifts the curve')
+    parser.add_argument('--autocast_bf16', action='store_true', help='bf16 autocast in --fast mode')
+    parser.add_argument('--compile', action='store_true', help='torch.compile the RNN in --fast mode')
+    parser.add_argument("--torch_profile_batches", type=int, help='Run the torch profiler over this many training batches, traces go to logs_dir', default=0)
 
 
 def collect_rnn_arguments(parser):
@@ -43,4 +54,17 @@ def collect_rnn_arguments(parser):
     rnn_group.add_argument('--skip_connections', action='store_true')
     rnn_group.add_argument('--gradient_clipping', action='store_true')
     rnn_group.add_argument('--dropout_p', type=float, default=0.0)
-    rnn_group.add_argument('--attention', action='store_true')
\ No newline at end of file
+    rnn_group.add_argument('--attention', action='store_true')
+
+
+def collect_serving_arguments(parser):
+    serving_group = parser.add_argument_group('Serving group', 'Arguments group for the prediction service')
+    serving_group.add_argument("--model_dir", help='Directory with the checkpoints to serve', default='../trained_models/')
+    serving_group.add_argument("--reload_interval", type=float, help='seconds between checks for new checkpoints, 0 disables reloading', default=10.0)
+    serving_group.add_argument("--meter_data_root", help='Root of the server-side meter directories /predict_batch may read', default='../data/')
+    serving_group.add_argument("--cluster_dir", help='Output directory of train_clusters.py, meters are routed to their cluster model')
+    serving_group.add_argument("--xgboost_model", help='XGBoost model served for model_type=xgboost, the pickled average_model.dat of the notebook or a native booster file')
+    serving_group.add_argument("--model_format", choices=['eager', 'torchscript', 'onnx'], help='serve the .pt checkpoints, or their .torchscript/.onnx exports from export_model.py', default='eager')
+    serving_group.add_argument("--forecast_cache_bytes", type=int, help='memory for cached /predict forecasts, 0 disables the cache', default=64 << 20)
+    serving_group.add_argument("--forecast_cache_ttl", type=float, help='seconds a cached forecast is served, 0 keeps it until evicted', default=3600.0)
+    serving_group.add_argument("--forecast_cache_db", help='SQLite file of a second cache tier shared by the service processes')
\ No newline at end of file